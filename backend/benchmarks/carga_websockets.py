@@ -0,0 +1,333 @@
+# /backend/benchmarks/carga_websockets.py
+"""
+Prueba de carga del juego en vivo por websocket (routes/websockets.py y
+ConnectionManager).
+
+Arranca la app en un subproceso con uvicorn y una base de datos en memoria (sin
+MongoDB ni Stockfish: el juego en vivo no usa el motor) y abre N clientes
+simulados. Cada uno pide partida con find_match, juega una apertura fija con
+mensajes move, escribe en el chat, hace ping y al final abandona. Informa de
+la latencia ida y vuelta de las jugadas (percentiles), mensajes por segundo y
+memoria del servidor.
+
+Uso (desde backend/):
+    python -m benchmarks.carga_websockets --clientes 2000
+    python -m benchmarks.carga_websockets --clientes 2000 --protocolo binary
+
+Con miles de clientes puede hacer falta subir el límite de descriptores
+(ulimit -n) en la máquina que lo ejecuta.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from types import SimpleNamespace
+import websockets
+import chess
+from utils.auth import create_access_token
+from utils.protocolo_binario import codificar_mover, decodificar_jugada, TRAMA_JUGADA
+
+# Ruy López cerrada: 20 plies legales que juegan todas las parejas
+APERTURA = ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6", "b5a4", "g8f6", "e1g1", "f8e7",
+            "f1e1", "b7b5", "a4b3", "d7d6", "c2c3", "e8g8", "h2h3", "c6b8", "d2d4", "b8d7"]
+
+
+# --- Servidor ---------------------------------------------------------------
+
+class _Cursor:
+    def __init__(self, documentos):
+        self._documentos = documentos
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, cantidad):
+        return self
+
+    async def to_list(self, cantidad):
+        return list(self._documentos)
+
+class _ColeccionMemoria:
+    """Lo justo de una colección de motor para el camino del juego en vivo"""
+
+    def __init__(self):
+        self.escrituras = 0
+
+    async def find_one(self, *args, **kwargs):
+        return None
+
+    def find(self, *args, **kwargs):
+        return _Cursor([])
+
+    async def insert_one(self, documento):
+        self.escrituras += 1
+
+    async def update_one(self, *args, **kwargs):
+        self.escrituras += 1
+
+    async def bulk_write(self, operaciones, ordered=True):
+        self.escrituras += len(operaciones)
+        # Nada queda guardado, así que todo upsert cuenta como inserción
+        return SimpleNamespace(upserted_ids={
+            indice: None for indice, operacion in enumerate(operaciones) if getattr(operacion, "_upsert", False)
+        })
+
+class _BaseMemoria:
+    def __init__(self):
+        self._colecciones = {}
+        self.client = self
+
+    def __getattr__(self, nombre):
+        if nombre.startswith("_"):
+            raise AttributeError(nombre)
+        return self._colecciones.setdefault(nombre, _ColeccionMemoria())
+
+    def __getitem__(self, nombre):
+        return getattr(self, nombre)
+
+    def close(self):
+        pass
+
+class _ClienteMemoria:
+    def __init__(self, *args, **kwargs):
+        self._base = _BaseMemoria()
+
+    def __getitem__(self, nombre):
+        return self._base
+
+def servir(port: int):
+    """Modo servidor (lo lanza el propio harness en un subproceso)"""
+    import uvicorn
+    import main
+
+    main.AsyncIOMotorClient = _ClienteMemoria
+    main.app.router.on_startup.remove(main.startup_stockfish_pool)
+    main.app.router.on_shutdown.remove(main.shutdown_stockfish_pool)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", ws_max_queue=1024)
+
+
+# --- Clientes ---------------------------------------------------------------
+
+class Resultados:
+    def __init__(self):
+        self.latencias: list[float] = []
+        self.enviados = 0
+        self.recibidos = 0
+        self.partidas = 0
+        self.errores = 0
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _memoria_servidor(pid: int) -> int:
+    """RSS del servidor en KB (Linux); 0 si no se puede leer"""
+    try:
+        with open(f"/proc/{pid}/status") as estado:
+            for linea in estado:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return 0
+
+class ClienteSimulado:
+    def __init__(self, url: str, username: str, binario: bool, resultados: Resultados, chat_cada: int):
+        self.username = username
+        self.url = f"{url}/ws/{create_access_token({'username': username})}"
+        if binario:
+            self.url += "?protocol=binary"
+        self.binario = binario
+        self.resultados = resultados
+        self.chat_cada = chat_cada
+        self.game_id = None
+        self.color = None
+        self.ply = 0
+        self.enviada_en = None
+
+    async def _enviar(self, ws, mensaje):
+        await ws.send(mensaje)
+        self.resultados.enviados += 1
+
+    async def _mover(self, ws):
+        """Envía la jugada que le toca de la apertura y apunta cuándo"""
+        uci = APERTURA[self.ply]
+        if self.binario:
+            mensaje = codificar_mover(self.game_id, chess.Move.from_uci(uci))
+        else:
+            mensaje = json.dumps({"type": "move", "game_id": self.game_id,
+                                  "move": {"from_square": uci[:2], "to_square": uci[2:4]}})
+        self.enviada_en = time.perf_counter()
+        await self._enviar(ws, mensaje)
+        if self.ply % self.chat_cada == 0:
+            await self._enviar(ws, json.dumps({"type": "chat", "game_id": self.game_id, "message": "gg"}))
+            await self._enviar(ws, b"\x82" if self.binario else '{"type":"ping"}')
+
+    async def _al_mover(self, ws, ply: int):
+        """Llega una jugada (propia o del rival) con su número de ply"""
+        mia = (ply % 2 == 1) == (self.color == "white")
+        if mia and self.enviada_en is not None:
+            self.resultados.latencias.append((time.perf_counter() - self.enviada_en) * 1000)
+            self.enviada_en = None
+        self.ply = ply
+        if self.ply >= len(APERTURA):
+            # Apertura terminada: abandonan las negras para cerrar la partida
+            if self.color == "black":
+                await self._enviar(ws, json.dumps({"type": "game_action", "game_id": self.game_id,
+                                                   "action": "resign"}))
+            return
+        if not mia:
+            await self._mover(ws)
+
+    async def jugar(self, elo: int, semaforo: asyncio.Semaphore):
+        # El semáforo solo limita cuántos se están conectando a la vez, no cuántos juegan
+        async with semaforo:
+            ws = await websockets.connect(self.url, max_queue=None, ping_interval=None)
+        async with ws:
+            await self._enviar(ws, json.dumps({"type": "find_match", "elo": elo}))
+            async for mensaje in ws:
+                self.resultados.recibidos += 1
+                if isinstance(mensaje, bytes):
+                    if mensaje[0] == TRAMA_JUGADA:
+                        jugada = decodificar_jugada(mensaje)
+                        if jugada["game_id"] == self.game_id:
+                            await self._al_mover(ws, jugada["ply"])
+                    continue
+                datos = json.loads(mensaje)
+                tipo = datos.get("type")
+                if tipo == "ping":
+                    await self._enviar(ws, '{"type": "pong"}')
+                elif tipo == "game_start":
+                    self.game_id, self.color = datos["game_id"], datos["your_color"]
+                    if self.color == "white":
+                        await self._mover(ws)
+                elif tipo == "move":
+                    await self._al_mover(ws, self.ply + 1)
+                elif tipo == "game_end":
+                    self.resultados.partidas += 1
+                    return
+                elif tipo == "error":
+                    self.resultados.errores += 1
+
+async def _jugar(cliente: ClienteSimulado, elo: int, semaforo: asyncio.Semaphore, resultados: Resultados):
+    try:
+        await cliente.jugar(elo, semaforo)
+    except Exception as e:
+        resultados.errores += 1
+        print(f"{cliente.username}: {e!r}")
+
+def _percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+async def cargar(url: str, clientes: int, binario: bool, chat_cada: int, conexiones_a_la_vez: int,
+                 limite_segundos: float) -> tuple[Resultados, float]:
+    resultados = Resultados()
+    semaforo = asyncio.Semaphore(conexiones_a_la_vez)
+    azar = random.Random(1)
+    # ELO repartido, pero cada dos clientes con el mismo para que se emparejen en el
+    # primer tick: se mide el juego, no lo que tarda en ensancharse la ventana
+    elos = [elo for elo in (azar.randint(1000, 2000) for _ in range(clientes // 2 + 1)) for _ in range(2)]
+    inicio = time.perf_counter()
+    tareas = [
+        asyncio.create_task(_jugar(
+            ClienteSimulado(url, f"carga_{i}", binario, resultados, chat_cada),
+            elos[i], semaforo, resultados
+        ))
+        for i in range(clientes)
+    ]
+    _, pendientes = await asyncio.wait(tareas, timeout=limite_segundos)
+    for tarea in pendientes:
+        tarea.cancel()
+    if pendientes:
+        print(f"{len(pendientes)} clientes no terminaron en {limite_segundos:.0f} s")
+    return resultados, time.perf_counter() - inicio
+
+def _esperar_servidor(port: int, segundos: float = 30):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("El servidor no arrancó")
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del juego en vivo por websocket")
+    parser.add_argument("--clientes", type=int, default=1000, help="clientes simulados (se emparejan de dos en dos)")
+    parser.add_argument("--protocolo", choices=("json", "binary"), default="json")
+    parser.add_argument("--chat-cada", type=int, default=5, help="chat y ping cada tantos plies")
+    parser.add_argument("--conexiones-a-la-vez", type=int, default=200)
+    parser.add_argument("--limite", type=float, default=300, help="segundos máximos de la prueba")
+    parser.add_argument("--url", help="usar un servidor ya arrancado (ws://host:puerto) en vez de lanzar uno")
+    parser.add_argument("--servidor", type=int, metavar="PUERTO", help=argparse.SUPPRESS)
+    argumentos = parser.parse_args()
+
+    if argumentos.servidor:
+        servir(argumentos.servidor)
+        return
+
+    servidor = None
+    url = argumentos.url
+    if url is None:
+        port = _puerto_libre()
+        servidor = subprocess.Popen([sys.executable, "-m", "benchmarks.carga_websockets", "--servidor", str(port)],
+                                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    # Sin los print de cada conexión; los errores siguen saliendo por stderr
+                                    stdout=subprocess.DEVNULL)
+        _esperar_servidor(port)
+        url = f"ws://127.0.0.1:{port}"
+
+    try:
+        memoria_inicial = _memoria_servidor(servidor.pid) if servidor else 0
+        resultados, duracion = asyncio.run(cargar(
+            url, argumentos.clientes, argumentos.protocolo == "binary", argumentos.chat_cada,
+            argumentos.conexiones_a_la_vez, argumentos.limite
+        ))
+        memoria_final = _memoria_servidor(servidor.pid) if servidor else 0
+        metricas = None
+        try:
+            http = url.replace("ws://", "http://").replace("wss://", "https://")
+            peticion = urllib.request.Request(f"{http}/internal/metricas", headers={
+                "Authorization": f"Bearer {create_access_token({'username': 'carga', 'role': 'admin'})}"
+            })
+            with urllib.request.urlopen(peticion, timeout=5) as respuesta:
+                metricas = json.load(respuesta)
+        except OSError:
+            pass
+    finally:
+        if servidor is not None:
+            servidor.terminate()
+            servidor.wait()
+
+    latencias = resultados.latencias
+    mensajes = resultados.enviados + resultados.recibidos
+    print(f"{argumentos.clientes} clientes ({argumentos.protocolo}) en {duracion:.1f} s")
+    print(f"  partidas terminadas:   {resultados.partidas // 2}")
+    print(f"  jugadas medidas:       {len(latencias)}")
+    if latencias:
+        print(f"  ida y vuelta (ms):     p50 {_percentil(latencias, 0.5):.2f}  p90 {_percentil(latencias, 0.9):.2f}  "
+              f"p99 {_percentil(latencias, 0.99):.2f}  máx {max(latencias):.2f}  media {statistics.mean(latencias):.2f}")
+    print(f"  mensajes/s:            {mensajes / duracion:.0f} ({resultados.enviados} enviados, "
+          f"{resultados.recibidos} recibidos)")
+    print(f"  errores:               {resultados.errores}")
+    if memoria_final:
+        print(f"  memoria del servidor:  {memoria_inicial / 1024:.1f} MB al empezar, {memoria_final / 1024:.1f} MB al acabar")
+    if metricas:
+        contadores = {k: v for k, v in metricas.get("contadores", {}).items() if k.startswith("ws.")}
+        if contadores:
+            print(f"  contadores del servidor: {contadores}")
+
+if __name__ == "__main__":
+    main()
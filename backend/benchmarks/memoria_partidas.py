@@ -0,0 +1,113 @@
+# /backend/benchmarks/memoria_partidas.py
+"""
+Memoria por partida en vivo: representación anterior (diccionario con una
+jugada completa, FEN incluido, por ply y tablero de python-chess con historial)
+frente a PartidaViva.
+
+Uso (desde backend/):
+    python -m benchmarks.memoria_partidas --partidas 1000 --plies 40
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+import chess
+import chess.polyglot
+from utils.partida_viva import PartidaViva
+
+def _partidas_aleatorias(cantidad: int, plies: int, semilla: int) -> list[list[chess.Move]]:
+    """Las mismas partidas (jugadas legales al azar) para las dos representaciones"""
+    azar = random.Random(semilla)
+    partidas = []
+    for _ in range(cantidad):
+        board = chess.Board()
+        jugadas = []
+        for _ in range(plies):
+            legales = list(board.legal_moves)
+            if not legales or board.is_game_over():
+                break
+            jugada = azar.choice(legales)
+            board.push(jugada)
+            jugadas.append(jugada)
+        partidas.append(jugadas)
+    return partidas
+
+def _antes(jugadas: list[chess.Move]):
+    """Como se guardaba antes: dict de la partida + tablero con historial + contador de repeticiones"""
+    board = chess.Board()
+    repeticiones = Counter()
+    game = {
+        "game_id": str(uuid.uuid4()),
+        "white_player": "jugador_blancas",
+        "black_player": "jugador_negras",
+        "white_elo": 1200,
+        "black_elo": 1200,
+        "current_turn": "white",
+        "moves": [],
+        "status": "active",
+        "result": "*",
+        "winner": None,
+        "end_reason": None,
+        "time_control": {"initial": 600, "increment": 0, "white_time": 600.0, "black_time": 600.0},
+        "current_fen": board.fen(),
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow()
+    }
+    for jugada in jugadas:
+        pieza = board.piece_at(jugada.from_square).symbol().upper()
+        san = board.san(jugada)
+        board.push(jugada)
+        repeticiones[chess.polyglot.zobrist_hash(board)] += 1
+        game["moves"].append({
+            "from_square": chess.square_name(jugada.from_square),
+            "to_square": chess.square_name(jugada.to_square),
+            "piece": pieza,
+            "promotion": chess.piece_symbol(jugada.promotion).upper() if jugada.promotion else None,
+            "san": san,
+            "fen": board.fen()
+        })
+        game["current_turn"] = "white" if board.turn == chess.WHITE else "black"
+        game["current_fen"] = board.fen()
+        game["updated_at"] = datetime.utcnow()
+    return game, board, repeticiones
+
+def _despues(jugadas: list[chess.Move]):
+    game = PartidaViva(str(uuid.uuid4()), "jugador_blancas", "jugador_negras", 1200, 1200, 600, 0)
+    for jugada in jugadas:
+        game.jugar(jugada)
+    return game
+
+def _medir(construir, partidas) -> float:
+    """Bytes retenidos por partida (tracemalloc) tras construirlas todas"""
+    gc.collect()
+    tracemalloc.start()
+    inicio, _ = tracemalloc.get_traced_memory()
+    vivas = [construir(jugadas) for jugadas in partidas]
+    gc.collect()
+    fin, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del vivas
+    return (fin - inicio) / len(partidas)
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por partida en vivo, antes y después")
+    parser.add_argument("--partidas", type=int, default=1000)
+    parser.add_argument("--plies", type=int, default=40)
+    parser.add_argument("--semilla", type=int, default=1)
+    argumentos = parser.parse_args()
+
+    partidas = _partidas_aleatorias(argumentos.partidas, argumentos.plies, argumentos.semilla)
+    plies = sum(len(jugadas) for jugadas in partidas) / len(partidas)
+    antes = _medir(_antes, partidas)
+    despues = _medir(_despues, partidas)
+
+    print(f"{len(partidas)} partidas, {plies:.1f} plies de media")
+    print(f"  antes (dict + jugadas con FEN):  {antes:10.0f} bytes/partida")
+    print(f"  después (PartidaViva):           {despues:10.0f} bytes/partida")
+    print(f"  reducción:                       {antes / despues:10.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -17,4 +17,76 @@ FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
 # Configuración de la base de datos
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://mongo:27017")
-DATABASE_NAME = os.getenv("DATABASE_NAME", "ajedrez_db") 
\ No newline at end of file
+DATABASE_NAME = os.getenv("DATABASE_NAME", "ajedrez_db") 
+
+# Configuración de Stockfish
+STOCKFISH_PATH = os.getenv("STOCKFISH_PATH", "/usr/local/bin/stockfish")
+STOCKFISH_DEPTH = int(os.getenv("STOCKFISH_DEPTH", "15"))
+# Número de procesos Stockfish en el pool (por defecto uno por núcleo)
+STOCKFISH_POOL_SIZE = int(os.getenv("STOCKFISH_POOL_SIZE", str(os.cpu_count() or 1)))
+
+# Entradas máximas de la cache de evaluaciones en memoria (el resto queda en MongoDB)
+EVAL_CACHE_SIZE = int(os.getenv("EVAL_CACHE_SIZE", "50000"))
+
+# Trabajos de análisis en segundo plano
+# Por defecto tantos como motores puede usar el análisis (ver ENGINE_INTERACTIVE_RESERVED)
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(max(1, STOCKFISH_POOL_SIZE - 1))))
+ANALYSIS_JOBS_RETAINED = int(os.getenv("ANALYSIS_JOBS_RETAINED", "1000"))
+# Segundos que se conservan en MongoDB los trabajos y lotes (para consultarlos desde cualquier worker)
+ANALYSIS_JOBS_TTL_SECONDS = int(os.getenv("ANALYSIS_JOBS_TTL_SECONDS", "86400"))
+
+# Partidas contra Stockfish con estado (cada una tiene su propio proceso)
+BOT_SESSIONS_MAX = int(os.getenv("BOT_SESSIONS_MAX", "32"))
+BOT_SESSION_IDLE_SECONDS = int(os.getenv("BOT_SESSION_IDLE_SECONDS", "900"))
+
+# Nodos máximos del trie de prefijos SAN → UCI compartido
+MOVE_TRIE_MAX_NODES = int(os.getenv("MOVE_TRIE_MAX_NODES", "100000"))
+# Segundos con un motor prestado a partir de los que se considera colgado
+STOCKFISH_HUNG_SECONDS = int(os.getenv("STOCKFISH_HUNG_SECONDS", "120"))
+
+# Control de admisión del motor: esperas máximas por delante en la cola del pool,
+# peticiones simultáneas por usuario y trabajos de análisis pendientes
+ENGINE_QUEUE_MAX = int(os.getenv("ENGINE_QUEUE_MAX", str(STOCKFISH_POOL_SIZE * 4)))
+ENGINE_USER_MAX = int(os.getenv("ENGINE_USER_MAX", "2"))
+# Motores que el análisis de partidas no puede ocupar: quedan para pistas y jugadas del bot
+# (con un pool de un solo motor no se puede reservar ninguno)
+ENGINE_INTERACTIVE_RESERVED = int(os.getenv("ENGINE_INTERACTIVE_RESERVED", "1"))
+ANALYSIS_QUEUE_MAX = int(os.getenv("ANALYSIS_QUEUE_MAX", "200"))
+
+# Backplane de partidas en vivo entre workers: vacío = un solo worker (en memoria);
+# con varios workers, el hub de utils/backplane.py, p. ej. tcp://backplane:8765
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "")
+
+# Matchmaking: cada tick se empareja en bloque; la diferencia de ELO aceptada
+# empieza en la ventana base y crece con la espera hasta la máxima
+MATCHMAKING_TICK_SECONDS = float(os.getenv("MATCHMAKING_TICK_SECONDS", "1"))
+MATCHMAKING_BASE_WINDOW = int(os.getenv("MATCHMAKING_BASE_WINDOW", "100"))
+MATCHMAKING_WIDEN_PER_SECOND = float(os.getenv("MATCHMAKING_WIDEN_PER_SECOND", "10"))
+MATCHMAKING_MAX_WINDOW = int(os.getenv("MATCHMAKING_MAX_WINDOW", "800"))
+
+# Mensajes pendientes por conexión WebSocket; al llenarse se aplica la política
+# de cliente lento: "disconnect" (cerrar, el cliente reconecta) o "drop" (descartar)
+WS_SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")
+
+# Diario de partidas en vivo: cada cuánto se vuelca a MongoDB y tamaño máximo del lote
+JOURNAL_FLUSH_MS = int(os.getenv("JOURNAL_FLUSH_MS", "200"))
+JOURNAL_BATCH_MAX = int(os.getenv("JOURNAL_BATCH_MAX", "500"))
+
+# Reloj de las partidas en vivo: tiempo inicial por jugador e incremento por jugada (segundos)
+CLOCK_INITIAL_SECONDS = int(os.getenv("CLOCK_INITIAL_SECONDS", "600"))
+CLOCK_INCREMENT_SECONDS = int(os.getenv("CLOCK_INCREMENT_SECONDS", "0"))
+# Una partida en pausa (jugador desconectado) se da por abandonada pasado este tiempo
+GAME_ABANDON_SECONDS = int(os.getenv("GAME_ABANDON_SECONDS", "120"))
+
+# Latido de los websockets: cada cuánto se comprueba y cuántos intervalos sin señales se toleran
+WS_HEARTBEAT_SECONDS = int(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+WS_HEARTBEAT_MISSED_MAX = int(os.getenv("WS_HEARTBEAT_MISSED_MAX", "3"))
+
+# Lobby en vivo: cada cuánto se difunden los cambios agrupados y tamaño máximo de página
+LOBBY_PUSH_MS = int(os.getenv("LOBBY_PUSH_MS", "500"))
+LOBBY_PAGE_MAX = int(os.getenv("LOBBY_PAGE_MAX", "100"))
+
+# Guardado de las partidas en vivo terminadas: cada cuánto se escribe el lote y tamaño máximo
+GAME_SAVE_FLUSH_MS = int(os.getenv("GAME_SAVE_FLUSH_MS", "1000"))
+GAME_SAVE_BATCH_MAX = int(os.getenv("GAME_SAVE_BATCH_MAX", "200"))
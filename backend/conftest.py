@@ -0,0 +1,2 @@
+# /backend/conftest.py
+# Hace importables utils, routes y models desde las pruebas (pytest desde backend/)
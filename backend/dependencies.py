@@ -1,4 +1,4 @@
-from fastapi import Depends, HTTPException, Header
+from fastapi import Depends, HTTPException, Header, Request
 from jose import JWTError
 from utils.auth import decode_token
 
@@ -12,3 +12,17 @@ async def get_current_user(authorization: str = Header(...)):
         raise HTTPException(status_code=403, detail="Token inválido o expirado")
 
     return payload  # contiene username, role, etc.
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    """Solo administradores (rutas internas como las métricas)"""
+    if current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="No autorizado")
+    return current_user
+
+async def identificar_cliente(request: Request, authorization: str = Header(None)) -> str:
+    """Usuario del token si lo hay; si no, la IP. Sirve para repartir el motor con justicia"""
+    if authorization and authorization.startswith("Bearer "):
+        payload = decode_token(authorization.split(" ")[1])
+        if payload and payload.get("username"):
+            return payload["username"]
+    return f"ip:{request.client.host if request.client else 'desconocida'}"
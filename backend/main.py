@@ -1,12 +1,19 @@
 # backend/main.py
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 from config import MONGODB_URL, DATABASE_NAME
+from utils.stockfish_pool import stockfish_pool, MotorSaturado
+from utils.trabajos_analisis import cola_analisis
+from utils.sesiones_bot import sesiones_bot
+from utils.websocket_manager import manager
+from utils.diario_partidas import diario_partidas
+from utils.guardado_partidas import guardado_partidas
 
-from routes import users, games, puzzles, lessons_eval, websockets, analysis
+from routes import users, games, puzzles, lessons_eval, websockets, analysis, metricas
 
 app = FastAPI()
 
@@ -25,10 +32,46 @@ async def startup_db_client():
     client = AsyncIOMotorClient(MONGODB_URL)
     app.state.db = client[DATABASE_NAME]
 
+# Backplane de partidas en vivo (conexión al hub si hay varios workers)
+@app.on_event("startup")
+async def startup_backplane():
+    await manager.start()
+    # Diario de partidas y recuperación de las que quedaron a medias
+    await diario_partidas.iniciar(app.state.db)
+    await guardado_partidas.iniciar(app.state.db)
+    await manager.recover()
+
+@app.on_event("shutdown")
+async def shutdown_backplane():
+    await guardado_partidas.cerrar()
+    await diario_partidas.cerrar()
+    await manager.stop()
+
+# Pool de motores Stockfish
+@app.on_event("startup")
+async def startup_stockfish_pool():
+    await stockfish_pool.iniciar()
+    await sesiones_bot.iniciar(app.state.db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     app.state.db.client.close()
 
+@app.on_event("shutdown")
+async def shutdown_stockfish_pool():
+    await cola_analisis.cerrar()
+    await sesiones_bot.cerrar()
+    await stockfish_pool.cerrar()
+
+# Control de admisión del motor: respuesta rápida en lugar de una cola sin límite
+@app.exception_handler(MotorSaturado)
+async def motor_saturado(request: Request, exc: MotorSaturado):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.reintentar_en)}
+    )
+
 # Ruta simple de prueba
 @app.get("/")
 async def root():
@@ -51,3 +94,4 @@ app.include_router(puzzles.router)
 app.include_router(lessons_eval.router)
 app.include_router(websockets.router)
 app.include_router(analysis.router, prefix="/api")
+app.include_router(metricas.router, prefix="/internal")
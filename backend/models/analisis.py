@@ -0,0 +1,33 @@
+# /backend/models/analisis.py
+from pydantic import BaseModel, Field
+from typing import List, Optional, Literal
+from datetime import datetime
+
+class OpcionesAnalisis(BaseModel):
+    # "fijo": todas las posiciones con el mismo límite
+    # "adaptativo": pasada rápida a poca profundidad y luego más profundidad solo
+    # en las jugadas donde la evaluación cambia mucho, hasta agotar el presupuesto
+    modo: Literal["fijo", "adaptativo"] = "fijo"
+    profundidad: Optional[int] = Field(None, ge=1, le=30)  # None = la del pool (STOCKFISH_DEPTH)
+
+    # Límites por posición en modo fijo (en lugar de profundidad)
+    nodos: Optional[int] = Field(None, ge=1000, le=50_000_000)
+    tiempo_ms: Optional[int] = Field(None, ge=10, le=10_000)
+
+    # Modo adaptativo
+    presupuesto_ms: Optional[int] = Field(None, ge=100, le=600_000)  # tiempo total de motor; None = sin límite
+    profundidad_rapida: int = Field(8, ge=1, le=20)
+    umbral_cp: int = Field(100, ge=10, le=2000)  # cambio de evaluación que merece re-búsqueda
+
+    def es_estandar(self) -> bool:
+        """Análisis a profundidad fija: el único que se guarda en la partida"""
+        return self.modo == "fijo" and not self.nodos and not self.tiempo_ms
+
+class LoteAnalisis(BaseModel):
+    # Partidas concretas, o bien un filtro por jugador y/o fechas
+    partida_ids: List[str] = []
+    jugador: Optional[str] = None
+    desde: Optional[datetime] = None
+    hasta: Optional[datetime] = None
+    limite: int = Field(100, ge=1, le=1000)
+    opciones: OpcionesAnalisis = OpcionesAnalisis()
@@ -22,7 +22,8 @@ class LiveGame(BaseModel):
     status: Literal["waiting", "active", "paused", "finished"] = "waiting"
     result: Optional[Literal["1-0", "0-1", "1/2-1/2", "*"]] = "*"
     winner: Optional[str] = None
-    time_control: dict = {"white_time": 600, "black_time": 600}  # Tiempo en segundos
+    end_reason: Optional[str] = None  # checkmate, stalemate, fivefold_repetition, threefold_repetition (reclamada), resignation...
+    time_control: dict = {"initial": 600, "increment": 0, "white_time": 600, "black_time": 600}  # Tiempo en segundos
     created_at: datetime
     updated_at: datetime
 
@@ -0,0 +1,12 @@
+# /backend/models/sesion_bot.py
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+class NuevaSesionBot(BaseModel):
+    color: Literal["white", "black"] = "white"  # color con el que juega el alumno
+    nivel: Optional[int] = Field(None, ge=0, le=20)  # Skill Level de Stockfish
+    elo: Optional[int] = Field(None, ge=1320, le=3190)  # UCI_Elo (tiene prioridad sobre nivel)
+    movimientos: List[str] = []  # jugadas SAN previas, para retomar una partida empezada
+
+class JugadaBot(BaseModel):
+    jugada: str  # en SAN ("Nf3") o UCI ("g1f3")
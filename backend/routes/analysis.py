@@ -1,87 +1,245 @@
-from fastapi import APIRouter, HTTPException, Request, Body
+from fastapi import APIRouter, HTTPException, Request, Body, Depends
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+from utils.stockfish_analysis import convertir_con_posiciones, jugada_de_stockfish, mejores_jugadas
+from utils.stockfish_pool import stockfish_pool, PRIORIDAD_INTERACTIVA
+from utils.cache_evaluaciones import cache_evaluaciones, clave_evaluacion
+from utils import servicio_analisis
+from utils.servicio_analisis import cargar_partida, analisis_guardado, completar_opciones
+from models.analisis import OpcionesAnalisis, LoteAnalisis
 from bson import ObjectId
-from utils.stockfish_analysis import analizar_movimientos, convertir_a_uci
-from stockfish import Stockfish
-
-stockfish = Stockfish(path="/usr/local/bin/stockfish", depth=15)
+from models.sesion_bot import NuevaSesionBot, JugadaBot
+from utils.sesiones_bot import sesiones_bot
+from utils.trabajos_analisis import cola_analisis, vista_trabajo
+from dependencies import identificar_cliente, get_admin_user
 
 router = APIRouter()
 
 
-@router.get("/analisis/{partida_id}")
-async def analizar_partida(partida_id: str, request: Request):
+@router.post("/analisis/{partida_id}/trabajos")
+async def crear_trabajo_analisis(partida_id: str, request: Request,
+                                 opciones: OpcionesAnalisis = Depends(), reanalizar: bool = False,
+                                 cliente: str = Depends(identificar_cliente)):
+    """Encola el análisis de la partida y devuelve el id del trabajo para consultarlo después"""
+    db = request.app.state.db
+    partida = await cargar_partida(db, partida_id)
+    opciones = completar_opciones(opciones)
+
+    # Ya hay un análisis guardado suficiente: no hace falta trabajo
+    if not reanalizar and analisis_guardado(partida, opciones) is not None:
+        return {"job_id": None, "partida_id": partida_id, "opciones": opciones.model_dump(),
+                "estado": "terminado", "guardado": True}
+
+    trabajo = cola_analisis.enviar(db, partida, opciones, usuario=cliente)
+    # Cualquier worker puede recibir la consulta del trabajo
+    await cola_analisis.compartido(trabajo)
+    return vista_trabajo(trabajo, con_resultado=False)
+
+
+@router.post("/analisis/lotes")
+async def crear_lote_analisis(lote: LoteAnalisis, request: Request):
+    """
+    Analiza varias partidas en paralelo (por ejemplo, todas las de una clase o de
+    una ronda de torneo): por id o filtrando por jugador y rango de fechas
+    """
     db = request.app.state.db
 
-    partida = None
+    if lote.partida_ids:
+        ids = [ObjectId(p) if ObjectId.is_valid(p) else p for p in lote.partida_ids]
+        filtro = {"_id": {"$in": ids}}
+    elif lote.jugador or lote.desde or lote.hasta:
+        filtro = {}
+        if lote.jugador:
+            filtro["$or"] = [{"white_player": lote.jugador}, {"black_player": lote.jugador}]
+        if lote.desde or lote.hasta:
+            filtro["date_played"] = {}
+            if lote.desde:
+                filtro["date_played"]["$gte"] = lote.desde
+            if lote.hasta:
+                filtro["date_played"]["$lte"] = lote.hasta
+    else:
+        raise HTTPException(status_code=400, detail="Indica partida_ids o un filtro (jugador, desde, hasta)")
+
+    partidas = await db.games.find(filtro).to_list(lote.limite)
+    if not partidas:
+        raise HTTPException(status_code=404, detail="No se encontraron partidas")
+
+    # Partidas sin jugadas: no hay nada que analizar
+    partidas = [p for p in partidas if p.get("moves") or p.get("movimientos")]
+
     try:
-        oid = ObjectId(partida_id)
-        partida = await db.games.find_one({"_id": oid})
-    except Exception as e:
-        print(f"Error al crear ObjectId: {e}")
+        nuevo = cola_analisis.enviar_lote(db, partidas, lote.opciones)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await cola_analisis.compartido(nuevo)
+    return {"lote_id": nuevo["lote_id"], "total": len(nuevo["partidas"])}
 
-    if not partida:
-        # Intentar buscar con string por si acaso
-        partida = await db.games.find_one({"_id": partida_id})
 
-    if not partida:
-        raise HTTPException(status_code=404, detail="Partida no encontrada")
+@router.get("/analisis/lotes/{lote_id}")
+async def estado_lote_analisis(lote_id: str, request: Request):
+    estado = await cola_analisis.estado_lote(request.app.state.db, lote_id)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    return estado
 
-    movimientos_raw = partida.get("moves") or partida.get("movimientos")
-    if not movimientos_raw:
-        raise HTTPException(status_code=400, detail="La partida no tiene movimientos")
 
-    if isinstance(movimientos_raw, list) and len(movimientos_raw) == 1 and isinstance(movimientos_raw[0], str):
-        movimientos = movimientos_raw[0].replace(" ", "").split(",")
-    else:
-        movimientos = [m.strip("'\"") for m in movimientos_raw]
+@router.get("/analisis/trabajos/{job_id}")
+async def estado_trabajo_analisis(job_id: str, request: Request):
+    """Estado del trabajo; incluye el resultado cuando ya terminó"""
+    trabajo = await cola_analisis.obtener(request.app.state.db, job_id)
+    if not trabajo:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return vista_trabajo(trabajo)
+
+
+@router.get("/analisis/{partida_id}")
+async def analizar_partida(partida_id: str, request: Request,
+                           opciones: OpcionesAnalisis = Depends(), reanalizar: bool = False,
+                           cliente: str = Depends(identificar_cliente)):
+    """
+    Análisis de la partida. Se sirve desde el análisis guardado en la partida si
+    existe uno de igual o mayor profundidad; reanalizar=true fuerza recalcularlo
+    (por ejemplo, para pedir más profundidad).
+    Con modo=adaptativo se hace una pasada rápida y se profundiza solo en las
+    jugadas críticas dentro de presupuesto_ms; con nodos o tiempo_ms se limita
+    cada búsqueda en lugar de usar profundidad.
+    """
+    db = request.app.state.db
+    partida = await cargar_partida(db, partida_id)
+    opciones = completar_opciones(opciones)
+
+    if not reanalizar:
+        guardado = analisis_guardado(partida, opciones)
+        if guardado is not None:
+            return {"analisis": guardado["jugadas"], "profundidad": guardado["profundidad"]}
+
+    # Pasa por la cola: si otra petición ya está analizando la misma partida, se espera ese resultado
+    trabajo = cola_analisis.enviar(db, partida, opciones, usuario=cliente)
+    analisis = await cola_analisis.esperar(trabajo["job_id"])
+    return {"analisis": analisis, "profundidad": servicio_analisis.profundidad_alcanzada(analisis, opciones)}
+
+
+@router.get("/analisis/{partida_id}/stream")
+async def analizar_partida_stream(partida_id: str, request: Request,
+                                  opciones: OpcionesAnalisis = Depends(), reanalizar: bool = False,
+                                  cliente: str = Depends(identificar_cliente)):
+    """Análisis en NDJSON: una línea por jugada, enviada en cuanto se calcula"""
+    db = request.app.state.db
+    partida = await cargar_partida(db, partida_id)
 
-    analisis = analizar_movimientos(movimientos)
-    return {"analisis": analisis}
+    jugadas = servicio_analisis.analizar_partida_stream(db, partida, opciones, reanalizar, usuario=cliente)
+    # La primera jugada se pide antes de responder: si no hay admisión, el 429 llega
+    # como respuesta normal y no a mitad de un stream ya empezado
+    try:
+        primera = await jugadas.__anext__()
+    except StopAsyncIteration:
+        primera = None
+
+    async def lineas():
+        if primera is None:
+            return
+        try:
+            yield json.dumps(primera) + "\n"
+            async for jugada in jugadas:
+                yield json.dumps(jugada) + "\n"
+        finally:
+            await jugadas.aclose()
+
+    # Si el cliente se desconecta, Starlette cancela el generador y el análisis se detiene
+    return StreamingResponse(lineas(), media_type="application/x-ndjson")
 
 
 @router.post("/juga-stockfish")
-def jugar_con_stockfish(movimientos: list[str] = Body(...)):
-    movimientos_uci = convertir_a_uci(movimientos)
+async def jugar_con_stockfish(request: Request, movimientos: list[str] = Body(...),
+                              cliente: str = Depends(identificar_cliente)):
+    db = request.app.state.db
+    # La conversión reproduce en un tablero las jugadas que el trie no conoce: fuera del event loop
+    movimientos_uci, posiciones = await asyncio.to_thread(convertir_con_posiciones, movimientos)
 
     if not movimientos_uci:
         raise HTTPException(status_code=400, detail="Movimientos inválidos")
 
-    stockfish.set_position(movimientos_uci)
+    fen = posiciones[-1]
+    await cache_evaluaciones.precargar(db, [clave_evaluacion(fen, stockfish_pool.depth)])
 
-    jugada_stockfish = stockfish.get_best_move()
+    jugada_stockfish, fen = await stockfish_pool.ejecutar(jugada_de_stockfish, fen, cache_evaluaciones,
+                                                          prioridad=PRIORIDAD_INTERACTIVA, usuario=cliente)
+    await cache_evaluaciones.persistir(db)
 
     if not jugada_stockfish:
         return {"mensaje": "La partida ha terminado o no se puede continuar"}
 
-    movimientos_uci.append(jugada_stockfish)
-    stockfish.set_position(movimientos_uci)
-
     return {
         "jugada_stockfish": jugada_stockfish,
-        "fen": stockfish.get_fen_position(),
+        "fen": fen,
         "movimientos_totales": movimientos + [jugada_stockfish],
         "comentario": f"Stockfish juega {jugada_stockfish}"
     }
 
 
+@router.post("/bot/partidas")
+async def crear_partida_bot(datos: NuevaSesionBot):
+    """
+    Partida contra Stockfish con estado en el servidor: después solo se envía la
+    última jugada a /bot/partidas/{game_id}/jugada
+    """
+    try:
+        return await sesiones_bot.crear(datos.color, datos.nivel, datos.elo, datos.movimientos)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Movimientos inválidos")
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.post("/bot/partidas/{game_id}/jugada")
+async def jugar_partida_bot(game_id: str, datos: JugadaBot):
+    try:
+        return await sesiones_bot.jugar(game_id, datos.jugada)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Partida no encontrada o cerrada por inactividad")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.delete("/bot/partidas/{game_id}")
+async def terminar_partida_bot(game_id: str):
+    if not await sesiones_bot.terminar(game_id):
+        raise HTTPException(status_code=404, detail="Partida no encontrada")
+    return {"mensaje": "Partida terminada"}
+
+
 @router.post("/analizar-tablero")
-def sugerencias_de_jugada(movimientos: list[str] = Body(...)):
-    movimientos_uci = convertir_a_uci(movimientos)
+async def sugerencias_de_jugada(request: Request, movimientos: list[str] = Body(...),
+                                cliente: str = Depends(identificar_cliente)):
+    db = request.app.state.db
+    movimientos_uci, posiciones = await asyncio.to_thread(convertir_con_posiciones, movimientos)
 
     if not movimientos_uci and movimientos:
         raise HTTPException(status_code=400, detail="Movimientos inválidos")
 
-    stockfish.set_position(movimientos_uci)
-
     # Determinar el turno actual en base al número de movimientos
     turno = "blancas" if len(movimientos_uci) % 2 == 0 else "negras"
 
-    mejores_jugadas = stockfish.get_top_moves(3)
+    fen = posiciones[-1]
+    await cache_evaluaciones.precargar(db, [clave_evaluacion(fen, stockfish_pool.depth, 3)])
+
+    mejores, fen = await stockfish_pool.ejecutar(mejores_jugadas, fen, 3, cache_evaluaciones,
+                                                 prioridad=PRIORIDAD_INTERACTIVA, usuario=cliente)
+    await cache_evaluaciones.persistir(db)
 
     return {
         "turno_actual": turno,
-        "mejores_jugadas": mejores_jugadas,
-        "fen": stockfish.get_fen_position(),
+        "mejores_jugadas": mejores,
+        "fen": fen,
         "comentario": f"Las mejores jugadas para las {turno} son: " +
-                      ", ".join([f"{m['Move']} (eval: {m['Centipawn']})" for m in mejores_jugadas])
+                      ", ".join([f"{m['Move']} (eval: {m['Centipawn']})" for m in mejores])
     }
+
+
+@router.get("/cache-evaluaciones", dependencies=[Depends(get_admin_user)])
+async def estadisticas_cache():
+    """Aciertos y fallos de la cache de evaluaciones"""
+    return cache_evaluaciones.estadisticas()
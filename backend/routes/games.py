@@ -3,15 +3,13 @@ from models.game import Game
 from models.live_game import LiveGame, Move
 from datetime import datetime
 from utils.websocket_manager import manager
+from utils.elo import calcular_nuevo_elo
+from utils.guardado_partidas import guardado_partidas, id_partida, nuevos_elo
+from utils.diario_partidas import diario_partidas
+from utils.partida_viva import PartidaViva
 
 router = APIRouter()
 
-def calcular_nuevo_elo(rating_a, rating_b, resultado):
-    # resultado: 1.0 si gana A, 0.5 tablas, 0.0 derrota
-    K = 32
-    expected_score = 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
-    return int(rating_a + K * (resultado - expected_score))
-
 @router.post("/guardar-partida")
 async def save_game(game: Game, request: Request):
     db = request.app.state.db
@@ -77,82 +75,37 @@ async def save_game(game: Game, request: Request):
 @router.get("/partidas/{username}")
 async def obtener_partidas(request: Request, username: str):
     db = request.app.state.db
+    # El análisis guardado se pide aparte en /api/analisis/{partida_id}
     partidas = await db.games.find({
         "$or": [{"white_player": username}, {"black_player": username}]
-    }).to_list(None)
+    }, {"analisis_guardado": 0}).to_list(None)
     return [{**p, "_id": str(p["_id"])} for p in partidas]
 
 @router.post("/finalizar-partida-vivo")
 async def finalizar_partida_vivo(request: Request, game_id: str):
-    """Finaliza una partida en vivo y la guarda en la base de datos"""
+    """
+    Las partidas en vivo se guardan solas al terminar; esto queda para los
+    clientes que lo siguen llamando, con la misma respuesta de siempre
+    """
     db = request.app.state.db
-    
-    if game_id not in manager.active_games:
-        return {"error": "Partida no encontrada"}
-    
-    live_game = manager.active_games[game_id]
-    
-    # Crear objeto Game para guardar
-    game_data = {
-        "white_player": live_game["white_player"],
-        "black_player": live_game["black_player"],
-        "white_elo": live_game["white_elo"],
-        "black_elo": live_game["black_elo"],
-        "moves": [move["san"] for move in live_game["moves"]],  # Solo notación SAN
-        "result_code": live_game["result"],
-        "winner": live_game["winner"] or "draw",
-        "date_played": live_game["created_at"]
-    }
-    
-    # Calcular resultado numérico para blancos
-    resultado_blancos = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}.get(live_game["result"], 0.5)
-    
-    # Calcular nuevos ELO
-    white_elo = live_game["white_elo"]
-    black_elo = live_game["black_elo"]
-    
-    nuevo_elo_blancos = calcular_nuevo_elo(white_elo, black_elo, resultado_blancos)
-    nuevo_elo_negras = calcular_nuevo_elo(black_elo, white_elo, 1 - resultado_blancos)
-    
-    # Guardar partida en la base de datos
-    result = await db.games.insert_one(game_data)
-    
-    # Actualizar estadísticas de usuarios
-    white_player = live_game["white_player"]
-    black_player = live_game["black_player"]
-    
-    await db.users.update_one(
-        {"username": white_player},
-        {"$set": {"elo": nuevo_elo_blancos},
-         "$inc": {
-             "games_played": 1,
-             "games_won": 1 if live_game["result"] == "1-0" else 0,
-             "games_lost": 1 if live_game["result"] == "0-1" else 0,
-             "games_drawn": 1 if live_game["result"] == "1/2-1/2" else 0
-         }}
-    )
 
-    await db.users.update_one(
-        {"username": black_player},
-        {"$set": {"elo": nuevo_elo_negras},
-         "$inc": {
-             "games_played": 1,
-             "games_won": 1 if live_game["result"] == "0-1" else 0,
-             "games_lost": 1 if live_game["result"] == "1-0" else 0,
-             "games_drawn": 1 if live_game["result"] == "1/2-1/2" else 0
-         }}
-    )
-    
-    # Remover partida de partidas activas
-    del manager.active_games[game_id]
-    if white_player in manager.user_to_game:
-        del manager.user_to_game[white_player]
-    if black_player in manager.user_to_game:
-        del manager.user_to_game[black_player]
-    
+    partida = guardado_partidas.pendiente(game_id) or \
+        await db.games.find_one({"live_game_id": game_id}, {"white_elo": 1, "black_elo": 1, "result_code": 1})
+    if partida is None:
+        # Aún en vivo (aquí o en otro worker), o terminada en otro worker y sin escribir todavía
+        game = manager.active_games.get(game_id)
+        if game is None:
+            doc = await diario_partidas.leer(game_id)
+            if doc is None:
+                return {"error": "Partida no encontrada"}
+            game = PartidaViva.desde_diario(game_id, doc)
+        if game.status != "finished":
+            return {"error": "La partida no ha terminado"}
+        partida = {"_id": id_partida(game_id), "white_elo": game.white_elo,
+                   "black_elo": game.black_elo, "result_code": game.result}
+
     return {
         "mensaje": "Partida finalizada y guardada",
-        "id": str(result.inserted_id),
-        "nuevo_elo_blancos": nuevo_elo_blancos,
-        "nuevo_elo_negras": nuevo_elo_negras
+        "id": str(partida["_id"]),
+        **nuevos_elo(partida["white_elo"], partida["black_elo"], partida["result_code"])
     }
@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from dependencies import get_admin_user
+from utils.metricas import metricas
+from utils.stockfish_pool import stockfish_pool
+from utils.cache_evaluaciones import cache_evaluaciones
+from utils.sesiones_bot import sesiones_bot
+
+# Expone el estado interno del servidor: solo para administradores
+router = APIRouter(dependencies=[Depends(get_admin_user)])
+
+
+@router.get("/metricas")
+async def obtener_metricas():
+    """Latencias por llamada al motor, espera por un motor libre y salud de los procesos Stockfish"""
+    return {
+        **metricas.resumen(),
+        "pool": stockfish_pool.salud(),
+        "sesiones_bot": sesiones_bot.salud(),
+        "cache_evaluaciones": cache_evaluaciones.estadisticas()
+    }
@@ -58,7 +58,7 @@ async def perfil_usuario(username: str, request: Request):
             {"white_player": username},
             {"black_player": username}
         ]
-    }).to_list(None)
+    }, {"analisis_guardado": 0}).to_list(None)
 
     total_partidas = len(partidas)
     victorias = sum(1 for p in partidas if p.get("winner") == username)
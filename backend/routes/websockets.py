@@ -1,9 +1,17 @@
 # /backend/routes/websockets.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from utils.websocket_manager import manager
+from utils.websocket_manager import manager, PING_FRAMES, PONG_FRAME
+from utils.protocolo_binario import leer_trama, PONG
+from utils.diario_partidas import diario_partidas
+from utils.partida_viva import PartidaViva
 from utils.auth import decode_token
+from utils.servicio_analisis import cargar_partida, analizar_partida_stream
+from utils.stockfish_pool import MotorSaturado
+import asyncio
 import json
+from typing import Optional
+from config import LOBBY_PAGE_MAX
 
 router = APIRouter()
 security = HTTPBearer()
@@ -15,34 +23,105 @@ async def get_current_user_ws(token: str):
         return None
     return payload.get("username")
 
+async def enviar_analisis(db, partida_id: str, username: str):
+    """Envía el análisis de una partida guardada jugada por jugada"""
+    try:
+        partida = await cargar_partida(db, partida_id)
+        async for jugada in analizar_partida_stream(db, partida, usuario=username):
+            await manager.send_personal_message({
+                "type": "analysis_move",
+                "game_id": partida_id,
+                "analysis": jugada
+            }, username)
+    except HTTPException as e:
+        await manager.send_personal_message({
+            "type": "analysis_error",
+            "game_id": partida_id,
+            "message": e.detail
+        }, username)
+        return
+    except MotorSaturado as e:
+        await manager.send_personal_message({
+            "type": "analysis_error",
+            "game_id": partida_id,
+            "message": str(e),
+            "retry_after": e.reintentar_en
+        }, username)
+        return
+    except Exception as e:
+        print(f"Error analizando la partida {partida_id}: {e}")
+        await manager.send_personal_message({
+            "type": "analysis_error",
+            "game_id": partida_id,
+            "message": "Error al analizar la partida"
+        }, username)
+        return
+
+    await manager.send_personal_message({
+        "type": "analysis_end",
+        "game_id": partida_id
+    }, username)
+
 @router.websocket("/ws/{token}")
 async def websocket_endpoint(websocket: WebSocket, token: str):
-    """Endpoint principal de WebSocket para conexiones de usuarios"""
+    """
+    Endpoint principal de WebSocket para conexiones de usuarios. Con
+    ?protocol=binary las jugadas y el latido van en tramas binarias
+    (utils/protocolo_binario.py); el resto de mensajes siguen en JSON.
+    """
     username = await get_current_user_ws(token)
     
     if not username:
         await websocket.close(code=4001, reason="Token inválido")
         return
     
-    await manager.connect(websocket, username)
+    binary = websocket.query_params.get("protocol") == "binary"
+    connection = await manager.connect(websocket, username, binary)
+
+    # Análisis en streaming pedido por esta conexión (uno a la vez)
+    analisis_en_curso = None
     
     try:
         while True:
             # Recibir mensaje del cliente
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            connection.touch()
+
+            if frame.get("bytes") is not None:
+                # Trama binaria: se traduce al mismo mensaje que llegaría en JSON
+                try:
+                    message = leer_trama(frame["bytes"])
+                except ValueError as e:
+                    await manager.send_personal_message({"type": "error", "message": str(e)}, username)
+                    continue
+                if message["type"] == "ping":
+                    connection.mark_heartbeat()
+                    connection.send(PONG)
+                    continue
+                if message["type"] == "pong":
+                    continue
+            else:
+                data = frame["text"]
+                # Latido: el ping se contesta sin parsear y el pong solo cuenta como señal de vida
+                if data in PING_FRAMES:
+                    connection.mark_heartbeat()
+                    connection.send(PONG_FRAME)
+                    continue
+                message = json.loads(data)
             
             message_type = message.get("type")
             
             if message_type == "find_match":
-                # Buscar partida
-                user_elo = message.get("elo", 1200)
-                await manager.add_to_matchmaking(username, user_elo)
+                # Buscar partida con el ELO guardado (el que envía el cliente solo si no hay otro)
+                user = await websocket.app.state.db.users.find_one({"username": username}, {"elo": 1})
+                user_elo = user.get("elo") if user and user.get("elo") else message.get("elo", 1200)
+                await manager.add_to_matchmaking(username, int(user_elo))
                 
             elif message_type == "cancel_match":
                 # Cancelar búsqueda de partida
-                if username in manager.matchmaking_queue:
-                    manager.matchmaking_queue.remove(username)
+                await manager.remove_from_matchmaking(username)
                 await manager.send_personal_message({
                     "type": "match_cancelled"
                 }, username)
@@ -53,7 +132,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 move_data = message.get("move")
                 
                 if game_id and move_data:
-                    await manager.handle_move(game_id, move_data, username)
+                    await manager.route_game_event(game_id, {"type": "move", "move": move_data}, username)
                 
             elif message_type == "game_action":
                 # Acciones del juego (resignar, ofrecer tablas, etc.)
@@ -61,7 +140,7 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 action = message.get("action")
                 
                 if game_id and action:
-                    await manager.handle_game_action(game_id, action, username)
+                    await manager.route_game_event(game_id, {"type": "game_action", "action": action}, username)
                 
             elif message_type == "chat":
                 # Mensaje de chat en la partida
@@ -69,45 +148,90 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
                 chat_message = message.get("message")
                 
                 if game_id and chat_message:
-                    await manager.send_game_message({
-                        "type": "chat",
-                        "player": username,
-                        "message": chat_message
-                    }, game_id)
+                    await manager.route_game_event(game_id, {"type": "chat", "message": chat_message}, username)
+                
+            elif message_type == "spectate":
+                # Mirar una partida: foto inicial y después una delta por jugada
+                game_id = message.get("game_id")
+                
+                if game_id:
+                    await manager.spectate(game_id, username)
+                
+            elif message_type == "unspectate":
+                await manager.unspectate(username)
+                
+            elif message_type == "lobby_subscribe":
+                # Lobby en vivo: foto inicial y después deltas agrupados
+                await manager.subscribe_lobby(username)
+                
+            elif message_type == "lobby_unsubscribe":
+                manager.unsubscribe_lobby(username)
+                
+            elif message_type == "analyze_game":
+                # Análisis de una partida guardada, enviado jugada por jugada
+                partida_id = message.get("game_id")
+                
+                if partida_id:
+                    if analisis_en_curso and not analisis_en_curso.done():
+                        analisis_en_curso.cancel()
+                    analisis_en_curso = asyncio.create_task(
+                        enviar_analisis(websocket.app.state.db, partida_id, username)
+                    )
+                
+            elif message_type == "cancel_analysis":
+                # Cancelar el análisis en curso
+                if analisis_en_curso and not analisis_en_curso.done():
+                    analisis_en_curso.cancel()
+                    await manager.send_personal_message({
+                        "type": "analysis_cancelled"
+                    }, username)
                 
             elif message_type == "ping":
-                # Ping para mantener conexión
-                await manager.send_personal_message({
-                    "type": "pong"
-                }, username)
+                # Ping con otro formato (p. ej. con campos extra)
+                connection.mark_heartbeat()
+                connection.send(PONG_FRAME)
                 
     except WebSocketDisconnect:
-        manager.disconnect(username)
+        manager.disconnect(username, websocket)
     except Exception as e:
         print(f"Error en WebSocket para {username}: {e}")
-        manager.disconnect(username)
+        manager.disconnect(username, websocket)
+    finally:
+        # El cliente se fue: no seguir analizando para nadie
+        if analisis_en_curso and not analisis_en_curso.done():
+            analisis_en_curso.cancel()
 
 @router.get("/active-games")
-async def get_active_games(request: Request):
-    """Obtener lista de partidas activas"""
-    games = []
-    for game_id, game_data in manager.active_games.items():
-        games.append({
-            "game_id": game_id,
-            "white_player": game_data["white_player"],
-            "black_player": game_data["black_player"],
-            "status": game_data["status"],
-            "moves_count": len(game_data["moves"])
-        })
-    return {"active_games": games}
+async def get_active_games(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=LOBBY_PAGE_MAX),
+    status: Optional[str] = None,
+    player: Optional[str] = None,
+    min_elo: Optional[int] = None,
+    max_elo: Optional[int] = None
+):
+    """
+    Lista de partidas en vivo (de todos los workers), servida desde el índice
+    del lobby. Sin limit se devuelven todas, como antes de paginar; con limit,
+    total y next_offset (None en la última página) permiten recorrer el resto.
+    Para seguir los cambios sin sondear, suscribirse por websocket con
+    {"type": "lobby_subscribe"}.
+    """
+    return manager.lobby.listar(offset, limit, status, player, min_elo, max_elo)
 
 @router.get("/game/{game_id}")
 async def get_game_details(game_id: str, request: Request):
     """Obtener detalles de una partida específica"""
-    if game_id not in manager.active_games:
+    game = manager.active_games.get(game_id)
+    if game is not None:
+        return game.as_dict()
+
+    # Partida de otro worker: se lee del diario, compartido por todos
+    doc = await diario_partidas.leer(game_id)
+    if doc is None:
         raise HTTPException(status_code=404, detail="Partida no encontrada")
-    
-    return manager.active_games[game_id]
+    return PartidaViva.desde_diario(game_id, doc).as_dict()
 
 @router.post("/create-private-game")
 async def create_private_game(
@@ -126,7 +250,7 @@ async def create_private_game(
     username = payload["username"]
     
     # Verificar que el oponente existe y está conectado
-    if opponent_username not in manager.active_connections:
+    if not await manager.is_online(opponent_username):
         raise HTTPException(status_code=400, detail="Oponente no está conectado")
     
     # Obtener ELOs de la base de datos
@@ -145,25 +269,7 @@ async def create_private_game(
         white_player, black_player = opponent_username, username
         white_elo, black_elo = opponent["elo"], user["elo"]
     
-    game_id = manager.create_game(white_player, black_player, white_elo, black_elo)
-    
-    # Notificar a ambos jugadores
-    game_start_message = {
-        "type": "game_start",
-        "game_id": game_id,
-        "white_player": white_player,
-        "black_player": black_player,
-        "is_private": True
-    }
-    
-    await manager.send_personal_message({
-        **game_start_message, 
-        "your_color": "white" if white_player == username else "black"
-    }, username)
-    
-    await manager.send_personal_message({
-        **game_start_message,
-        "your_color": "white" if white_player == opponent_username else "black"
-    }, opponent_username)
+    # Crea la partida en este worker y notifica a ambos jugadores
+    game_id = await manager.start_game(white_player, black_player, white_elo, black_elo, is_private=True)
     
     return {"message": "Partida privada creada", "game_id": game_id}
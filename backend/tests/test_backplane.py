@@ -0,0 +1,146 @@
+# /backend/tests/test_backplane.py
+"""
+Backplane en red con el hub real (HubBackplane) en un puerto libre: dos
+ConnectionManager, cada uno con su BackplaneRed, como dos workers de uvicorn.
+"""
+import asyncio
+import json
+import socket
+from utils.backplane import HubBackplane, BackplaneRed
+from utils.websocket_manager import ConnectionManager
+
+
+class _WebSocket:
+    """Lo justo de un WebSocket de Starlette para el manager"""
+
+    def __init__(self):
+        self.recibidos = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, texto: str):
+        self.recibidos.append(json.loads(texto))
+
+    async def send_bytes(self, datos: bytes):
+        pass
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+    def de_tipo(self, tipo: str) -> list[dict]:
+        return [mensaje for mensaje in self.recibidos if mensaje.get("type") == tipo]
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _esperar(condicion, segundos: float = 2.0):
+    limite = asyncio.get_running_loop().time() + segundos
+    while not condicion():
+        assert asyncio.get_running_loop().time() < limite, "tiempo agotado"
+        await asyncio.sleep(0.01)
+
+
+def test_jugada_entre_dos_workers():
+    async def prueba():
+        hub = HubBackplane()
+        port = await hub.iniciar(port=0)
+        worker1 = ConnectionManager(BackplaneRed("127.0.0.1", port))
+        worker2 = ConnectionManager(BackplaneRed("127.0.0.1", port))
+        await worker1.start()
+        await worker2.start()
+        ana, beto = _WebSocket(), _WebSocket()
+        try:
+            await worker1.connect(ana, "ana")
+            await worker2.connect(beto, "beto")
+
+            # La partida vive en el worker de ana; beto recibe el inicio a través del hub
+            game_id = await worker1.start_game("ana", "beto", 1200, 1200)
+            await _esperar(lambda: beto.de_tipo("game_start"))
+            assert game_id not in worker2.active_games
+
+            # Las jugadas se llevan al worker dueño de la partida y vuelven a los dos
+            await worker1.route_game_event(game_id, {"type": "move", "move": {"from_square": "e2", "to_square": "e4"}}, "ana")
+            await worker2.route_game_event(game_id, {"type": "move", "move": {"from_square": "e7", "to_square": "e5"}}, "beto")
+            await _esperar(lambda: len(ana.de_tipo("move")) == 2 and len(beto.de_tipo("move")) == 2)
+            assert [m["move"]["san"] for m in beto.de_tipo("move")] == ["e4", "e5"]
+            assert worker1.active_games[game_id].current_turn == "white"
+        finally:
+            await worker1.stop()
+            await worker2.stop()
+            await hub.cerrar()
+
+    asyncio.run(prueba())
+
+
+def test_worker_espera_a_que_arranque_el_hub():
+    async def prueba():
+        port = _puerto_libre()
+        backplane = BackplaneRed("127.0.0.1", port)
+        recibidos = []
+
+        async def al_recibir(mensaje):
+            recibidos.append(mensaje)
+
+        # El worker arranca antes que el hub (como con depends_on en docker compose)
+        arranque = asyncio.create_task(backplane.iniciar(al_recibir))
+        await asyncio.sleep(0.2)
+        assert not arranque.done()
+
+        hub = HubBackplane()
+        await hub.iniciar(port=port)
+        otro = BackplaneRed("127.0.0.1", port)
+        try:
+            await asyncio.wait_for(arranque, 5)
+            await otro.iniciar(al_recibir)
+            assert await backplane.reclamar("matchmaking") == backplane.worker_id
+            assert await otro.dueno("matchmaking") == backplane.worker_id
+        finally:
+            await otro.cerrar()
+            await backplane.cerrar()
+            await hub.cerrar()
+
+    asyncio.run(prueba())
+
+
+def test_reconexion_en_otro_worker_no_deja_la_partida_en_pausa():
+    async def prueba():
+        hub = HubBackplane()
+        port = await hub.iniciar(port=0)
+        worker1 = ConnectionManager(BackplaneRed("127.0.0.1", port))
+        worker2 = ConnectionManager(BackplaneRed("127.0.0.1", port))
+        await worker1.start()
+        await worker2.start()
+        ana_vieja, ana_nueva, beto = _WebSocket(), _WebSocket(), _WebSocket()
+        try:
+            await worker1.connect(ana_vieja, "ana")
+            await worker1.connect(beto, "beto")
+            game_id = await worker1.start_game("ana", "beto", 1200, 1200)
+            game = worker1.active_games[game_id]
+
+            # Ana se reconecta en el otro worker: el viejo cierra su socket y la partida sigue
+            await worker2.connect(ana_nueva, "ana")
+            await _esperar(lambda: ana_nueva.de_tipo("game_resumed"))
+            await _esperar(lambda: "ana" not in worker1.active_connections)
+            # El cierre del socket viejo llega después (ya no es la conexión de ana)
+            worker1.disconnect("ana", ana_vieja)
+            await asyncio.sleep(0.2)
+            assert game.status == "active"
+            assert not beto.de_tipo("opponent_disconnected")
+
+            # Si aun así quedó en pausa, al vencer el plazo con los dos conectados se reanuda
+            game.status = "paused"
+            worker1._stop_clock(game)
+            await worker1._on_abandon(game_id)
+            assert game.status == "active"
+            await _esperar(lambda: ana_nueva.de_tipo("game_resumed")[-1]["status"] == "active")
+        finally:
+            await worker1.stop()
+            await worker2.stop()
+            await hub.cerrar()
+
+    asyncio.run(prueba())
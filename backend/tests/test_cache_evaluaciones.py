@@ -0,0 +1,13 @@
+# /backend/tests/test_cache_evaluaciones.py
+"""
+Cache de evaluaciones: las entradas pendientes de persistir están acotadas.
+"""
+from utils.cache_evaluaciones import CacheEvaluaciones
+
+
+def test_pendientes_acotadas_sin_persistir():
+    cache = CacheEvaluaciones(3)
+    for i in range(10):
+        cache.guardar(f"fen{i}", {"cp": i})
+    assert list(cache._pendientes) == ["fen7", "fen8", "fen9"]
+    assert cache.obtener("fen9") == {"cp": 9}
@@ -0,0 +1,125 @@
+# /backend/tests/test_guardado_partidas.py
+"""
+Guardado de partidas terminadas contra una base de datos en memoria que
+entiende justo las operaciones que usa: repetir o reintentar no cuenta nada
+dos veces y el ELO se fija con el calculado al inicio de la partida.
+"""
+import asyncio
+import uuid
+from utils.guardado_partidas import GuardadoPartidas, id_partida, nuevos_elo
+from utils.partida_viva import PartidaViva
+
+
+class _Resultado:
+    def __init__(self, upserted_ids: dict):
+        self.upserted_ids = upserted_ids
+
+
+class _Coleccion:
+    def __init__(self, documentos: list = None):
+        self.documentos = documentos or []
+        self.fallos = 0
+
+    def _cumple(self, doc: dict, filtro: dict) -> bool:
+        for campo, condicion in filtro.items():
+            if isinstance(condicion, dict):
+                if condicion["$ne"] in doc.get(campo, []):
+                    return False
+            elif doc.get(campo) != condicion:
+                return False
+        return True
+
+    async def bulk_write(self, operaciones: list, ordered: bool = True):
+        if self.fallos:
+            self.fallos -= 1
+            raise ConnectionError("sin conexión")
+        insertados = {}
+        for i, op in enumerate(operaciones):
+            doc = next((d for d in self.documentos if self._cumple(d, op._filter)), None)
+            if not hasattr(op, "_doc"):
+                if doc is not None:
+                    self.documentos.remove(doc)
+                continue
+            cambios = op._doc
+            if doc is None:
+                if not op._upsert:
+                    continue
+                doc = {**op._filter, **cambios["$setOnInsert"]}
+                self.documentos.append(doc)
+                insertados[i] = doc["_id"]
+                continue
+            doc.update(cambios.get("$set", {}))
+            for campo, n in cambios.get("$inc", {}).items():
+                doc[campo] = doc.get(campo, 0) + n
+            for campo, valor in cambios.get("$push", {}).items():
+                doc[campo] = (doc.get(campo, []) + valor["$each"])[valor["$slice"]:]
+        return _Resultado(insertados)
+
+
+class _Db:
+    def __init__(self):
+        self.games = _Coleccion()
+        self.users = _Coleccion([{"username": "ana", "elo": 1500}, {"username": "beto", "elo": 1400}])
+        self.partidas_vivo = _Coleccion()
+
+
+def _terminada(resultado: str = "1-0") -> PartidaViva:
+    game = PartidaViva(str(uuid.uuid4()), "ana", "beto", 1500, 1400, 600, 0)
+    game.status = "finished"
+    game.result = resultado
+    return game
+
+
+def _usuario(db: _Db, username: str) -> dict:
+    return next(d for d in db.users.documentos if d["username"] == username)
+
+
+def test_volver_a_encolar_no_cuenta_dos_veces():
+    async def prueba():
+        db = _Db()
+        guardado = GuardadoPartidas(10_000, 100)
+        guardado._db = db
+        game = _terminada()
+        db.partidas_vivo.documentos.append({"_id": game.game_id})
+
+        nuevos = guardado.encolar(game)
+        # Recuperación tras una caída: la misma partida se encola otra vez
+        guardado.encolar(game)
+        assert guardado.pendiente(game.game_id)["_id"] == id_partida(game.game_id)
+        await guardado.vaciar()
+
+        assert [d["_id"] for d in db.games.documentos] == [id_partida(game.game_id)]
+        ana = _usuario(db, "ana")
+        assert ana["elo"] == nuevos["nuevo_elo_blancos"]
+        assert (ana["games_played"], ana["games_won"]) == (1, 1)
+        assert _usuario(db, "beto")["games_lost"] == 1
+        assert db.partidas_vivo.documentos == []
+        assert guardado.pendiente(game.game_id) is None
+
+    asyncio.run(prueba())
+
+
+def test_reintento_tras_fallo_de_users():
+    async def prueba():
+        db = _Db()
+        db.users.fallos = 1
+        guardado = GuardadoPartidas(10_000, 100)
+        guardado._db = db
+        game = _terminada("0-1")
+        db.partidas_vivo.documentos.append({"_id": game.game_id})
+        guardado.encolar(game)
+
+        await guardado.vaciar()
+        # La partida ya está en games, pero el diario se conserva hasta aplicar el ELO
+        assert len(db.games.documentos) == 1
+        assert "games_played" not in _usuario(db, "beto")
+        assert db.partidas_vivo.documentos != []
+
+        await guardado.vaciar()
+        beto = _usuario(db, "beto")
+        assert beto["elo"] == nuevos_elo(1500, 1400, "0-1")["nuevo_elo_negras"]
+        assert (beto["games_played"], beto["games_won"]) == (1, 1)
+        assert db.partidas_vivo.documentos == []
+        assert len(guardado) == 0
+
+    asyncio.run(prueba())
@@ -0,0 +1,29 @@
+# /backend/tests/test_lobby.py
+"""
+Índice del lobby: sin limit se listan todas; con limit, next_offset recorre el resto.
+"""
+from utils.lobby import IndiceLobby
+
+
+def _lobby(n: int) -> IndiceLobby:
+    lobby = IndiceLobby()
+    for i in range(n):
+        lobby.actualizar({"game_id": f"g{i}", "white_player": f"b{i}", "black_player": f"n{i}",
+                          "white_elo": 1200, "black_elo": 1200, "status": "active", "moves_count": 0})
+    return lobby
+
+
+def test_sin_limit_se_listan_todas():
+    pagina = _lobby(120).listar()
+    assert len(pagina["active_games"]) == pagina["total"] == 120
+    assert pagina["next_offset"] is None
+
+
+def test_next_offset_recorre_las_paginas():
+    lobby = _lobby(5)
+    vistas, offset = [], 0
+    while offset is not None:
+        pagina = lobby.listar(offset, 2)
+        vistas += [entrada["game_id"] for entrada in pagina["active_games"]]
+        offset = pagina["next_offset"]
+    assert vistas == [f"g{i}" for i in range(5)]
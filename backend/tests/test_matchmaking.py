@@ -0,0 +1,34 @@
+# /backend/tests/test_matchmaking.py
+"""
+Emparejador: rival más cercano dentro de la ventana, también entre buckets,
+y ventana que se ensancha con la espera.
+"""
+import time
+from utils.matchmaking import Emparejador
+
+
+def test_empareja_con_el_mas_cercano_aunque_este_en_otro_bucket():
+    cola = Emparejador(ventana_base=50, ensanche_por_segundo=0, ventana_maxima=50)
+    cola.agregar("ana", 1295)
+    cola.agregar("beto", 1250)
+    cola.agregar("carla", 1310)
+    cola.agregar("dani", 2000)
+    assert cola.emparejar() == [("ana", 1295, "carla", 1310)]
+    assert "beto" in cola and "dani" in cola
+    assert len(cola) == 2
+
+
+def test_la_ventana_se_ensancha_con_la_espera():
+    cola = Emparejador(ventana_base=50, ensanche_por_segundo=10, ventana_maxima=300)
+    cola.agregar("ana", 1200)
+    cola.agregar("beto", 1400)
+    assert cola.emparejar() == []
+    ahora = time.monotonic()
+    assert cola.ventana("ana", ahora + 15) == 200
+    assert cola.ventana("ana", ahora + 60) == 300
+    # Como si llevaran 20 s esperando
+    for username in ("ana", "beto"):
+        elo, desde = cola._esperando[username]
+        cola._esperando[username] = (elo, desde - 20)
+    assert cola.emparejar() == [("ana", 1200, "beto", 1400)]
+    assert len(cola) == 0
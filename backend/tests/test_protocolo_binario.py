@@ -0,0 +1,50 @@
+# /backend/tests/test_protocolo_binario.py
+"""
+Tramas binarias: ida y vuelta de JUGADA y MOVER, y el latido en los dos sentidos.
+"""
+import uuid
+import chess
+from utils import protocolo_binario as pb
+
+
+def test_jugada_ida_y_vuelta():
+    game_id = str(uuid.uuid4())
+    tablero = chess.Board("8/P7/8/8/8/8/8/k6K w - - 0 1")
+    move = chess.Move.from_uci("a7a8q")
+    tablero.push(move)
+    datos = pb.codificar_jugada(game_id, 1, move, {"white_time": 12.345, "black_time": 7.0},
+                                0xDEADBEEF, "finished", "black", "1-0", "timeout")
+    assert len(datos) == 39
+    assert pb.decodificar_jugada(datos) == {
+        "game_id": game_id,
+        "ply": 1,
+        "uci": "a7a8q",
+        "clock": {"white_time": 12.345, "black_time": 7.0},
+        "zobrist": 0xDEADBEEF,
+        "status": "finished",
+        "current_turn": "black",
+        "result": "1-0",
+        "reason": "timeout"
+    }
+
+
+def test_mover_se_lee_como_el_mensaje_json():
+    game_id = str(uuid.uuid4())
+    mensaje = pb.leer_trama(pb.codificar_mover(game_id, chess.Move.from_uci("e7e8n")))
+    assert mensaje == {
+        "type": "move",
+        "game_id": game_id,
+        "move": {"from_square": "e7", "to_square": "e8", "promotion": "n"}
+    }
+
+
+def test_latido():
+    assert pb.leer_trama(bytes([pb.TRAMA_PING])) == {"type": "ping"}
+    assert pb.leer_trama(bytes([pb.TRAMA_PONG_CLIENTE])) == {"type": "pong"}
+    # Las tramas del servidor no se aceptan como del cliente
+    for trama in (pb.PING, pb.PONG):
+        try:
+            pb.leer_trama(trama)
+            assert False, "debía rechazarse"
+        except ValueError:
+            pass
@@ -0,0 +1,32 @@
+# /backend/tests/test_relojes.py
+"""
+PlanificadorRelojes: un vencimiento lento no retrasa a los siguientes.
+"""
+import asyncio
+import time
+from utils.relojes import PlanificadorRelojes
+
+
+def test_un_vencimiento_lento_no_retrasa_a_los_demas():
+    async def prueba():
+        vencidos = {}
+
+        async def al_vencer(clave: str):
+            vencidos[clave] = time.monotonic()
+            if clave == "lenta":
+                await asyncio.sleep(0.5)
+            if clave == "falla":
+                raise RuntimeError("fallo")
+
+        relojes = PlanificadorRelojes()
+        await relojes.iniciar(al_vencer)
+        ahora = time.monotonic()
+        relojes.programar("lenta", ahora + 0.02)
+        relojes.programar("falla", ahora + 0.03)
+        relojes.programar("rapida", ahora + 0.05)
+        await asyncio.sleep(0.2)
+        assert set(vencidos) == {"lenta", "falla", "rapida"}
+        assert vencidos["rapida"] - ahora < 0.15
+        await relojes.cerrar()
+
+    asyncio.run(prueba())
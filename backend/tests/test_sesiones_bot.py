@@ -0,0 +1,88 @@
+# /backend/tests/test_sesiones_bot.py
+"""
+Sesiones contra Stockfish con un motor de mentira: el motor recibe la historia
+de la partida y la sesión termina en tablas por triple repetición.
+"""
+import asyncio
+from types import SimpleNamespace
+from utils.sesiones_bot import SesionesBot
+
+
+class _Coleccion:
+    def __init__(self):
+        self.documentos = {}
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    async def insert_one(self, doc: dict):
+        self.documentos[doc["_id"]] = dict(doc)
+
+    async def find_one(self, filtro: dict):
+        doc = self.documentos.get(filtro["_id"])
+        return dict(doc) if doc else None
+
+    async def update_one(self, filtro: dict, cambios: dict):
+        doc = self.documentos.get(filtro["_id"])
+        cumple = doc is not None and len(doc["movimientos"]) == filtro["movimientos"]["$size"]
+        if cumple:
+            doc.update(cambios["$set"])
+        return SimpleNamespace(matched_count=int(cumple))
+
+    async def delete_one(self, filtro: dict):
+        return SimpleNamespace(deleted_count=int(self.documentos.pop(filtro["_id"], None) is not None))
+
+
+class _Motor:
+    """Devuelve el caballo de rey a su casilla: g8f6, f6g8, g8f6..."""
+
+    def __init__(self):
+        self.posiciones = []
+
+    def set_skill_level(self, nivel: int):
+        pass
+
+    def set_fen_position(self, posicion: str, ucinewgame: bool = True):
+        self.posiciones.append(posicion)
+
+    def get_best_move(self) -> str:
+        jugadas = self.posiciones[-1].split(" moves ")[-1].split()
+        return "f6g8" if jugadas.count("g8f6") > jugadas.count("f6g8") else "g8f6"
+
+    def terminar(self):
+        pass
+
+    def vivo(self) -> bool:
+        return True
+
+
+class _Sesiones(SesionesBot):
+    def _crear_motor(self, nivel, elo):
+        self.motor = _Motor()
+        return self.motor
+
+
+def test_el_motor_ve_la_historia_y_la_repeticion_termina_la_partida():
+    async def prueba():
+        sesiones = _Sesiones("", 10, 2, 600)
+        await sesiones.iniciar(SimpleNamespace(sesiones_bot=_Coleccion()))
+        sesion = await sesiones.crear("white", nivel=5)
+        game_id = sesion["game_id"]
+
+        for jugada in ("Nf3", "Ng1", "Nf3"):
+            respuesta = await sesiones.jugar(game_id, jugada)
+            assert not respuesta["terminada"]
+        assert sesiones.motor.posiciones[-1].endswith("moves g1f3 g8f6 f3g1 f6g8 g1f3")
+
+        # Ng1 y el motor vuelve a g8: la posición inicial aparece por tercera vez
+        respuesta = await sesiones.jugar(game_id, "Ng1")
+        assert respuesta["jugada_stockfish"] == "f6g8"
+        assert (respuesta["terminada"], respuesta["resultado"]) == (True, "1/2-1/2")
+        try:
+            await sesiones.jugar(game_id, "Nf3")
+            assert False, "debía rechazarse"
+        except ValueError:
+            pass
+        await sesiones.cerrar()
+
+    asyncio.run(prueba())
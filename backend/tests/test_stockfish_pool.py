@@ -0,0 +1,77 @@
+# /backend/tests/test_stockfish_pool.py
+"""
+StockfishPool con motores de mentira (sin procesos): reserva de motores para
+las peticiones interactivas y plazas por usuario.
+"""
+import asyncio
+import threading
+import time
+from utils.stockfish_pool import StockfishPool, PRIORIDAD_INTERACTIVA, MotorSaturado
+from config import ENGINE_USER_MAX
+
+
+class _Motor:
+    def set_depth(self, depth: int):
+        pass
+
+    def terminar(self):
+        pass
+
+
+class _Pool(StockfishPool):
+    def _crear_motor(self):
+        motor = _Motor()
+        self._motores.append(motor)
+        return motor
+
+
+def _esperar(segundos: float):
+    def funcion(motor):
+        time.sleep(segundos)
+        return motor
+    return funcion
+
+
+def test_interactiva_no_espera_a_los_analisis():
+    async def prueba():
+        pool = _Pool("", 10, size=2, reservados=1)
+        await pool.iniciar()
+        # Dos análisis largos: solo uno puede ocupar motor, el otro espera
+        analisis = [asyncio.create_task(pool.ejecutar(_esperar(0.5))) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        inicio = time.perf_counter()
+        await pool.ejecutar(_esperar(0), prioridad=PRIORIDAD_INTERACTIVA)
+        assert time.perf_counter() - inicio < 0.2
+        await asyncio.gather(*analisis)
+        await pool.cerrar()
+
+    asyncio.run(prueba())
+
+
+def test_la_plaza_del_usuario_dura_lo_que_la_busqueda():
+    async def prueba():
+        pool = _Pool("", 10, size=ENGINE_USER_MAX + 2)
+        await pool.iniciar()
+        liberar = threading.Event()
+
+        def bloqueada(motor):
+            liberar.wait(2)
+
+        # El cliente abandona sus peticiones, pero las búsquedas siguen en sus hilos
+        for _ in range(ENGINE_USER_MAX):
+            peticion = asyncio.create_task(pool.ejecutar(bloqueada, usuario="ana"))
+            await asyncio.sleep(0.05)
+            peticion.cancel()
+        await asyncio.sleep(0.05)
+        try:
+            await pool.ejecutar(bloqueada, usuario="ana")
+            assert False, "debía rechazarse"
+        except MotorSaturado:
+            pass
+
+        liberar.set()
+        await asyncio.sleep(0.1)
+        assert await pool.ejecutar(_esperar(0), usuario="ana") is not None
+        await pool.cerrar()
+
+    asyncio.run(prueba())
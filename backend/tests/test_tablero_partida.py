@@ -0,0 +1,37 @@
+# /backend/tests/test_tablero_partida.py
+"""
+TableroPartida: el hash incremental coincide con el polyglot de python-chess
+y las repeticiones se cuentan con él.
+"""
+import chess
+import chess.polyglot
+from utils.chess_validation import TableroPartida
+
+
+def _jugar(tablero: TableroPartida, uci: str):
+    tablero.jugar(tablero.leer_jugada(uci[:2], uci[2:4], uci[4:] or None))
+
+
+def test_hash_incremental_igual_al_polyglot():
+    # Enroques, captura al paso y coronación: las jugadas que tocan más de dos casillas
+    jugadas = ["e2e4", "g8f6", "e4e5", "d7d5", "e5d6", "e7e6", "g1f3", "f8e7", "f1e2",
+               "e8g8", "e1g1", "b7b5", "d6c7", "b8c6", "c7d8q"]
+    tablero = TableroPartida()
+    referencia = chess.Board()
+    for uci in jugadas:
+        _jugar(tablero, uci)
+        referencia.push_uci(uci)
+        assert tablero.hash == chess.polyglot.zobrist_hash(referencia), uci
+
+
+def test_repeticiones():
+    tablero = TableroPartida()
+    for _ in range(2):
+        for uci in ("g1f3", "g8f6", "f3g1", "f6g8"):
+            _jugar(tablero, uci)
+    assert tablero.tablas_reclamables() == "threefold_repetition"
+    assert tablero.estado_final() is None
+    for _ in range(2):
+        for uci in ("g1f3", "g8f6", "f3g1", "f6g8"):
+            _jugar(tablero, uci)
+    assert tablero.estado_final() == ("1/2-1/2", "fivefold_repetition")
@@ -0,0 +1,317 @@
+# /backend/utils/backplane.py
+"""
+Backplane entre workers para las partidas en vivo.
+
+Cada worker de uvicorn tiene su propio ConnectionManager; el backplane le dice
+en qué worker está conectado cada usuario y qué worker es dueño de cada partida
+(y de la cola de matchmaking), y lleva los mensajes de un worker a otro.
+
+- BackplaneMemoria: un solo proceso (por defecto, sin servicios externos).
+- BackplaneRed: cliente del hub TCP de este módulo, que se arranca con
+  `python -m utils.backplane --port 8765`. Protocolo de líneas JSON.
+
+Claves del directorio: "usuario:<username>", "partida:<game_id>", "matchmaking".
+Canales: "worker:<id>" (mensajes para un worker) y "todos" (difusión).
+publicar nunca entrega el mensaje al worker que lo envía.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import uuid
+
+CANAL_TODOS = "todos"
+
+def canal_worker(worker_id: str) -> str:
+    return f"worker:{worker_id}"
+
+class BackplaneMemoria:
+    """Backplane de un solo proceso: directorio y canales en diccionarios"""
+
+    def __init__(self):
+        self.worker_id = str(uuid.uuid4())
+        self._duenos: dict[str, str] = {}
+        self._al_recibir = None
+
+    async def iniciar(self, al_recibir):
+        """al_recibir(mensaje) es una corrutina que procesa los mensajes para este worker"""
+        self._al_recibir = al_recibir
+
+    async def cerrar(self):
+        self._al_recibir = None
+        self._duenos.clear()
+
+    async def reclamar(self, clave: str, forzar: bool = False) -> str:
+        """Se queda con la clave si está libre (o siempre, con forzar); devuelve el dueño actual"""
+        if forzar:
+            self._duenos[clave] = self.worker_id
+        return self._duenos.setdefault(clave, self.worker_id)
+
+    async def liberar(self, clave: str):
+        """Suelta la clave solo si este worker sigue siendo su dueño"""
+        if self._duenos.get(clave) == self.worker_id:
+            del self._duenos[clave]
+
+    async def dueno(self, clave: str):
+        return self._duenos.get(clave)
+
+    async def publicar(self, canal: str, mensaje: dict):
+        # Con un único worker no hay nadie más a quien entregar
+        return
+
+    async def enviar_a_worker(self, worker_id: str, mensaje: dict):
+        await self.publicar(canal_worker(worker_id), mensaje)
+
+
+class BackplaneRed:
+    """
+    Cliente del hub TCP. Las respuestas se emparejan por id; los mensajes de
+    otros workers se procesan en orden en una tarea aparte, para que el
+    manejador pueda a su vez consultar el hub sin bloquear la lectura.
+    Si la conexión se cae, se reconecta y vuelve a reclamar sus claves.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.worker_id = str(uuid.uuid4())
+        self._reader: asyncio.StreamReader = None
+        self._writer: asyncio.StreamWriter = None
+        self._al_recibir = None
+        self._ids = itertools.count()
+        self._pendientes: dict[int, asyncio.Future] = {}
+        # Claves que este worker tiene reclamadas (para recuperarlas al reconectar)
+        self._claves: set[str] = set()
+        self._entrantes: asyncio.Queue = None
+        self._tareas: list = []
+        self._conectado: asyncio.Event = None
+        self._cerrando = False
+
+    async def iniciar(self, al_recibir):
+        self._al_recibir = al_recibir
+        self._entrantes = asyncio.Queue()
+        self._conectado = asyncio.Event()
+        self._cerrando = False
+        # El hub puede no estar listo todavía (depends_on no espera a que escuche)
+        await self._conectar_con_reintentos()
+        self._tareas = [asyncio.create_task(self._leer()), asyncio.create_task(self._despachar())]
+        print(f"Backplane conectado a {self.host}:{self.port} como worker {self.worker_id}")
+
+    async def cerrar(self):
+        self._cerrando = True
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _conectar(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._escribir({"op": "hola", "worker": self.worker_id})
+        for canal in (canal_worker(self.worker_id), CANAL_TODOS):
+            self._escribir({"op": "suscribir", "canal": canal})
+        # Sin forzar: si otro worker la tomó mientras tanto (p. ej. el usuario se reconectó allí), es suya
+        for clave in self._claves:
+            self._escribir({"op": "reclamar", "clave": clave})
+        self._conectado.set()
+
+    def _escribir(self, datos: dict):
+        self._writer.write(json.dumps(datos).encode() + b"\n")
+
+    async def _leer(self):
+        while True:
+            try:
+                linea = await self._reader.readline()
+                if not linea:
+                    raise ConnectionError("el hub cerró la conexión")
+            except (ConnectionError, OSError) as e:
+                if self._cerrando:
+                    return
+                await self._reconectar(e)
+                continue
+
+            datos = json.loads(linea)
+            if datos.get("op") == "mensaje":
+                self._entrantes.put_nowait(datos["mensaje"])
+            else:
+                futuro = self._pendientes.pop(datos.get("id"), None)
+                if futuro is not None and not futuro.done():
+                    futuro.set_result(datos)
+
+    async def _reconectar(self, error: Exception):
+        print(f"Backplane desconectado ({error}); reintentando")
+        self._conectado.clear()
+        for futuro in self._pendientes.values():
+            if not futuro.done():
+                futuro.set_exception(ConnectionError("backplane no disponible"))
+        self._pendientes.clear()
+        await self._conectar_con_reintentos()
+        print("Backplane reconectado")
+
+    async def _conectar_con_reintentos(self):
+        """Reintenta la conexión con espera creciente (hasta 10 s) hasta que el hub responde"""
+        espera = 0.5
+        while not self._cerrando:
+            try:
+                await self._conectar()
+                return
+            except OSError as e:
+                print(f"Hub del backplane en {self.host}:{self.port} no disponible ({e}); reintento en {espera} s")
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 10)
+
+    async def _despachar(self):
+        while True:
+            mensaje = await self._entrantes.get()
+            try:
+                await self._al_recibir(mensaje)
+            except Exception as e:
+                print(f"Error procesando un mensaje del backplane: {e}")
+
+    async def _pedir(self, op: str, **datos) -> dict:
+        await self._conectado.wait()
+        pedido_id = next(self._ids)
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendientes[pedido_id] = futuro
+        self._escribir({"op": op, "id": pedido_id, **datos})
+        return await futuro
+
+    async def reclamar(self, clave: str, forzar: bool = False) -> str:
+        respuesta = await self._pedir("reclamar", clave=clave, forzar=forzar)
+        if respuesta["dueno"] == self.worker_id:
+            self._claves.add(clave)
+        return respuesta["dueno"]
+
+    async def liberar(self, clave: str):
+        self._claves.discard(clave)
+        await self._pedir("liberar", clave=clave)
+
+    async def dueno(self, clave: str):
+        return (await self._pedir("dueno", clave=clave))["dueno"]
+
+    async def publicar(self, canal: str, mensaje: dict):
+        await self._conectado.wait()
+        self._escribir({"op": "publicar", "canal": canal, "mensaje": mensaje})
+
+    async def enviar_a_worker(self, worker_id: str, mensaje: dict):
+        await self.publicar(canal_worker(worker_id), mensaje)
+
+
+class HubBackplane:
+    """
+    Hub al que se conectan los workers: guarda el directorio de claves y
+    reparte los mensajes publicados. Cuando un worker se desconecta, sus
+    claves quedan libres para que otro las reclame.
+    """
+
+    def __init__(self):
+        self._duenos: dict[str, str] = {}
+        # Conexión por la que se reclamó cada clave: al caer esa conexión se libera
+        # (si el worker ya se reconectó por otra, la clave es de la nueva)
+        self._conexion: dict[str, asyncio.StreamWriter] = {}
+        self._canales: dict[str, set] = {}
+        # Conexión → tarea que la atiende
+        self._atenciones: dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._servidor: asyncio.AbstractServer = None
+
+    async def iniciar(self, host: str = "127.0.0.1", port: int = 8765) -> int:
+        """Empieza a escuchar; devuelve el puerto (útil con port=0)"""
+        self._servidor = await asyncio.start_server(self._atender, host, port)
+        return self._servidor.sockets[0].getsockname()[1]
+
+    async def cerrar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            # Cerrar cada conexión hace que su tarea termine por sí sola
+            for writer in list(self._atenciones):
+                writer.close()
+            await asyncio.gather(*self._atenciones.values(), return_exceptions=True)
+            await self._servidor.wait_closed()
+            self._servidor = None
+
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        canales = set()
+        claves = set()
+        self._atenciones[writer] = asyncio.current_task()
+
+        def responder(datos: dict):
+            writer.write(json.dumps(datos).encode() + b"\n")
+
+        try:
+            async for linea in reader:
+                datos = json.loads(linea)
+                op = datos.get("op")
+
+                if op == "hola":
+                    worker_id = datos["worker"]
+
+                elif op == "suscribir":
+                    self._canales.setdefault(datos["canal"], set()).add(writer)
+                    canales.add(datos["canal"])
+
+                elif op == "publicar":
+                    salida = json.dumps({"op": "mensaje", "canal": datos["canal"],
+                                         "mensaje": datos["mensaje"]}).encode() + b"\n"
+                    for destino in self._canales.get(datos["canal"], ()):
+                        if destino is not writer:
+                            destino.write(salida)
+
+                elif op == "reclamar":
+                    clave = datos["clave"]
+                    anterior = self._duenos.get(clave)
+                    if anterior is None or datos.get("forzar"):
+                        self._duenos[clave] = worker_id
+                        self._conexion[clave] = writer
+                        claves.add(clave)
+                    if "id" in datos:
+                        responder({"id": datos["id"], "dueno": self._duenos[clave]})
+
+                elif op == "liberar":
+                    clave = datos["clave"]
+                    if self._duenos.get(clave) == worker_id:
+                        del self._duenos[clave]
+                        del self._conexion[clave]
+                    responder({"id": datos["id"]})
+
+                elif op == "dueno":
+                    responder({"id": datos["id"], "dueno": self._duenos.get(datos["clave"])})
+
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError) as e:
+            print(f"Worker {worker_id} desconectado del hub: {e}")
+        finally:
+            for canal in canales:
+                self._canales.get(canal, set()).discard(writer)
+            for clave in claves:
+                if self._conexion.get(clave) is writer:
+                    del self._duenos[clave]
+                    del self._conexion[clave]
+            self._atenciones.pop(writer, None)
+            writer.close()
+
+
+def crear_backplane(url: str):
+    """"" → en memoria; "tcp://host:puerto" → hub en red"""
+    if not url:
+        return BackplaneMemoria()
+    if not url.startswith("tcp://"):
+        raise ValueError(f"BACKPLANE_URL no soportada: {url}")
+    host, _, port = url[len("tcp://"):].rpartition(":")
+    return BackplaneRed(host, int(port))
+
+
+async def _servir(host: str, port: int):
+    hub = HubBackplane()
+    port = await hub.iniciar(host, port)
+    print(f"Hub del backplane escuchando en {host}:{port}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hub del backplane de partidas en vivo")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    argumentos = parser.parse_args()
+    asyncio.run(_servir(argumentos.host, argumentos.port))
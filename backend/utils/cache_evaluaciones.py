@@ -0,0 +1,111 @@
+# /backend/utils/cache_evaluaciones.py
+import threading
+from collections import OrderedDict
+from pymongo import UpdateOne
+from config import EVAL_CACHE_SIZE
+
+def normalizar_fen(fen: str) -> str:
+    """Quita los contadores de medio movimiento y de jugada: no cambian la evaluación"""
+    return " ".join(fen.split(" ")[:4])
+
+def clave_evaluacion(fen: str, profundidad, variantes: int = 1, nodos: int = None) -> str:
+    # Las búsquedas limitadas por nodos se guardan aparte de las de profundidad
+    limite = f"n{nodos}" if nodos else f"d{profundidad}"
+    return f"{normalizar_fen(fen)}|{limite}|m{variantes}"
+
+class CacheEvaluaciones:
+    """
+    Cache de evaluaciones de Stockfish en dos niveles:
+    - memoria: LRU acotado, consultado desde los hilos del pool (obtener/guardar)
+    - MongoDB (colección "evaluaciones"): sobrevive a reinicios. Se lee antes de
+      usar el motor (precargar) y se escribe al terminar (persistir).
+    """
+
+    def __init__(self, tamano: int):
+        self.tamano = tamano
+        self._memoria: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Entradas nuevas que aún no se escribieron en Mongo
+        self._pendientes: dict = {}
+        # Entradas traídas de Mongo que todavía no se consultaron
+        self._desde_mongo: set = set()
+        self.aciertos_memoria = 0
+        self.aciertos_mongo = 0
+        self.fallos = 0
+
+    def _insertar(self, clave: str, valor: dict):
+        self._memoria[clave] = valor
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.tamano:
+            antigua, _ = self._memoria.popitem(last=False)
+            self._desde_mongo.discard(antigua)
+
+    def obtener(self, clave: str):
+        with self._lock:
+            valor = self._memoria.get(clave)
+            if valor is None:
+                self.fallos += 1
+                return None
+            self._memoria.move_to_end(clave)
+            if clave in self._desde_mongo:
+                self._desde_mongo.discard(clave)
+                self.aciertos_mongo += 1
+            else:
+                self.aciertos_memoria += 1
+            return valor
+
+    def guardar(self, clave: str, valor: dict):
+        with self._lock:
+            self._insertar(clave, valor)
+            self._pendientes[clave] = valor
+            # Si nadie llama a persistir, se pierden las más antiguas en vez de crecer sin límite
+            while len(self._pendientes) > self.tamano:
+                del self._pendientes[next(iter(self._pendientes))]
+
+    async def precargar(self, db, claves: list[str]):
+        """Trae de Mongo las claves que no están en memoria"""
+        with self._lock:
+            faltantes = list({c for c in claves if c not in self._memoria})
+        if not faltantes:
+            return
+        try:
+            documentos = await db.evaluaciones.find({"_id": {"$in": faltantes}}).to_list(None)
+        except Exception as e:
+            print(f"Error al leer la cache de evaluaciones: {e}")
+            return
+        with self._lock:
+            for doc in documentos:
+                clave = doc.pop("_id")
+                self._insertar(clave, doc)
+                self._desde_mongo.add(clave)
+
+    async def persistir(self, db):
+        """Escribe en Mongo las evaluaciones nuevas"""
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        if not pendientes:
+            return
+        operaciones = [
+            UpdateOne({"_id": clave}, {"$set": valor}, upsert=True)
+            for clave, valor in pendientes.items()
+        ]
+        try:
+            await db.evaluaciones.bulk_write(operaciones, ordered=False)
+        except Exception as e:
+            print(f"Error al guardar la cache de evaluaciones: {e}")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            aciertos = self.aciertos_memoria + self.aciertos_mongo
+            consultas = aciertos + self.fallos
+            return {
+                "entradas_memoria": len(self._memoria),
+                "tamano_maximo": self.tamano,
+                "aciertos_memoria": self.aciertos_memoria,
+                "aciertos_mongo": self.aciertos_mongo,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(aciertos / consultas, 4) if consultas else 0.0
+            }
+
+# Instancia global de la cache
+cache_evaluaciones = CacheEvaluaciones(EVAL_CACHE_SIZE)
@@ -1,12 +1,15 @@
 # /backend/utils/chess_validation.py
 """
-Utilidades básicas para validación de movimientos de ajedrez.
-Para una implementación completa, considera usar python-chess library.
+Utilidades para validación de movimientos de ajedrez: comprobaciones de formato
+y el tablero autoritativo de cada partida en vivo (python-chess).
 """
+import chess
+import chess.polyglot
+from collections import Counter
 
 def is_valid_square(square: str) -> bool:
     """Verifica si una casilla es válida (a1-h8)"""
-    if len(square) != 2:
+    if not isinstance(square, str) or len(square) != 2:
         return False
     
     file = square[0].lower()
@@ -16,11 +19,14 @@ def is_valid_square(square: str) -> bool:
 
 def is_valid_piece(piece: str) -> bool:
     """Verifica si una pieza es válida"""
-    return piece.upper() in ['K', 'Q', 'R', 'B', 'N', 'P']
+    return isinstance(piece, str) and piece.upper() in ['K', 'Q', 'R', 'B', 'N', 'P']
 
 def validate_move_format(move_data: dict) -> bool:
-    """Validación básica de formato de movimiento"""
-    required_fields = ['from_square', 'to_square', 'piece', 'san', 'fen']
+    """
+    Validación básica de formato de movimiento. San y fen los calcula el
+    servidor con su tablero, así que no son obligatorios.
+    """
+    required_fields = ['from_square', 'to_square']
     
     for field in required_fields:
         if field not in move_data:
@@ -32,7 +38,11 @@ def validate_move_format(move_data: dict) -> bool:
     if not is_valid_square(move_data['to_square']):
         return False
     
-    if not is_valid_piece(move_data['piece']):
+    if move_data.get('piece') and not is_valid_piece(move_data['piece']):
+        return False
+
+    promotion = move_data.get('promotion')
+    if promotion and (not isinstance(promotion, str) or promotion.upper() not in ['Q', 'R', 'B', 'N']):
         return False
     
     return True
@@ -56,3 +66,110 @@ def validate_fen(fen: str) -> bool:
 
 # FEN inicial estándar
 STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+_ZOBRIST = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_HASHER = chess.polyglot.ZobristHasher(_ZOBRIST)
+
+def _clave_pieza(pieza: chess.Piece, casilla: int) -> int:
+    # Mismo índice que chess.polyglot: (tipo - 1) * 2 + color (negras 0, blancas 1)
+    return _ZOBRIST[64 * ((pieza.piece_type - 1) * 2 + int(pieza.color)) + casilla]
+
+class TableroPartida:
+    """
+    Tablero autoritativo de una partida en vivo. Se actualiza jugada a jugada y
+    mantiene el hash Zobrist (compatible con polyglot) de forma incremental: solo
+    se recalculan las casillas que cambian, sin reconstruir el FEN ni rehacer
+    la lista de jugadas. Con él, las repeticiones son un contador.
+
+    No guarda historial: la pila de jugadas de python-chess se vacía en cada
+    jugada, y el contador de repeticiones se reinicia tras capturas y movimientos
+    de peón (una posición anterior ya no puede repetirse).
+    """
+
+    __slots__ = ("board", "_hash_piezas", "hash", "repeticiones")
+
+    def __init__(self, fen: str = STARTING_FEN):
+        self.board = chess.Board(fen)
+        self._hash_piezas = _HASHER.hash_board(self.board)
+        self.hash = self._hash_completo()
+        self.repeticiones = Counter({self.hash: 1})
+
+    def _hash_completo(self) -> int:
+        # Enroques, al paso y turno son O(1); las piezas se llevan aparte
+        return (self._hash_piezas ^ _HASHER.hash_castling(self.board) ^
+                _HASHER.hash_ep_square(self.board) ^ _HASHER.hash_turn(self.board))
+
+    def _casillas_afectadas(self, jugada: chess.Move) -> set[int]:
+        casillas = {jugada.from_square, jugada.to_square}
+        if self.board.is_en_passant(jugada):
+            casillas.add(jugada.to_square + (-8 if self.board.turn == chess.WHITE else 8))
+        elif self.board.is_castling(jugada):
+            fila = chess.square_rank(jugada.from_square)
+            if self.board.is_kingside_castling(jugada):
+                casillas |= {chess.square(7, fila), chess.square(5, fila), chess.square(6, fila)}
+            else:
+                casillas |= {chess.square(0, fila), chess.square(3, fila), chess.square(2, fila)}
+        return casillas
+
+    def leer_jugada(self, desde: str, hasta: str, promocion: str = None) -> chess.Move:
+        """Jugada legal a partir de casillas; ValueError si no lo es"""
+        try:
+            jugada = chess.Move.from_uci(f"{desde}{hasta}{(promocion or '').lower()}")
+        except ValueError:
+            raise ValueError("Formato de movimiento inválido")
+        # Un peón que llega a la última fila sin pieza indicada corona dama
+        if (not jugada.promotion and self.board.piece_type_at(jugada.from_square) == chess.PAWN
+                and chess.square_rank(jugada.to_square) in (0, 7)):
+            jugada.promotion = chess.QUEEN
+        if not self.board.is_legal(jugada):
+            raise ValueError("Movimiento ilegal")
+        return jugada
+
+    def jugar(self, jugada: chess.Move) -> str:
+        """Aplica una jugada legal y devuelve su SAN"""
+        san = self.board.san(jugada)
+        casillas = list(self._casillas_afectadas(jugada))
+        antes = [self.board.piece_at(c) for c in casillas]
+        self.board.push(jugada)
+        self.board.clear_stack()
+        for casilla, pieza in zip(casillas, antes):
+            despues = self.board.piece_at(casilla)
+            if pieza != despues:
+                if pieza:
+                    self._hash_piezas ^= _clave_pieza(pieza, casilla)
+                if despues:
+                    self._hash_piezas ^= _clave_pieza(despues, casilla)
+        self.hash = self._hash_completo()
+        if self.board.halfmove_clock == 0:
+            self.repeticiones = Counter()
+        self.repeticiones[self.hash] += 1
+        return san
+
+    def fen(self) -> str:
+        return self.board.fen()
+
+    def estado_final(self):
+        """
+        (resultado, motivo) si la partida terminó con esta posición; None si sigue.
+        Solo lo que acaba la partida sin que nadie lo pida: la quíntuple
+        repetición y las 75 jugadas. La triple y las 50 hay que reclamarlas.
+        """
+        if self.board.is_checkmate():
+            return ("0-1" if self.board.turn == chess.WHITE else "1-0"), "checkmate"
+        if self.board.is_stalemate():
+            return "1/2-1/2", "stalemate"
+        if self.board.is_insufficient_material():
+            return "1/2-1/2", "insufficient_material"
+        if self.repeticiones[self.hash] >= 5:
+            return "1/2-1/2", "fivefold_repetition"
+        if self.board.halfmove_clock >= 150:
+            return "1/2-1/2", "seventyfive_moves"
+        return None
+
+    def tablas_reclamables(self):
+        """Motivo por el que se pueden reclamar tablas en esta posición; None si no se puede"""
+        if self.repeticiones[self.hash] >= 3:
+            return "threefold_repetition"
+        if self.board.halfmove_clock >= 100:
+            return "fifty_moves"
+        return None
@@ -0,0 +1,160 @@
+# /backend/utils/diario_partidas.py
+import asyncio
+import time
+from datetime import datetime
+from pymongo import UpdateOne, DeleteOne
+from utils.metricas import metricas
+from config import JOURNAL_FLUSH_MS, JOURNAL_BATCH_MAX
+
+class DiarioPartidas:
+    """
+    Diario de las partidas en vivo (colección partidas_vivo), escrito en segundo
+    plano: las jugadas se anotan en memoria y se vuelcan en lote con un solo
+    bulk_write cada intervalo_ms (o antes si hay lote_maximo partidas
+    pendientes), así que jugar no espera a MongoDB.
+
+    Lo pendiente se agrupa por partida: las jugadas y cambios de estado de una
+    misma partida se funden en un único $set (la jugada N va en moves.N y el
+    estado nuevo pisa al viejo), y borrarla descarta lo que tuviera pendiente.
+    Así, aunque MongoDB no responda durante un rato, lo acumulado no pasa de
+    una entrada por partida en vivo. Todas las operaciones son idempotentes, de
+    modo que si un volcado falla a medias se puede repetir entero.
+    """
+
+    def __init__(self, intervalo_ms: int, lote_maximo: int):
+        self.intervalo_ms = intervalo_ms
+        self.lote_maximo = lote_maximo
+        self._db = None
+        # game_id → {"crear": cabecera o None, "set": campos, "borrar": bool}, en orden de llegada
+        self._pendientes: dict[str, dict] = {}
+        self._despertar: asyncio.Event = None
+        self._tarea: asyncio.Task = None
+
+    async def iniciar(self, db):
+        self._db = db
+        self._despertar = asyncio.Event()
+        self._tarea = asyncio.create_task(self._vaciar_periodicamente())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        await self.vaciar()
+        self._db = None
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def _anotar(self, game_id: str, crear: dict = None, campos: dict = None, borrar: bool = False):
+        # Sin base de datos (p. ej. antes del startup) no hay diario
+        if self._db is None:
+            return
+        pendiente = self._pendientes.get(game_id)
+        if pendiente is None:
+            self._pendientes[game_id] = {"crear": crear, "set": dict(campos or {}), "borrar": borrar}
+            if len(self._pendientes) >= self.lote_maximo:
+                self._despertar.set()
+            return
+        metricas.incrementar("diario.fusionadas")
+        _fusionar(pendiente, {"crear": crear, "set": campos or {}, "borrar": borrar})
+
+    def crear(self, game):
+        """game es una PartidaViva recién creada"""
+        cabecera = {k: v for k, v in game.as_dict().items() if k not in ("game_id", "moves")}
+        self._anotar(game.game_id, crear={**cabecera, "moves": []})
+
+    def jugada(self, game, move: dict):
+        """Anota la última jugada de la partida (sin su FEN) y el estado que deja"""
+        ply = len(game.moves) - 1
+        self._anotar(game.game_id, campos={
+            f"moves.{ply}": {k: v for k, v in move.items() if k != "fen"},
+            "current_turn": game.current_turn,
+            "current_fen": move.get("fen") or game.current_fen,
+            "status": game.status,
+            "result": game.result,
+            "winner": game.winner,
+            "end_reason": game.end_reason,
+            "time_control": game.time_control,
+            "updated_at": game.updated_at
+        })
+
+    def estado(self, game):
+        """Anota cambios de estado sin jugada (pausa, reanudación, abandono, tiempo)"""
+        self._anotar(game.game_id, campos={
+            "status": game.status,
+            "result": game.result,
+            "winner": game.winner,
+            "end_reason": game.end_reason,
+            "time_control": game.time_control,
+            "updated_at": datetime.utcnow()
+        })
+
+    def borrar(self, game_id: str):
+        self._anotar(game_id, borrar=True)
+
+    async def vaciar(self):
+        if not self._pendientes or self._db is None:
+            return
+        pendientes, self._pendientes = self._pendientes, {}
+        operaciones = []
+        for game_id, pendiente in pendientes.items():
+            if pendiente["borrar"]:
+                operaciones.append(DeleteOne({"_id": game_id}))
+                continue
+            # La creación va aparte y antes: $setOnInsert y $set no pueden tocar los mismos campos
+            if pendiente["crear"] is not None:
+                operaciones.append(UpdateOne({"_id": game_id}, {"$setOnInsert": pendiente["crear"]}, upsert=True))
+            if pendiente["set"]:
+                operaciones.append(UpdateOne({"_id": game_id}, {"$set": pendiente["set"]}))
+        inicio = time.perf_counter()
+        try:
+            await self._db.partidas_vivo.bulk_write(operaciones, ordered=True)
+            metricas.observar("diario.vaciado", (time.perf_counter() - inicio) * 1000)
+        except Exception as e:
+            print(f"Error al escribir el diario de partidas ({len(pendientes)} partidas): {e}")
+            metricas.incrementar("diario.errores")
+            # Se reintenta en el próximo volcado, fundido con lo anotado mientras tanto
+            for game_id, nuevo in self._pendientes.items():
+                if game_id in pendientes:
+                    _fusionar(pendientes[game_id], nuevo)
+                else:
+                    pendientes[game_id] = nuevo
+            self._pendientes = pendientes
+
+    async def _vaciar_periodicamente(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                await self.vaciar()
+            except Exception as e:
+                # Un fallo inesperado no puede parar el diario
+                print(f"Error en el volcado periódico del diario: {e}")
+                metricas.incrementar("diario.errores")
+
+    async def leer(self, game_id: str):
+        """Documento de una partida del diario (None si no está); puede ir un volcado por detrás"""
+        return await self._db.partidas_vivo.find_one({"_id": game_id})
+
+    async def sin_terminar(self) -> list[dict]:
+        """Partidas del diario que no llegaron a terminar (para rehidratarlas al arrancar)"""
+        return await self._db.partidas_vivo.find({"status": {"$in": ["active", "paused"]}}).to_list(None)
+
+    async def terminadas(self) -> list[dict]:
+        """Partidas que terminaron pero cuyo guardado no llegó a completarse"""
+        return await self._db.partidas_vivo.find({"status": "finished"}).to_list(None)
+
+def _fusionar(pendiente: dict, nuevo: dict):
+    """Funde en pendiente lo anotado después para la misma partida"""
+    if nuevo["borrar"]:
+        pendiente.update(crear=None, set={}, borrar=True)
+        return
+    if pendiente["crear"] is None:
+        pendiente["crear"] = nuevo["crear"]
+    pendiente["set"].update(nuevo["set"])
+
+# Instancia global del diario
+diario_partidas = DiarioPartidas(JOURNAL_FLUSH_MS, JOURNAL_BATCH_MAX)
@@ -0,0 +1,7 @@
+# /backend/utils/elo.py
+
+def calcular_nuevo_elo(rating_a, rating_b, resultado):
+    # resultado: 1.0 si gana A, 0.5 tablas, 0.0 derrota
+    K = 32
+    expected_score = 1 / (1 + 10 ** ((rating_b - rating_a) / 400))
+    return int(rating_a + K * (resultado - expected_score))
@@ -0,0 +1,196 @@
+# /backend/utils/guardado_partidas.py
+import asyncio
+import time
+import uuid
+from bson import ObjectId
+from pymongo import UpdateOne, DeleteOne
+from utils.elo import calcular_nuevo_elo
+from utils.metricas import metricas
+from config import GAME_SAVE_FLUSH_MS, GAME_SAVE_BATCH_MAX
+
+RESULTADO_BLANCAS = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+# Últimas partidas aplicadas a cada usuario; basta con cubrir los reintentos pendientes
+PARTIDAS_CONTADAS_MAX = 200
+
+class GuardadoPartidas:
+    """
+    Guarda en segundo plano las partidas en vivo que terminan: la partida se
+    encola al acabar (ya sin ocupar memoria en el manager) y cada intervalo_ms
+    se escribe todo lo acumulado con un bulk_write por colección.
+
+    Tres etapas, cada una con su cola y reintento propio:
+    1. games: upsert por live_game_id ($setOnInsert), así repetir no duplica.
+       El _id sale del game_id (id_partida) para conocerlo antes de escribir.
+    2. users: ELO y estadísticas. Como siempre, el ELO nuevo se calcula con los
+       ELO del inicio de la partida y se fija con $set; el lote va en orden, así
+       que si un jugador acaba dos partidas a la vez se queda el de la última.
+       Cada usuario guarda en partidas_contadas las últimas partidas ya
+       aplicadas y el filtro las excluye: reintentar un lote (o volver a
+       encolar una partida tras una caída entre etapas) no cuenta nada dos veces.
+    3. partidas_vivo: se borra la entrada del diario solo cuando lo anterior
+       está escrito; si el servidor cae antes, la partida se vuelve a encolar
+       al arrancar.
+    """
+
+    def __init__(self, intervalo_ms: int, lote_maximo: int):
+        self.intervalo_ms = intervalo_ms
+        self.lote_maximo = lote_maximo
+        self._db = None
+        self._partidas: list[dict] = []
+        self._usuarios: list = []
+        self._diario: list = []
+        self._despertar: asyncio.Event = None
+        self._tarea: asyncio.Task = None
+
+    async def iniciar(self, db):
+        self._db = db
+        self._despertar = asyncio.Event()
+        try:
+            await db.games.create_index("live_game_id", unique=True, sparse=True)
+        except Exception as e:
+            print(f"No se pudo crear el índice de live_game_id: {e}")
+        self._tarea = asyncio.create_task(self._vaciar_periodicamente())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        await self.vaciar()
+        self._db = None
+
+    def __len__(self):
+        return len(self._partidas) + len(self._usuarios) + len(self._diario)
+
+    def encolar(self, game) -> dict:
+        """Encola una PartidaViva terminada; devuelve los ELO nuevos"""
+        documento = documento_partida(game)
+        nuevos = nuevos_elo(game.white_elo, game.black_elo, game.result)
+        self._partidas.append({
+            "game_id": game.game_id,
+            "documento": documento,
+            "usuarios": [
+                _aplicar_partida(game.white_player, game.game_id, nuevos["nuevo_elo_blancos"], {
+                    "games_played": 1,
+                    "games_won": 1 if game.result == "1-0" else 0,
+                    "games_lost": 1 if game.result == "0-1" else 0,
+                    "games_drawn": 1 if game.result == "1/2-1/2" else 0
+                }),
+                _aplicar_partida(game.black_player, game.game_id, nuevos["nuevo_elo_negras"], {
+                    "games_played": 1,
+                    "games_won": 1 if game.result == "0-1" else 0,
+                    "games_lost": 1 if game.result == "1-0" else 0,
+                    "games_drawn": 1 if game.result == "1/2-1/2" else 0
+                })
+            ]
+        })
+        if self._despertar is not None and len(self._partidas) >= self.lote_maximo:
+            self._despertar.set()
+        return nuevos
+
+    def pendiente(self, game_id: str):
+        """Documento de la partida si todavía espera a escribirse en games"""
+        for partida in self._partidas:
+            if partida["game_id"] == game_id:
+                return partida["documento"]
+        return None
+
+    async def vaciar(self):
+        if self._db is None or not len(self):
+            return
+        inicio = time.perf_counter()
+
+        if self._partidas:
+            lote, self._partidas = self._partidas, []
+            try:
+                resultado = await self._db.games.bulk_write([
+                    UpdateOne({"live_game_id": partida["game_id"]}, {"$setOnInsert": partida["documento"]}, upsert=True)
+                    for partida in lote
+                ], ordered=False)
+            except Exception as e:
+                print(f"Error al guardar {len(lote)} partidas terminadas: {e}")
+                metricas.incrementar("guardado.errores")
+                self._partidas = lote + self._partidas
+                return
+            # También las que ya estaban guardadas: el filtro de partidas_contadas evita contarlas dos veces
+            for partida in lote:
+                self._usuarios.extend(partida["usuarios"])
+            self._diario.extend(DeleteOne({"_id": partida["game_id"]}) for partida in lote)
+            metricas.incrementar("guardado.partidas", len(resultado.upserted_ids))
+
+        if self._usuarios:
+            lote, self._usuarios = self._usuarios, []
+            try:
+                # En orden: el $set del ELO de la última partida de cada jugador es el que queda
+                await self._db.users.bulk_write(lote, ordered=True)
+            except Exception as e:
+                print(f"Error al actualizar el ELO ({len(lote)} operaciones): {e}")
+                metricas.incrementar("guardado.errores")
+                self._usuarios = lote + self._usuarios
+                return
+
+        if self._diario:
+            lote, self._diario = self._diario, []
+            try:
+                await self._db.partidas_vivo.bulk_write(lote, ordered=False)
+            except Exception as e:
+                print(f"Error al limpiar el diario de partidas: {e}")
+                metricas.incrementar("guardado.errores")
+                self._diario = lote + self._diario
+                return
+
+        metricas.observar("guardado.vaciado", (time.perf_counter() - inicio) * 1000)
+
+    async def _vaciar_periodicamente(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                await self.vaciar()
+            except Exception as e:
+                # Un fallo inesperado no puede parar el guardado: lo pendiente sigue en las colas
+                print(f"Error en el guardado periódico de partidas: {e}")
+                metricas.incrementar("guardado.errores")
+
+def id_partida(game_id: str) -> ObjectId:
+    """_id en games de una partida en vivo, derivado de su game_id (uuid)"""
+    return ObjectId(uuid.UUID(game_id).bytes[:12])
+
+def nuevos_elo(white_elo: int, black_elo: int, result: str) -> dict:
+    resultado_blancas = RESULTADO_BLANCAS.get(result, 0.5)
+    return {
+        "nuevo_elo_blancos": calcular_nuevo_elo(white_elo, black_elo, resultado_blancas),
+        "nuevo_elo_negras": calcular_nuevo_elo(black_elo, white_elo, 1 - resultado_blancas)
+    }
+
+def documento_partida(game) -> dict:
+    """Documento de games de una PartidaViva terminada"""
+    return {
+        "_id": id_partida(game.game_id),
+        "live_game_id": game.game_id,
+        "white_player": game.white_player,
+        "black_player": game.black_player,
+        "white_elo": game.white_elo,
+        "black_elo": game.black_elo,
+        "moves": game.san_moves(),  # Solo notación SAN
+        "result_code": game.result,
+        "winner": game.winner or "draw",
+        "end_reason": game.end_reason,
+        "date_played": game.created_at
+    }
+
+def _aplicar_partida(username: str, game_id: str, elo: int, incrementos: dict) -> UpdateOne:
+    """Aplica la partida al ELO y las estadísticas del usuario si no estaba ya aplicada"""
+    return UpdateOne(
+        {"username": username, "partidas_contadas": {"$ne": game_id}},
+        {
+            "$set": {"elo": elo},
+            "$inc": incrementos,
+            "$push": {"partidas_contadas": {"$each": [game_id], "$slice": -PARTIDAS_CONTADAS_MAX}}
+        }
+    )
+
+# Instancia global del guardado de partidas
+guardado_partidas = GuardadoPartidas(GAME_SAVE_FLUSH_MS, GAME_SAVE_BATCH_MAX)
@@ -0,0 +1,117 @@
+# /backend/utils/lobby.py
+from typing import Optional
+
+class IndiceLobby:
+    """
+    Índice del lobby (partidas en vivo de todos los workers) que se mantiene
+    al crear, mover, pausar, terminar y quitar partidas, en lugar de recorrer
+    active_games en cada petición.
+
+    Cada entrada es un dict pequeño que se actualiza en su sitio: una jugada no
+    cambia qué partidas hay, así que la lista ordenada que sirve las páginas
+    solo se rehace cuando entra o sale alguna. Los cambios se acumulan y se
+    recogen juntos (tomar_cambios), de modo que una partida con varias jugadas
+    en el mismo intervalo produce un solo cambio.
+    """
+
+    CAMPOS = ("game_id", "white_player", "black_player", "white_elo", "black_elo", "status", "moves_count")
+
+    def __init__(self):
+        # game_id → entrada, en orden de creación
+        self._entradas: dict[str, dict] = {}
+        # jugador → game_id, para filtrar por jugador sin recorrer el índice
+        self._por_jugador: dict[str, str] = {}
+        # Lista de entradas para paginar; None si entró o salió alguna partida
+        self._lista: Optional[list] = None
+        self.version = 0
+        # Cambios pendientes de difundir: game_id → entrada (o None si se quitó)
+        self._cambios: dict[str, Optional[dict]] = {}
+        # De esos, los de partidas de este worker (los que hay que contar a los demás)
+        self._cambios_locales: dict[str, Optional[dict]] = {}
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def actualizar(self, datos: dict, local: bool = True):
+        """Crea o actualiza la entrada de una partida"""
+        game_id = datos["game_id"]
+        entrada = self._entradas.get(game_id)
+        if entrada is None:
+            entrada = self._entradas[game_id] = {campo: datos.get(campo) for campo in self.CAMPOS}
+            self._por_jugador[entrada["white_player"]] = game_id
+            self._por_jugador[entrada["black_player"]] = game_id
+            self._lista = None
+        else:
+            cambiados = {campo: datos[campo] for campo in self.CAMPOS if campo in datos and entrada[campo] != datos[campo]}
+            if not cambiados:
+                return
+            entrada.update(cambiados)
+        self._anotar(game_id, entrada, local)
+
+    def quitar(self, game_id: str, local: bool = True):
+        entrada = self._entradas.pop(game_id, None)
+        if entrada is None:
+            return
+        for jugador in (entrada["white_player"], entrada["black_player"]):
+            if self._por_jugador.get(jugador) == game_id:
+                del self._por_jugador[jugador]
+        self._lista = None
+        self._anotar(game_id, None, local)
+
+    def _anotar(self, game_id: str, entrada: Optional[dict], local: bool):
+        self.version += 1
+        self._cambios[game_id] = entrada
+        if local:
+            self._cambios_locales[game_id] = entrada
+
+    @staticmethod
+    def _separar(cambios: dict) -> tuple[list, list]:
+        actualizadas = [dict(entrada) for entrada in cambios.values() if entrada is not None]
+        quitadas = [game_id for game_id, entrada in cambios.items() if entrada is None]
+        return actualizadas, quitadas
+
+    def tomar_cambios(self) -> tuple[list, list]:
+        """(actualizadas, quitadas) desde la última vez, para los suscriptores de este worker"""
+        cambios, self._cambios = self._cambios, {}
+        return self._separar(cambios)
+
+    def tomar_cambios_locales(self) -> tuple[list, list]:
+        """(actualizadas, quitadas) de las partidas de este worker, para el resto de workers"""
+        cambios, self._cambios_locales = self._cambios_locales, {}
+        return self._separar(cambios)
+
+    def todas(self) -> list[dict]:
+        if self._lista is None:
+            self._lista = list(self._entradas.values())
+        return self._lista
+
+    def listar(self, offset: int = 0, limit: int = None, status: str = None, player: str = None,
+               min_elo: int = None, max_elo: int = None) -> dict:
+        """
+        Página del lobby con filtros opcionales (ELO medio de la partida para el
+        rango). Sin limit se devuelven todas a partir de offset. next_offset es
+        el offset de la página siguiente, o None si no quedan más.
+        """
+        if player is not None:
+            game_id = self._por_jugador.get(player)
+            candidatas = [self._entradas[game_id]] if game_id else []
+        else:
+            candidatas = self.todas()
+
+        if status is not None or min_elo is not None or max_elo is not None:
+            candidatas = [
+                entrada for entrada in candidatas
+                if (status is None or entrada["status"] == status)
+                and (min_elo is None or (entrada["white_elo"] + entrada["black_elo"]) / 2 >= min_elo)
+                and (max_elo is None or (entrada["white_elo"] + entrada["black_elo"]) / 2 <= max_elo)
+            ]
+
+        fin = len(candidatas) if limit is None else offset + limit
+        return {
+            "version": self.version,
+            "total": len(candidatas),
+            "offset": offset,
+            "limit": limit,
+            "next_offset": fin if fin < len(candidatas) else None,
+            "active_games": [dict(entrada) for entrada in candidatas[offset:fin]]
+        }
@@ -0,0 +1,90 @@
+# /backend/utils/matchmaking.py
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+class Emparejador:
+    """
+    Cola de matchmaking ordenada por ELO. Los jugadores se guardan en buckets de
+    ancho fijo (p. ej. 1200-1299) y, dentro de cada uno, en una lista ordenada
+    con bisect: entrar, salir y buscar al rival más cercano cuestan O(log n) por
+    bucket revisado, en lugar de recorrer toda la cola.
+
+    emparejar() se llama en cada tick: recorre a los que esperan del más antiguo
+    al más nuevo y les busca el rival de ELO más cercano dentro de su ventana,
+    que se ensancha cuanto más tiempo llevan esperando.
+    """
+
+    def __init__(self, ventana_base: int, ensanche_por_segundo: float, ventana_maxima: int, ancho_bucket: int = 100):
+        self.ventana_base = ventana_base
+        self.ensanche_por_segundo = ensanche_por_segundo
+        self.ventana_maxima = ventana_maxima
+        self.ancho_bucket = ancho_bucket
+        # username → (elo, desde); el orden de inserción es el orden de llegada
+        self._esperando: OrderedDict[str, tuple] = OrderedDict()
+        # bucket → lista ordenada de (elo, username)
+        self._buckets: dict[int, list] = {}
+
+    def __len__(self):
+        return len(self._esperando)
+
+    def __contains__(self, username: str):
+        return username in self._esperando
+
+    def _bucket(self, elo: int) -> int:
+        return elo // self.ancho_bucket
+
+    def agregar(self, username: str, elo: int):
+        if username in self._esperando:
+            return
+        self._esperando[username] = (elo, time.monotonic())
+        insort(self._buckets.setdefault(self._bucket(elo), []), (elo, username))
+
+    def quitar(self, username: str):
+        entrada = self._esperando.pop(username, None)
+        if entrada is None:
+            return
+        elo = entrada[0]
+        bucket = self._buckets[self._bucket(elo)]
+        del bucket[bisect_left(bucket, (elo, username))]
+        if not bucket:
+            del self._buckets[self._bucket(elo)]
+
+    def ventana(self, username: str, ahora: float = None) -> int:
+        """Diferencia de ELO aceptable para este jugador según lo que lleva esperando"""
+        _, desde = self._esperando[username]
+        espera = (ahora or time.monotonic()) - desde
+        return min(self.ventana_maxima, int(self.ventana_base + self.ensanche_por_segundo * espera))
+
+    def _mas_cercano(self, username: str, elo: int, ventana: int):
+        """Rival con el ELO más cercano dentro de la ventana, o None"""
+        mejor = None
+        for indice in range(self._bucket(elo - ventana), self._bucket(elo + ventana) + 1):
+            bucket = self._buckets.get(indice)
+            if not bucket:
+                continue
+            posicion = bisect_left(bucket, (elo, username))
+            # Los candidatos son los vecinos de la posición (saltando al propio jugador)
+            for i in (posicion - 2, posicion - 1, posicion, posicion + 1):
+                if 0 <= i < len(bucket) and bucket[i][1] != username:
+                    diferencia = abs(bucket[i][0] - elo)
+                    if diferencia <= ventana and (mejor is None or diferencia < mejor[0]):
+                        mejor = (diferencia, bucket[i][1])
+        return mejor[1] if mejor else None
+
+    def emparejar(self) -> list[tuple]:
+        """Forma todas las parejas posibles en este tick: [(jugador, elo, rival, elo_rival)]"""
+        ahora = time.monotonic()
+        parejas = []
+        for username in list(self._esperando):
+            if username not in self._esperando:
+                continue  # ya emparejado en este mismo tick
+            elo, _ = self._esperando[username]
+            rival = self._mas_cercano(username, elo, self.ventana(username, ahora))
+            if rival is None:
+                continue
+            elo_rival, _ = self._esperando[rival]
+            self.quitar(username)
+            self.quitar(rival)
+            parejas.append((username, elo, rival, elo_rival))
+        return parejas
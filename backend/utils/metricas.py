@@ -0,0 +1,96 @@
+# /backend/utils/metricas.py
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Límites de los buckets en milisegundos
+LIMITES_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+class Histograma:
+    """Histograma de buckets fijos: registrar un valor es O(log buckets) y sin memoria extra"""
+
+    def __init__(self, limites=LIMITES_MS):
+        self.limites = tuple(limites)
+        self.cuentas = [0] * (len(self.limites) + 1)  # el último bucket es "+inf"
+        self.total = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+
+    def observar(self, valor: float):
+        self.cuentas[bisect_left(self.limites, valor)] += 1
+        self.total += 1
+        self.suma += valor
+        self.maximo = max(self.maximo, valor)
+
+    def percentil(self, p: float) -> float:
+        """Aproximado: el límite superior del bucket donde cae el percentil"""
+        if not self.total:
+            return 0.0
+        objetivo = p * self.total
+        acumulado = 0
+        for i, cuenta in enumerate(self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return self.limites[i] if i < len(self.limites) else self.maximo
+        return self.maximo
+
+    def resumen(self) -> dict:
+        return {
+            "cuenta": self.total,
+            "media": round(self.suma / self.total, 2) if self.total else 0.0,
+            "p50": self.percentil(0.50),
+            "p95": self.percentil(0.95),
+            "p99": self.percentil(0.99),
+            "max": round(self.maximo, 2),
+            "buckets": {
+                **{f"<={limite}": cuenta for limite, cuenta in zip(self.limites, self.cuentas)},
+                "+inf": self.cuentas[-1]
+            }
+        }
+
+class Metricas:
+    """Registro de histogramas y contadores del proceso (se usa también desde los hilos del pool)"""
+
+    def __init__(self):
+        self._histogramas: dict[str, Histograma] = {}
+        self._contadores: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, nombre: str, valor: float, limites=LIMITES_MS):
+        with self._lock:
+            histograma = self._histogramas.get(nombre)
+            if histograma is None:
+                histograma = self._histogramas[nombre] = Histograma(limites)
+            histograma.observar(valor)
+
+    def incrementar(self, nombre: str, cantidad: int = 1):
+        with self._lock:
+            self._contadores[nombre] = self._contadores.get(nombre, 0) + cantidad
+
+    def media(self, nombre: str, defecto: float = 0.0) -> float:
+        """Media del histograma, o defecto si aún no tiene observaciones"""
+        with self._lock:
+            histograma = self._histogramas.get(nombre)
+            if histograma is None or not histograma.total:
+                return defecto
+            return histograma.suma / histograma.total
+
+    @contextmanager
+    def medir(self, nombre: str):
+        """Registra en el histograma `nombre` los milisegundos que tarda el bloque"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nombre, (time.perf_counter() - inicio) * 1000)
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                "histogramas": {nombre: h.resumen() for nombre, h in sorted(self._histogramas.items())},
+                "contadores": dict(sorted(self._contadores.items()))
+            }
+
+# Instancia global de métricas
+metricas = Metricas()
@@ -0,0 +1,125 @@
+# /backend/utils/partida_viva.py
+import time
+from array import array
+from datetime import datetime
+import chess
+from utils.chess_validation import TableroPartida
+from utils.protocolo_binario import empaquetar_jugada, desempaquetar_jugada
+
+class PartidaViva:
+    """
+    Registro compacto de una partida en vivo. Con __slots__ no hay diccionario
+    por instancia; las jugadas se guardan empaquetadas en 16 bits (array('H'),
+    mismo formato que el protocolo binario) y las fechas como timestamps.
+    FEN y SAN no se guardan: el FEN actual sale del tablero y las SAN de la
+    partida se recalculan al pedirlas (fotos para espectadores, al guardarla).
+    """
+
+    __slots__ = ("game_id", "white_player", "black_player", "white_elo", "black_elo",
+                 "status", "result", "winner", "end_reason",
+                 "initial", "increment", "white_time", "black_time",
+                 "created_ts", "updated_ts", "moves", "board")
+
+    def __init__(self, game_id: str, white_player: str, black_player: str, white_elo: int, black_elo: int,
+                 initial: int, increment: int):
+        self.game_id = game_id
+        self.white_player = white_player
+        self.black_player = black_player
+        self.white_elo = white_elo
+        self.black_elo = black_elo
+        self.status = "active"
+        self.result = "*"
+        self.winner = None
+        self.end_reason = None
+        self.initial = initial
+        self.increment = increment
+        self.white_time = float(initial)
+        self.black_time = float(initial)
+        self.created_ts = self.updated_ts = time.time()
+        self.moves = array("H")
+        self.board = TableroPartida()
+
+    @classmethod
+    def desde_diario(cls, game_id: str, doc: dict) -> "PartidaViva":
+        """Reconstruye la partida a partir de su documento del diario; ValueError si no cuadra"""
+        time_control = doc.get("time_control", {})
+        game = cls(game_id, doc["white_player"], doc["black_player"], doc["white_elo"], doc["black_elo"],
+                   time_control.get("initial", 600), time_control.get("increment", 0))
+        for move in doc["moves"]:
+            game.jugar(game.board.leer_jugada(move["from_square"], move["to_square"], move.get("promotion")))
+        game.status = doc["status"]
+        game.result = doc.get("result", "*")
+        game.winner = doc.get("winner")
+        game.end_reason = doc.get("end_reason")
+        game.white_time = float(time_control.get("white_time", game.initial))
+        game.black_time = float(time_control.get("black_time", game.initial))
+        if doc.get("created_at"):
+            game.created_ts = doc["created_at"].timestamp()
+        return game
+
+    @property
+    def current_turn(self) -> str:
+        return "white" if self.board.board.turn == chess.WHITE else "black"
+
+    @property
+    def current_fen(self) -> str:
+        return self.board.fen()
+
+    @property
+    def created_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self.created_ts)
+
+    @property
+    def updated_at(self) -> datetime:
+        return datetime.utcfromtimestamp(self.updated_ts)
+
+    @property
+    def time_control(self) -> dict:
+        return {"initial": self.initial, "increment": self.increment,
+                "white_time": self.white_time, "black_time": self.black_time}
+
+    def jugar(self, move: chess.Move) -> str:
+        """Aplica una jugada legal en el tablero y la anota; devuelve su SAN"""
+        san = self.board.jugar(move)
+        self.moves.append(empaquetar_jugada(move))
+        self.updated_ts = time.time()
+        return san
+
+    def move_list(self) -> list[dict]:
+        """Jugadas con casillas y SAN, recalculadas desde la posición inicial"""
+        board = chess.Board()
+        moves = []
+        for valor in self.moves:
+            move = desempaquetar_jugada(valor)
+            moves.append({
+                "from_square": chess.square_name(move.from_square),
+                "to_square": chess.square_name(move.to_square),
+                "piece": board.piece_at(move.from_square).symbol().upper(),
+                "promotion": chess.piece_symbol(move.promotion).upper() if move.promotion else None,
+                "san": board.san(move)
+            })
+            board.push(move)
+        return moves
+
+    def san_moves(self) -> list[str]:
+        return [move["san"] for move in self.move_list()]
+
+    def as_dict(self) -> dict:
+        """La partida con el formato de siempre (API y diario)"""
+        return {
+            "game_id": self.game_id,
+            "white_player": self.white_player,
+            "black_player": self.black_player,
+            "white_elo": self.white_elo,
+            "black_elo": self.black_elo,
+            "current_turn": self.current_turn,
+            "moves": self.move_list(),
+            "status": self.status,
+            "result": self.result,
+            "winner": self.winner,
+            "end_reason": self.end_reason,
+            "time_control": self.time_control,
+            "current_fen": self.current_fen,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
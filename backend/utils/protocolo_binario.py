@@ -0,0 +1,116 @@
+# /backend/utils/protocolo_binario.py
+"""
+Protocolo binario compacto para el tráfico de las partidas en vivo.
+
+Se negocia al conectar con /ws/{token}?protocol=binary; sin eso todo sigue en
+JSON. Solo las tramas frecuentes tienen formato binario (jugadas, latido); el
+resto de mensajes siguen yendo como texto JSON por la misma conexión.
+
+Formato (big-endian, el primer byte es el tipo de trama):
+
+Servidor → cliente
+    JUGADA  B tipo, 16s game_id (uuid), H ply, H jugada, I ms blancas,
+            I ms negras, Q zobrist, B estado, B resultado          (39 bytes)
+    PONG    B tipo
+    PING    B tipo   (latido del servidor; se contesta con PONG)
+
+Cliente → servidor
+    MOVER   B tipo, 16s game_id (uuid), H jugada
+    PING    B tipo
+    PONG    B tipo
+
+jugada = desde | hasta << 6 | promoción << 12, con las casillas de 0 (a1) a 63
+(h8) y la promoción como tipo de pieza de python-chess (0 si no hay).
+estado = estado de la partida (bits 0-1) | turno (bit 2, 1 = negras).
+resultado = código del resultado << 4 | código del motivo de fin.
+zobrist es el hash polyglot de la posición: el cliente puede comprobar que su
+tablero coincide sin recibir el FEN. El game_id distingue la partida propia
+de las que se siguen como espectador por la misma conexión.
+"""
+import struct
+import uuid
+import chess
+
+TRAMA_JUGADA = 0x01
+TRAMA_PONG = 0x03
+TRAMA_PING_SERVIDOR = 0x04
+TRAMA_MOVER = 0x81
+TRAMA_PING = 0x82
+TRAMA_PONG_CLIENTE = 0x83
+
+_JUGADA = struct.Struct(">B16sHHIIQBB")
+_MOVER = struct.Struct(">B16sH")
+
+PONG = bytes([TRAMA_PONG])
+PING = bytes([TRAMA_PING_SERVIDOR])
+
+ESTADOS = ("active", "paused", "finished")
+RESULTADOS = ("*", "1-0", "0-1", "1/2-1/2")
+MOTIVOS = (None, "checkmate", "stalemate", "insufficient_material", "threefold_repetition",
+           "fifty_moves", "resignation", "timeout", "timeout_vs_insufficient_material",
+           "fivefold_repetition", "seventyfive_moves", "abandonment")
+
+def empaquetar_jugada(move: chess.Move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def desempaquetar_jugada(valor: int) -> chess.Move:
+    promocion = valor >> 12 & 0x7
+    return chess.Move(valor & 0x3F, valor >> 6 & 0x3F, promocion or None)
+
+def codificar_jugada(game_id: str, ply: int, move: chess.Move, clock: dict, zobrist: int,
+                     status: str, turn: str, result: str = "*", reason: str = None) -> bytes:
+    """Trama JUGADA; clock son los segundos restantes {"white_time", "black_time"}"""
+    return _JUGADA.pack(
+        TRAMA_JUGADA,
+        uuid.UUID(game_id).bytes,
+        ply,
+        empaquetar_jugada(move),
+        int(clock["white_time"] * 1000),
+        int(clock["black_time"] * 1000),
+        zobrist,
+        ESTADOS.index(status) | (turn == "black") << 2,
+        RESULTADOS.index(result) << 4 | MOTIVOS.index(reason)
+    )
+
+def decodificar_jugada(datos: bytes) -> dict:
+    """Inversa de codificar_jugada (la usan los clientes y las pruebas de carga)"""
+    _, game_id, ply, valor, white_ms, black_ms, zobrist, estado, resultado = _JUGADA.unpack(datos)
+    return {
+        "game_id": str(uuid.UUID(bytes=game_id)),
+        "ply": ply,
+        "uci": desempaquetar_jugada(valor).uci(),
+        "clock": {"white_time": white_ms / 1000, "black_time": black_ms / 1000},
+        "zobrist": zobrist,
+        "status": ESTADOS[estado & 0x3],
+        "current_turn": "black" if estado & 0x4 else "white",
+        "result": RESULTADOS[resultado >> 4],
+        "reason": MOTIVOS[resultado & 0xF]
+    }
+
+def codificar_mover(game_id: str, move: chess.Move) -> bytes:
+    return _MOVER.pack(TRAMA_MOVER, uuid.UUID(game_id).bytes, empaquetar_jugada(move))
+
+def leer_trama(datos: bytes) -> dict:
+    """
+    Traduce una trama del cliente al mismo mensaje que llegaría en JSON, para
+    que el resto del endpoint no distinga protocolos. ValueError si no es válida.
+    """
+    if not datos:
+        raise ValueError("Trama vacía")
+    if datos[0] == TRAMA_PING:
+        return {"type": "ping"}
+    if datos[0] == TRAMA_PONG_CLIENTE:
+        return {"type": "pong"}
+    if datos[0] == TRAMA_MOVER and len(datos) == _MOVER.size:
+        _, game_id, valor = _MOVER.unpack(datos)
+        move = desempaquetar_jugada(valor)
+        return {
+            "type": "move",
+            "game_id": str(uuid.UUID(bytes=game_id)),
+            "move": {
+                "from_square": chess.square_name(move.from_square),
+                "to_square": chess.square_name(move.to_square),
+                "promotion": chess.piece_symbol(move.promotion) if move.promotion else None
+            }
+        }
+    raise ValueError(f"Trama desconocida: {datos[0]:#x}")
@@ -0,0 +1,90 @@
+# /backend/utils/relojes.py
+import asyncio
+import heapq
+import itertools
+import time
+
+class PlanificadorRelojes:
+    """
+    Un único planificador para los vencimientos de todos los relojes: un heap de
+    (vence_en, orden, clave) y una sola tarea que duerme hasta el vencimiento más
+    próximo. Miles de partidas con reloj cuestan una entrada en el heap cada una,
+    no una tarea de asyncio por partida.
+
+    Reprogramar o cancelar no busca en el heap: la entrada vieja se queda y se
+    descarta al salir si ya no es la vigente de su clave.
+
+    Cada vencimiento se atiende en su propia tarea: un al_vencer lento (guardar,
+    avisar a los jugadores) no retrasa las banderas que caen justo después.
+    """
+
+    def __init__(self):
+        self._heap: list = []
+        self._orden = itertools.count()
+        # clave → vence_en vigente
+        self._vigentes: dict[str, float] = {}
+        self._al_vencer = None
+        self._despertar: asyncio.Event = None
+        self._tarea: asyncio.Task = None
+        # Vencimientos en curso; se guarda la referencia para que no los recoja el GC
+        self._en_curso: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._vigentes)
+
+    async def iniciar(self, al_vencer):
+        """al_vencer(clave) es una corrutina; se llama con la clave cuyo plazo venció"""
+        self._al_vencer = al_vencer
+        self._despertar = asyncio.Event()
+        self._tarea = asyncio.create_task(self._bucle())
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        for tarea in list(self._en_curso):
+            tarea.cancel()
+
+    def programar(self, clave: str, vence_en: float):
+        """Fija (o cambia) el vencimiento de la clave; vence_en en tiempo de time.monotonic()"""
+        self._vigentes[clave] = vence_en
+        heapq.heappush(self._heap, (vence_en, next(self._orden), clave))
+        # Solo hay que despertar al bucle si este vencimiento es ahora el más próximo
+        if self._despertar is not None and self._heap[0][2] == clave:
+            self._despertar.set()
+        # Demasiadas entradas viejas: se reconstruye el heap con las vigentes
+        if len(self._heap) > 2 * len(self._vigentes) + 64:
+            self._heap = [(vence, next(self._orden), c) for c, vence in self._vigentes.items()]
+            heapq.heapify(self._heap)
+
+    def cancelar(self, clave: str):
+        self._vigentes.pop(clave, None)
+
+    def _terminado(self, tarea: asyncio.Task, clave: str):
+        self._en_curso.discard(tarea)
+        if not tarea.cancelled() and tarea.exception() is not None:
+            print(f"Error al vencer el reloj {clave}: {tarea.exception()}")
+
+    async def _bucle(self):
+        while True:
+            espera = None
+            ahora = time.monotonic()
+            while self._heap:
+                vence_en, _, clave = self._heap[0]
+                if self._vigentes.get(clave) != vence_en:
+                    heapq.heappop(self._heap)  # reprogramada o cancelada
+                elif vence_en <= ahora:
+                    heapq.heappop(self._heap)
+                    del self._vigentes[clave]
+                    tarea = asyncio.create_task(self._al_vencer(clave))
+                    self._en_curso.add(tarea)
+                    tarea.add_done_callback(lambda t, clave=clave: self._terminado(t, clave))
+                else:
+                    espera = vence_en - ahora
+                    break
+
+            self._despertar.clear()
+            try:
+                await asyncio.wait_for(self._despertar.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,171 @@
+# /backend/utils/servicio_analisis.py
+"""
+Análisis de partidas guardadas: carga de la partida, cache de evaluaciones,
+ejecución en el pool de Stockfish y almacenamiento del resultado en el propio
+documento de la partida. Lo usan las rutas HTTP y el WebSocket.
+"""
+import asyncio
+from fastapi import HTTPException
+from bson import ObjectId
+from datetime import datetime
+from models.analisis import OpcionesAnalisis
+from utils.stockfish_analysis import (analizar_movimientos, analizar_movimientos_iter, analizar_movimientos_adaptativo,
+                                      convertir_con_posiciones)
+from utils.stockfish_pool import stockfish_pool
+from utils.cache_evaluaciones import cache_evaluaciones, clave_evaluacion
+from utils.metricas import metricas
+
+# Subir cuando cambie el formato del análisis o la forma de calcularlo:
+# los análisis guardados con otra versión se recalculan
+VERSION_ANALISIS = 1
+
+async def cargar_partida(db, partida_id: str) -> dict:
+    """Busca la partida por su id (ObjectId o string)"""
+    partida = None
+    try:
+        oid = ObjectId(partida_id)
+        partida = await db.games.find_one({"_id": oid})
+    except Exception as e:
+        print(f"Error al crear ObjectId: {e}")
+
+    if not partida:
+        # Intentar buscar con string por si acaso
+        partida = await db.games.find_one({"_id": partida_id})
+
+    if not partida:
+        raise HTTPException(status_code=404, detail="Partida no encontrada")
+    return partida
+
+def movimientos_de_partida(partida: dict) -> list[str]:
+    """Jugadas en SAN de una partida guardada"""
+    movimientos_raw = partida.get("moves") or partida.get("movimientos")
+    if not movimientos_raw:
+        raise HTTPException(status_code=400, detail="La partida no tiene movimientos")
+
+    if isinstance(movimientos_raw, list) and len(movimientos_raw) == 1 and isinstance(movimientos_raw[0], str):
+        return movimientos_raw[0].replace(" ", "").split(",")
+    return [m.strip("'\"") for m in movimientos_raw]
+
+def completar_opciones(opciones: OpcionesAnalisis = None) -> OpcionesAnalisis:
+    """Rellena la profundidad por defecto para que las opciones equivalentes sean iguales"""
+    opciones = opciones or OpcionesAnalisis()
+    if opciones.profundidad is None:
+        opciones = opciones.model_copy(update={"profundidad": stockfish_pool.depth})
+    return opciones
+
+def analisis_guardado(partida: dict, opciones: OpcionesAnalisis):
+    """Análisis guardado en la partida si es de esta versión y al menos de esta profundidad"""
+    if not opciones.es_estandar():
+        return None
+    guardado = partida.get("analisis_guardado")
+    if not guardado or guardado.get("version") != VERSION_ANALISIS:
+        return None
+    if guardado.get("profundidad", 0) < opciones.profundidad:
+        return None
+    return guardado
+
+def profundidad_alcanzada(analisis: list[dict], opciones: OpcionesAnalisis) -> int:
+    """
+    Profundidad que tiene todo el análisis: en modo adaptativo cada jugada trae
+    la suya y solo las críticas llegan a la pedida, así que se da la menor
+    """
+    if opciones.modo == "adaptativo":
+        return min((jugada["profundidad"] for jugada in analisis if "profundidad" in jugada), default=None)
+    return opciones.profundidad
+
+async def guardar_analisis(db, partida: dict, analisis: list[dict], opciones: OpcionesAnalisis):
+    """Guarda el análisis junto a la partida (una partida guardada no cambia)"""
+    if not opciones.es_estandar() or not analisis or "error" in analisis[0]:
+        return
+    # No reemplazar un análisis vigente más profundo por uno más superficial
+    if analisis_guardado(partida, opciones.model_copy(update={"profundidad": opciones.profundidad + 1})) is not None:
+        return
+    guardado = {
+        "version": VERSION_ANALISIS,
+        "profundidad": opciones.profundidad,
+        "fecha": datetime.utcnow(),
+        "jugadas": analisis
+    }
+    try:
+        # La condición va en el filtro: otro análisis simultáneo más profundo pudo guardarse mientras tanto
+        resultado = await db.games.update_one({
+            "_id": partida["_id"],
+            "$or": [
+                {"analisis_guardado.version": {"$ne": VERSION_ANALISIS}},
+                {"analisis_guardado.profundidad": {"$lte": opciones.profundidad}}
+            ]
+        }, {"$set": {"analisis_guardado": guardado}})
+        if resultado.matched_count:
+            partida["analisis_guardado"] = guardado
+    except Exception as e:
+        print(f"Error al guardar el análisis de la partida {partida['_id']}: {e}")
+
+async def _precargar_evaluaciones(db, movimientos: list[str], opciones: OpcionesAnalisis):
+    """Trae de Mongo las evaluaciones ya conocidas de las posiciones de la partida"""
+    if opciones.tiempo_ms and opciones.modo == "fijo":
+        return  # las búsquedas por tiempo no se cachean
+    _, posiciones = await asyncio.to_thread(convertir_con_posiciones, movimientos)
+    if opciones.modo == "adaptativo":
+        profundidades = {opciones.profundidad, min(opciones.profundidad_rapida, opciones.profundidad)}
+        claves = [clave_evaluacion(fen, p) for fen in posiciones for p in profundidades]
+    else:
+        claves = [clave_evaluacion(fen, opciones.profundidad, nodos=opciones.nodos) for fen in posiciones]
+    await cache_evaluaciones.precargar(db, claves)
+
+async def _ejecutar_analisis(movimientos: list[str], opciones: OpcionesAnalisis) -> list[dict]:
+    # El análisis corre en un motor del pool, fuera del event loop
+    if opciones.modo == "adaptativo":
+        return await stockfish_pool.ejecutar(
+            analizar_movimientos_adaptativo, movimientos, cache_evaluaciones, opciones.profundidad,
+            opciones.profundidad_rapida, opciones.umbral_cp, opciones.presupuesto_ms
+        )
+    return await stockfish_pool.ejecutar(
+        analizar_movimientos, movimientos, cache_evaluaciones, opciones.profundidad,
+        opciones.nodos, opciones.tiempo_ms
+    )
+
+async def analizar_partida(db, partida: dict, opciones: OpcionesAnalisis = None) -> list[dict]:
+    opciones = completar_opciones(opciones)
+    movimientos = movimientos_de_partida(partida)
+    await _precargar_evaluaciones(db, movimientos, opciones)
+
+    with metricas.medir(f"analisis.partida.{opciones.modo}"):
+        analisis = await _ejecutar_analisis(movimientos, opciones)
+
+    await cache_evaluaciones.persistir(db)
+    await guardar_analisis(db, partida, analisis, opciones)
+    return analisis
+
+async def analizar_partida_stream(db, partida: dict, opciones: OpcionesAnalisis = None, reanalizar: bool = False,
+                                  usuario: str = None):
+    """
+    Igual que analizar_partida, pero entrega cada jugada en cuanto se calcula.
+    Con usuario se aplica el control de admisión del pool (puede lanzar MotorSaturado).
+    """
+    opciones = completar_opciones(opciones)
+
+    guardado = None if reanalizar else analisis_guardado(partida, opciones)
+    if guardado is not None:
+        for jugada in guardado["jugadas"]:
+            yield jugada
+        return
+
+    # El modo adaptativo necesita la partida entera antes de decidir dónde profundizar
+    if opciones.modo == "adaptativo":
+        for jugada in await analizar_partida(db, partida, opciones):
+            yield jugada
+        return
+
+    movimientos = movimientos_de_partida(partida)
+    await _precargar_evaluaciones(db, movimientos, opciones)
+
+    analisis = []
+    async for jugada in stockfish_pool.iterar(analizar_movimientos_iter, movimientos, cache_evaluaciones,
+                                              opciones.profundidad, opciones.nodos, opciones.tiempo_ms,
+                                              usuario=usuario):
+        analisis.append(jugada)
+        yield jugada
+
+    # Si el cliente se va antes, lo pendiente se escribe en la próxima persistencia
+    await cache_evaluaciones.persistir(db)
+    await guardar_analisis(db, partida, analisis, opciones)
@@ -0,0 +1,282 @@
+# /backend/utils/sesiones_bot.py
+import asyncio
+import time
+import uuid
+from datetime import datetime
+import chess
+from config import STOCKFISH_PATH, STOCKFISH_DEPTH, BOT_SESSIONS_MAX, BOT_SESSION_IDLE_SECONDS
+from utils.stockfish_analysis import buscar_posicion, fijar_posicion_con_historia
+from utils.cache_evaluaciones import cache_evaluaciones
+from utils.stockfish_pool import MotorStockfish
+from utils.metricas import metricas
+
+class SesionBot:
+    """Partida contra Stockfish: un motor propio y el tablero de la partida"""
+
+    def __init__(self, game_id: str, motor: MotorStockfish, tablero: chess.Board, color: str, nivel, elo):
+        self.game_id = game_id
+        self.motor = motor
+        self.tablero = tablero
+        self.color = color
+        self.nivel = nivel
+        self.elo = elo
+        self.ultimo_uso = time.monotonic()
+        # Un solo movimiento a la vez por partida
+        self.lock = asyncio.Lock()
+
+    @property
+    def fuerza_completa(self) -> bool:
+        return self.nivel is None and self.elo is None
+
+class SesionesBot:
+    """
+    Sesiones de "jugar contra Stockfish" indexadas por game_id.
+    Cada sesión recibe solo la última jugada del alumno: el tablero ya está en
+    memoria y al motor se le pasan la posición inicial y las jugadas, para que
+    vea las repeticiones. La partida termina también en tablas reclamables
+    (triple repetición, 50 jugadas). Las sesiones inactivas se cierran.
+
+    La partida en sí (color, nivel y jugadas) está en la colección sesiones_bot,
+    así que cualquier worker puede atenderla: el motor y el tablero de cada
+    worker son una cache que se rehace desde el documento si otro worker jugó
+    entretanto. MongoDB borra las partidas inactivas con un índice TTL.
+    """
+
+    def __init__(self, path: str, depth: int, maximo: int, inactividad_s: int):
+        self.path = path
+        self.depth = depth
+        self.maximo = max(1, maximo)
+        self.inactividad_s = inactividad_s
+        self._db = None
+        self._sesiones: dict[str, SesionBot] = {}
+        self._limpieza: asyncio.Task = None
+
+    def _crear_motor(self, nivel, elo) -> MotorStockfish:
+        motor = MotorStockfish(path=self.path, depth=self.depth)
+        if elo is not None:
+            motor.set_elo_rating(elo)
+        elif nivel is not None:
+            motor.set_skill_level(nivel)
+        return motor
+
+    async def iniciar(self, db):
+        self._db = db
+        try:
+            await db.sesiones_bot.create_index("actualizada", expireAfterSeconds=self.inactividad_s)
+        except Exception as e:
+            print(f"No se pudo crear el índice TTL de sesiones_bot: {e}")
+        if self._limpieza is None:
+            self._limpieza = asyncio.create_task(self._limpiar_periodicamente())
+
+    async def cerrar(self):
+        """Cierra los motores de este worker; las partidas siguen en MongoDB"""
+        if self._limpieza is not None:
+            self._limpieza.cancel()
+            self._limpieza = None
+        for game_id in list(self._sesiones):
+            await self._cerrar_local(game_id)
+
+    def salud(self) -> dict:
+        return {
+            "sesiones": len(self._sesiones),
+            "maximo": self.maximo,
+            "procesos_caidos": sum(1 for s in self._sesiones.values() if not s.motor.vivo())
+        }
+
+    async def crear(self, color: str = "white", nivel: int = None, elo: int = None, movimientos: list[str] = None) -> dict:
+        """Crea la sesión; si el alumno lleva negras, Stockfish hace la primera jugada"""
+        tablero = chess.Board()
+        for mov in movimientos or []:
+            tablero.push_san(mov.strip())  # ValueError si alguna jugada no es legal
+
+        sesion = await self._abrir(str(uuid.uuid4()), tablero, color, nivel, elo)
+        await self._db.sesiones_bot.insert_one({
+            "_id": sesion.game_id,
+            "color": color,
+            "nivel": nivel,
+            "elo": elo,
+            "movimientos": [m.uci() for m in tablero.move_stack],
+            "actualizada": datetime.utcnow()
+        })
+
+        respuesta = {"game_id": sesion.game_id, "fen": tablero.fen()}
+        turno_bot = chess.BLACK if color == "white" else chess.WHITE
+        if tablero.turn == turno_bot and not _terminada(tablero):
+            async with sesion.lock:
+                plies = len(tablero.move_stack)
+                try:
+                    respuesta.update(await self._jugada_del_motor(sesion))
+                except Exception as e:
+                    # Sin la primera jugada la sesión quedaría esperando al motor para siempre
+                    await self.terminar(sesion.game_id)
+                    raise RuntimeError("El motor no respondió, vuelve a crear la partida") from e
+                await self._guardar(sesion, plies)
+        return respuesta
+
+    async def jugar(self, game_id: str, jugada: str) -> dict:
+        """Aplica la jugada del alumno y devuelve la respuesta de Stockfish"""
+        sesion = self._sesiones.get(game_id)
+        if sesion is None:
+            doc = await self._db.sesiones_bot.find_one({"_id": game_id})
+            if doc is None:
+                raise KeyError(game_id)
+            # La partida se creó en otro worker (o este cerró su motor): se abre aquí
+            sesion = await self._abrir(game_id, chess.Board(), doc["color"], doc["nivel"], doc["elo"])
+
+        async with sesion.lock:
+            # El documento manda: otro worker pudo jugar entretanto o la partida expiró
+            doc = await self._db.sesiones_bot.find_one({"_id": game_id})
+            if doc is None:
+                await self._cerrar_local(game_id)
+                raise KeyError(game_id)
+            if [m.uci() for m in sesion.tablero.move_stack] != doc["movimientos"]:
+                sesion.tablero = chess.Board()
+                for uci in doc["movimientos"]:
+                    sesion.tablero.push_uci(uci)
+
+            sesion.ultimo_uso = time.monotonic()
+            tablero = sesion.tablero
+            plies = len(tablero.move_stack)
+            turno_alumno = chess.WHITE if sesion.color == "white" else chess.BLACK
+            if _terminada(tablero):
+                raise ValueError("La partida ha terminado")
+            if tablero.turn != turno_alumno:
+                raise ValueError("No es tu turno")
+
+            tablero.push(_leer_jugada(tablero, jugada))
+            if _terminada(tablero):
+                respuesta = {"jugada_stockfish": None, "fen": tablero.fen(), **_estado_final(tablero)}
+            else:
+                try:
+                    respuesta = await self._jugada_del_motor(sesion)
+                except Exception as e:
+                    # Se deshace la jugada del alumno para que pueda volver a enviarla
+                    tablero.pop()
+                    raise RuntimeError("El motor no respondió, vuelve a enviar la jugada") from e
+            await self._guardar(sesion, plies)
+            return respuesta
+
+    async def _abrir(self, game_id: str, tablero: chess.Board, color: str, nivel, elo) -> SesionBot:
+        """Arranca el motor de una sesión en este worker"""
+        # Al llegar al máximo se cierra el motor usado hace más tiempo (que no esté pensando);
+        # su partida sigue en MongoDB y se vuelve a abrir si llega otra jugada
+        if len(self._sesiones) >= self.maximo:
+            libres = [s for s in self._sesiones.values() if not s.lock.locked()]
+            if not libres:
+                raise RuntimeError("No hay motores disponibles para una nueva partida")
+            await self._cerrar_local(min(libres, key=lambda s: s.ultimo_uso).game_id)
+
+        motor = await asyncio.to_thread(self._crear_motor, nivel, elo)
+        if game_id in self._sesiones:
+            # Otra petición de la misma partida la abrió mientras arrancaba este motor
+            await asyncio.to_thread(motor.terminar)
+            return self._sesiones[game_id]
+        sesion = SesionBot(game_id, motor, tablero, color, nivel, elo)
+        self._sesiones[game_id] = sesion
+        return sesion
+
+    async def _guardar(self, sesion: SesionBot, plies: int):
+        """
+        Escribe las jugadas nuevas si nadie más escribió desde que había `plies`;
+        si no, deshace las de aquí y lanza ValueError
+        """
+        tablero = sesion.tablero
+        resultado = await self._db.sesiones_bot.update_one(
+            {"_id": sesion.game_id, "movimientos": {"$size": plies}},
+            {"$set": {"movimientos": [m.uci() for m in tablero.move_stack], "actualizada": datetime.utcnow()}}
+        )
+        if not resultado.matched_count:
+            while len(tablero.move_stack) > plies:
+                tablero.pop()
+            raise ValueError("La partida cambió mientras se calculaba la jugada, vuelve a cargarla")
+
+    async def _jugada_del_motor(self, sesion: SesionBot) -> dict:
+        tablero = sesion.tablero
+        try:
+            jugada = await asyncio.to_thread(self._buscar, sesion)
+        except Exception as e:
+            # El proceso murió: se arranca otro con la misma configuración y se reintenta una vez
+            print(f"Reiniciando el motor de la partida {sesion.game_id}: {e}")
+            metricas.incrementar("sesiones_bot.reinicios")
+            await asyncio.to_thread(sesion.motor.terminar)
+            sesion.motor = await asyncio.to_thread(self._crear_motor, sesion.nivel, sesion.elo)
+            jugada = await asyncio.to_thread(self._buscar, sesion)
+        if sesion.fuerza_completa:
+            await cache_evaluaciones.persistir(self._db)
+
+        movimiento = chess.Move.from_uci(jugada)
+        san = tablero.san(movimiento)
+        tablero.push(movimiento)
+        sesion.ultimo_uso = time.monotonic()
+        return {
+            "jugada_stockfish": jugada,
+            "san": san,
+            "fen": tablero.fen(),
+            "comentario": f"Stockfish juega {san}",
+            **_estado_final(tablero)
+        }
+
+    def _buscar(self, sesion: SesionBot) -> str:
+        # A fuerza completa la búsqueda es la misma que la del análisis y se comparte la cache.
+        # El motor recibe las jugadas de la partida para que vea las repeticiones
+        if sesion.fuerza_completa:
+            _, jugada = buscar_posicion(sesion.motor, sesion.tablero, cache_evaluaciones, historia=True)
+            return jugada
+        fijar_posicion_con_historia(sesion.motor, sesion.tablero)
+        return sesion.motor.get_best_move()
+
+    async def terminar(self, game_id: str) -> bool:
+        """Termina la partida en todos los workers; False si no existía"""
+        local = await self._cerrar_local(game_id)
+        resultado = await self._db.sesiones_bot.delete_one({"_id": game_id})
+        return local or resultado.deleted_count > 0
+
+    async def _cerrar_local(self, game_id: str) -> bool:
+        """Cierra el motor de la sesión en este worker"""
+        sesion = self._sesiones.pop(game_id, None)
+        if sesion is None:
+            return False
+        await asyncio.to_thread(sesion.motor.terminar)
+        return True
+
+    async def _limpiar_periodicamente(self):
+        while True:
+            await asyncio.sleep(max(1, self.inactividad_s // 4))
+            limite = time.monotonic() - self.inactividad_s
+            for sesion in list(self._sesiones.values()):
+                if sesion.ultimo_uso < limite and not sesion.lock.locked():
+                    print(f"Cerrando sesión inactiva contra Stockfish {sesion.game_id}")
+                    await self._cerrar_local(sesion.game_id)
+
+def _leer_jugada(tablero: chess.Board, jugada: str) -> chess.Move:
+    """Acepta SAN o UCI; ValueError si no es legal"""
+    jugada = jugada.strip()
+    try:
+        return tablero.parse_san(jugada)
+    except ValueError:
+        pass
+    try:
+        movimiento = chess.Move.from_uci(jugada)
+    except ValueError:
+        movimiento = None
+    if movimiento not in tablero.legal_moves:
+        raise ValueError(f"Jugada ilegal: {jugada}")
+    return movimiento
+
+def _tablas_reclamables(tablero: chess.Board) -> bool:
+    # Sin nadie que las reclame, la triple repetición y las 50 jugadas terminan la partida
+    # en cuanto se producen en el tablero
+    return tablero.is_repetition(3) or tablero.halfmove_clock >= 100
+
+def _terminada(tablero: chess.Board) -> bool:
+    return tablero.is_game_over() or _tablas_reclamables(tablero)
+
+def _estado_final(tablero: chess.Board) -> dict:
+    if tablero.is_game_over():
+        return {"terminada": True, "resultado": tablero.result()}
+    if _tablas_reclamables(tablero):
+        return {"terminada": True, "resultado": "1/2-1/2"}
+    return {"terminada": False, "resultado": "*"}
+
+# Instancia global de las sesiones
+sesiones_bot = SesionesBot(STOCKFISH_PATH, STOCKFISH_DEPTH, BOT_SESSIONS_MAX, BOT_SESSION_IDLE_SECONDS)
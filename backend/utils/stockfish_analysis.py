@@ -1,24 +1,108 @@
+import threading
+import time
 import chess
 from stockfish import Stockfish
+from config import MOVE_TRIE_MAX_NODES
+from utils.cache_evaluaciones import clave_evaluacion
 
-# Ruta al ejecutable de Stockfish dentro del contenedor Docker
-stockfish = Stockfish(path="/usr/local/bin/stockfish", depth=15)
+# Los motores (MotorStockfish) los presta utils/stockfish_pool.py; estas funciones
+# son bloqueantes y se ejecutan en un hilo con stockfish_pool.ejecutar(funcion, ...)
 
-# Función para convertir jugadas de notación algebraica (SAN) a notación UCI
-def convertir_a_uci(movimientos: list[str]) -> list[str]:
-    tablero = chess.Board()
-    jugadas_uci = []
+class _NodoPrefijo:
+    __slots__ = ("uci", "fen", "hijos")
 
-    for mov in movimientos:
-        try:
-            jugada = tablero.parse_san(mov.strip())  # "e4" → objeto jugada
-            jugadas_uci.append(jugada.uci())         # objeto jugada → "e2e4"
+    def __init__(self, uci: str, fen: str):
+        self.uci = uci
+        self.fen = fen    # posición después de la jugada
+        self.hijos = {}   # jugada SAN siguiente → _NodoPrefijo
+
+class TriePrefijos:
+    """
+    Prefijos de partidas ya convertidos de SAN a UCI, compartidos por el análisis,
+    el bot y las sugerencias. Una conversión recorre el prefijo más largo conocido
+    y solo reproduce en un tablero las jugadas que faltan. Al llegar a max_nodos
+    se vacía para no crecer sin límite (las aperturas frecuentes vuelven enseguida).
+    """
+
+    def __init__(self, max_nodos: int):
+        self.max_nodos = max_nodos
+        self._raiz = {}
+        self._nodos = 0
+        self._lock = threading.Lock()
+
+    def convertir(self, movimientos: list[str]):
+        """Devuelve (jugadas_uci, posiciones): la posición inicial y la que sigue a cada jugada"""
+        jugadas_uci = []
+        posiciones = [chess.STARTING_FEN]
+
+        # Prefijo ya conocido. Se lee sin lock: un nodo no cambia una vez colgado
+        # y al vaciarse se reemplaza la raíz entera, así que nunca se espera a nadie
+        hijos = self._raiz
+        i = 0
+        while i < len(movimientos):
+            nodo = hijos.get(movimientos[i].strip())
+            if nodo is None:
+                break
+            jugadas_uci.append(nodo.uci)
+            posiciones.append(nodo.fen)
+            hijos = nodo.hijos
+            i += 1
+
+        if i == len(movimientos):
+            return jugadas_uci, posiciones
+
+        # El resto se reproduce desde la última posición conocida
+        tablero = chess.Board(posiciones[-1])
+        for mov in movimientos[i:]:
+            try:
+                jugada = tablero.parse_san(mov.strip())  # "e4" → objeto jugada
+            except Exception as e:
+                print(f"Jugada inválida: {mov} - {e}")
+                break
             tablero.push(jugada)
-        except Exception as e:
-            print(f"Jugada inválida: {mov} - {e}")
-            break
+            jugadas_uci.append(jugada.uci())     # objeto jugada → "e2e4"
+            posiciones.append(tablero.fen())
+
+        if len(jugadas_uci) > i:
+            self._guardar(movimientos, jugadas_uci, posiciones)
+        return jugadas_uci, posiciones
+
+    def _guardar(self, movimientos: list[str], jugadas_uci: list[str], posiciones: list[str]):
+        """
+        Cuelga las jugadas que falten. Solo las inserciones se serializan, y sin
+        esperar: se llama desde varios hilos (los del pool y asyncio.to_thread),
+        así que si otro está insertando esta partida simplemente no se guarda
+        """
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            hijos = self._raiz
+            for indice, uci in enumerate(jugadas_uci):
+                san = movimientos[indice].strip()
+                nodo = hijos.get(san)
+                if nodo is None:
+                    if self._nodos >= self.max_nodos:
+                        # Lleno: se vacía y lo que queda de esta partida ya no se guarda
+                        self._raiz = {}
+                        self._nodos = 0
+                        return
+                    nodo = _NodoPrefijo(uci, posiciones[indice + 1])
+                    hijos[san] = nodo
+                    self._nodos += 1
+                hijos = nodo.hijos
+        finally:
+            self._lock.release()
+
+trie_prefijos = TriePrefijos(MOVE_TRIE_MAX_NODES)
 
-    return jugadas_uci
+# Función para convertir jugadas de notación algebraica (SAN) a notación UCI
+def convertir_a_uci(movimientos: list[str]) -> list[str]:
+    return trie_prefijos.convertir(movimientos)[0]
+
+# Igual que convertir_a_uci, pero también devuelve el FEN de cada posición
+# (la inicial y la que sigue a cada jugada)
+def convertir_con_posiciones(movimientos: list[str]):
+    return trie_prefijos.convertir(movimientos)
 
 # Función para generar comentarios automáticos
 def generar_comentario(eval_antes, eval_despues, best_move, move):
@@ -38,26 +122,87 @@ def generar_comentario(eval_antes, eval_despues, best_move, move):
     else:
         return "Podría ser mejor"
 
-# Función principal de análisis
-def analizar_movimientos(movimientos: list[str]):
+# Lee la evaluación de la última línea "info" de una búsqueda.
+# Stockfish la da relativa al bando que mueve; se devuelve desde el punto de vista de blancas.
+def evaluacion_desde_info(info: str, turno_blancas: bool) -> dict:
+    partes = info.split(" ")
+    if "score" not in partes:
+        return {}
+    i = partes.index("score")
+    signo = 1 if turno_blancas else -1
+    return {"type": partes[i + 1], "value": int(partes[i + 2]) * signo}
+
+# Lanza la búsqueda con el límite pedido y devuelve la mejor jugada.
+# Sin nodos ni tiempo se usa la profundidad del motor (stockfish.depth).
+def _buscar(stockfish: Stockfish, nodos: int = None, tiempo_ms: int = None):
+    if tiempo_ms:
+        return stockfish.get_best_move_time(tiempo_ms)
+    if nodos:
+        return stockfish.get_best_move_nodes(nodos)
+    return stockfish.get_best_move()
+
+# Posición con las jugadas que llevaron a ella ("position fen <inicial> moves ..."):
+# con solo el FEN el motor no ve las repeticiones de la partida.
+def fijar_posicion_con_historia(stockfish: Stockfish, tablero: chess.Board):
+    jugadas = " ".join(move.uci() for move in tablero.move_stack)
+    inicial = tablero.root().fen()
+    stockfish.set_fen_position(f"{inicial} moves {jugadas}" if jugadas else inicial, False)
+
+# Una sola búsqueda por posición: devuelve (evaluacion, mejor_jugada).
+# Si se pasa la cache de evaluaciones, se consulta antes de usar el motor
+# (las búsquedas por tiempo no son reproducibles y no se cachean).
+# Con historia el motor recibe también las jugadas del tablero; una posición
+# que ya se repitió no se cachea, porque su evaluación depende de esa historia.
+def buscar_posicion(stockfish: Stockfish, tablero: chess.Board, cache=None, nodos: int = None, tiempo_ms: int = None,
+                    historia: bool = False):
+    fen = tablero.fen()
+    clave = None
+    if historia and tablero.is_repetition(2):
+        cache = None
+    if cache is not None and not tiempo_ms:
+        clave = clave_evaluacion(fen, stockfish.depth, nodos=nodos)
+        guardada = cache.obtener(clave)
+        if guardada is not None:
+            return guardada["evaluacion"], guardada["mejor_jugada"]
+
+    # Sin "ucinewgame": la tabla de transposición se reutiliza entre jugadas seguidas
+    if historia:
+        fijar_posicion_con_historia(stockfish, tablero)
+    else:
+        stockfish.set_fen_position(fen, False)
+    mejor_jugada = _buscar(stockfish, nodos, tiempo_ms)
+    evaluacion = evaluacion_desde_info(stockfish.info, tablero.turn == chess.WHITE)
+
+    if clave is not None:
+        cache.guardar(clave, {"evaluacion": evaluacion, "mejor_jugada": mejor_jugada})
+    return evaluacion, mejor_jugada
+
+# Análisis jugada por jugada: genera cada resultado en cuanto se calcula
+def analizar_movimientos_iter(stockfish: Stockfish, movimientos: list[str], cache=None, profundidad: int = None,
+                              nodos: int = None, tiempo_ms: int = None):
     movimientos_uci = convertir_a_uci(movimientos)
 
     if not movimientos_uci:
-        return [{"error": "No se pudieron convertir las jugadas"}]
+        yield {"error": "No se pudieron convertir las jugadas"}
+        return
 
-    stockfish.set_position([])  # resetea el tablero
-    analisis = []
+    # El pool restablece la profundidad por defecto al prestar el motor
+    if profundidad:
+        stockfish.set_depth(profundidad)
 
-    for i, move in enumerate(movimientos_uci):
-        eval_antes = stockfish.get_evaluation()
-        best_move = stockfish.get_best_move()
+    tablero = chess.Board()
+
+    # La evaluación después de una jugada es la evaluación antes de la siguiente,
+    # así que cada posición se busca una única vez (N + 1 búsquedas en total)
+    eval_antes, best_move = buscar_posicion(stockfish, tablero, cache, nodos, tiempo_ms)
 
-        stockfish.make_moves_from_current_position([move])
-        eval_despues = stockfish.get_evaluation()
+    for i, move in enumerate(movimientos_uci):
+        tablero.push_uci(move)
+        eval_despues, siguiente_best_move = buscar_posicion(stockfish, tablero, cache, nodos, tiempo_ms)
 
         comentario = generar_comentario(eval_antes, eval_despues, best_move, move)
 
-        analisis.append({
+        yield {
             "jugada_num": i + 1,
             "jugada_real": movimientos[i],      # como se ingresó originalmente
             "jugada_uci": move,                 # como se interpreta
@@ -65,6 +210,143 @@ def analizar_movimientos(movimientos: list[str]):
             "evaluacion_antes": eval_antes,
             "evaluacion_despues": eval_despues,
             "comentario": comentario
+        }
+
+        eval_antes, best_move = eval_despues, siguiente_best_move
+
+# Función principal de análisis
+def analizar_movimientos(stockfish: Stockfish, movimientos: list[str], cache=None, profundidad: int = None,
+                         nodos: int = None, tiempo_ms: int = None):
+    return list(analizar_movimientos_iter(stockfish, movimientos, cache, profundidad, nodos, tiempo_ms))
+
+# Evaluación en centipeones para comparar jugadas (un mate cuenta como ±10000)
+def _a_centipeones(evaluacion: dict, turno_blancas: bool) -> int:
+    if evaluacion.get("type") != "mate":
+        return evaluacion.get("value", 0)
+    valor = evaluacion.get("value", 0)
+    if valor == 0:
+        # Mate en el tablero: pierde el bando que mueve
+        return -10000 if turno_blancas else 10000
+    return 10000 if valor > 0 else -10000
+
+# Resumen de una partida analizada para cada bando: precisión (jugadas iguales a la
+# mejor), pérdida media en centipeones y número de errores graves y jugadas dudosas
+def resumir_analisis(analisis: list[dict]) -> dict:
+    if not analisis or "error" in analisis[0]:
+        return {"jugadas": 0}
+
+    bandos = {
+        "blancas": {"jugadas": 0, "mejores": 0, "perdida_total": 0, "errores_graves": 0, "dudosas": 0},
+        "negras": {"jugadas": 0, "mejores": 0, "perdida_total": 0, "errores_graves": 0, "dudosas": 0}
+    }
+    for jugada in analisis:
+        blancas = jugada["jugada_num"] % 2 == 1
+        bando = bandos["blancas" if blancas else "negras"]
+        antes = _a_centipeones(jugada["evaluacion_antes"], blancas)
+        despues = _a_centipeones(jugada["evaluacion_despues"], not blancas)
+        perdida = antes - despues if blancas else despues - antes
+        bando["jugadas"] += 1
+        bando["mejores"] += jugada["jugada_uci"] == jugada["mejor_jugada"]
+        # Se acota para que un mate no domine la media
+        bando["perdida_total"] += min(max(perdida, 0), 1000)
+        bando["errores_graves"] += jugada["comentario"] == "Error grave"
+        bando["dudosas"] += jugada["comentario"] == "Jugada dudosa"
+
+    resumen = {"jugadas": len(analisis)}
+    for nombre, bando in bandos.items():
+        n = bando["jugadas"] or 1
+        resumen[nombre] = {
+            "precision": round(100 * bando["mejores"] / n, 1),
+            "perdida_media_cp": round(bando["perdida_total"] / n, 1),
+            "errores_graves": bando["errores_graves"],
+            "dudosas": bando["dudosas"]
+        }
+    return resumen
+
+# Análisis adaptativo: una pasada rápida a profundidad_rapida sobre toda la partida y
+# después se vuelven a buscar a la profundidad pedida solo las jugadas críticas
+# (cambio de evaluación mayor que umbral_cp), de la más crítica a la menos,
+# mientras quede presupuesto de tiempo de motor.
+def analizar_movimientos_adaptativo(stockfish: Stockfish, movimientos: list[str], cache=None, profundidad: int = None,
+                                    profundidad_rapida: int = 8, umbral_cp: int = 100, presupuesto_ms: int = None):
+    inicio = time.monotonic()
+    movimientos_uci = convertir_a_uci(movimientos)
+
+    if not movimientos_uci:
+        return [{"error": "No se pudieron convertir las jugadas"}]
+
+    profundidad = int(profundidad or stockfish.depth)
+    profundidad_rapida = min(profundidad_rapida, profundidad)
+
+    tableros = [chess.Board()]
+    for move in movimientos_uci:
+        tablero = tableros[-1].copy(stack=False)
+        tablero.push_uci(move)
+        tableros.append(tablero)
+
+    # Primera pasada: todas las posiciones a poca profundidad
+    stockfish.set_depth(profundidad_rapida)
+    resultados = [buscar_posicion(stockfish, tablero, cache) for tablero in tableros]
+    profundidades = [profundidad_rapida] * len(tableros)
+
+    # Jugadas críticas, ordenadas por el tamaño del cambio de evaluación
+    cambios = []
+    for i in range(len(movimientos_uci)):
+        antes = _a_centipeones(resultados[i][0], tableros[i].turn == chess.WHITE)
+        despues = _a_centipeones(resultados[i + 1][0], tableros[i + 1].turn == chess.WHITE)
+        if abs(despues - antes) >= umbral_cp:
+            cambios.append((abs(despues - antes), i))
+    cambios.sort(reverse=True)
+
+    # Segunda pasada: re-búsqueda profunda mientras quede presupuesto
+    stockfish.set_depth(profundidad)
+    limite = inicio + presupuesto_ms / 1000 if presupuesto_ms else None
+    for _, i in cambios:
+        if limite is not None and time.monotonic() >= limite:
+            break
+        for j in (i, i + 1):
+            if profundidades[j] < profundidad:
+                resultados[j] = buscar_posicion(stockfish, tableros[j], cache)
+                profundidades[j] = profundidad
+
+    analisis = []
+    for i, move in enumerate(movimientos_uci):
+        (eval_antes, best_move), (eval_despues, _) = resultados[i], resultados[i + 1]
+        analisis.append({
+            "jugada_num": i + 1,
+            "jugada_real": movimientos[i],
+            "jugada_uci": move,
+            "mejor_jugada": best_move,
+            "evaluacion_antes": eval_antes,
+            "evaluacion_despues": eval_despues,
+            "comentario": generar_comentario(eval_antes, eval_despues, best_move, move),
+            "profundidad": min(profundidades[i], profundidades[i + 1])
         })
 
     return analisis
+
+# Jugada de Stockfish en la posición dada; devuelve (jugada, fen resultante)
+def jugada_de_stockfish(stockfish: Stockfish, fen: str, cache=None):
+    tablero = chess.Board(fen)
+
+    _, jugada = buscar_posicion(stockfish, tablero, cache)
+    if not jugada:
+        return None, tablero.fen()
+
+    tablero.push_uci(jugada)
+    return jugada, tablero.fen()
+
+# Mejores jugadas para la posición actual; devuelve (mejores_jugadas, fen)
+def mejores_jugadas(stockfish: Stockfish, fen: str, cantidad: int = 3, cache=None):
+    if cache is not None:
+        clave = clave_evaluacion(fen, stockfish.depth, cantidad)
+        guardada = cache.obtener(clave)
+        if guardada is not None:
+            return guardada["mejores_jugadas"], fen
+
+    stockfish.set_fen_position(fen, False)
+    mejores = stockfish.get_top_moves(cantidad)
+
+    if cache is not None:
+        cache.guardar(clave, {"mejores_jugadas": mejores})
+    return mejores, fen
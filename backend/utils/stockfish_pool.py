@@ -0,0 +1,351 @@
+# /backend/utils/stockfish_pool.py
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from stockfish import Stockfish
+from config import (STOCKFISH_PATH, STOCKFISH_DEPTH, STOCKFISH_POOL_SIZE, STOCKFISH_HUNG_SECONDS,
+                    ENGINE_QUEUE_MAX, ENGINE_USER_MAX, ENGINE_INTERACTIVE_RESERVED)
+from utils.metricas import metricas
+
+# Marca de fin para los generadores que se recorren con StockfishPool.iterar
+_FIN = object()
+
+# Prioridades al esperar un motor libre: menor número, antes se atiende
+PRIORIDAD_INTERACTIVA = 0  # pistas y jugadas del bot: alguien está mirando el tablero
+PRIORIDAD_ANALISIS = 1     # análisis de partidas completas
+
+class MotorSaturado(Exception):
+    """No se admite más trabajo por ahora; reintentar_en son los segundos sugeridos (Retry-After)"""
+
+    def __init__(self, mensaje: str, reintentar_en: int):
+        super().__init__(mensaje)
+        self.reintentar_en = reintentar_en
+
+# Nodos por segundo: de 100 mil a 100 millones
+LIMITES_NPS = (100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000, 25_000_000, 100_000_000)
+
+class MotorStockfish(Stockfish):
+    """
+    Stockfish con métricas: tiempo de cada llamada al motor (stockfish.<método>,
+    en ms) y nodos por segundo de cada búsqueda (stockfish.nps).
+    """
+
+    def _medir(self, nombre: str, funcion, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            metricas.observar(f"stockfish.{nombre}", (time.perf_counter() - inicio) * 1000)
+
+    def _registrar_nps(self):
+        partes = self.info.split(" ")
+        if "nps" in partes:
+            metricas.observar("stockfish.nps", int(partes[partes.index("nps") + 1]), LIMITES_NPS)
+
+    def get_evaluation(self, *args, **kwargs):
+        return self._medir("get_evaluation", super().get_evaluation, *args, **kwargs)
+
+    def get_top_moves(self, *args, **kwargs):
+        return self._medir("get_top_moves", super().get_top_moves, *args, **kwargs)
+
+    def set_position(self, *args, **kwargs):
+        return self._medir("set_position", super().set_position, *args, **kwargs)
+
+    def set_fen_position(self, *args, **kwargs):
+        return self._medir("set_fen_position", super().set_fen_position, *args, **kwargs)
+
+    def get_best_move(self, *args, **kwargs):
+        jugada = self._medir("get_best_move", super().get_best_move, *args, **kwargs)
+        self._registrar_nps()
+        return jugada
+
+    def get_best_move_time(self, *args, **kwargs):
+        jugada = self._medir("get_best_move_time", super().get_best_move_time, *args, **kwargs)
+        self._registrar_nps()
+        return jugada
+
+    def get_best_move_nodes(self, nodos: int):
+        """Mejor jugada limitando la búsqueda por nodos (la librería no expone "go nodes")"""
+        def buscar():
+            self._put(f"go nodes {nodos}")
+            return self._get_best_move_from_sf_popen_process()
+        jugada = self._medir("get_best_move_nodes", buscar)
+        self._registrar_nps()
+        return jugada
+
+    @property
+    def pid(self) -> int:
+        return self._stockfish.pid
+
+    def vivo(self) -> bool:
+        return self._stockfish.poll() is None
+
+    def terminar(self, espera_s: float = 2.0):
+        """Cierra el proceso: "quit" si responde a tiempo y, si no (colgado o a mitad de búsqueda), kill"""
+        if not self.vivo():
+            return
+        try:
+            self._put("quit")
+            self._stockfish.wait(espera_s)
+        except Exception:
+            self._stockfish.kill()
+            self._stockfish.wait()
+
+class StockfishPool:
+    """
+    Pool de procesos Stockfish aislados.
+    Cada petición toma un motor en exclusiva, lo usa en un hilo aparte (para no
+    bloquear el event loop) y lo devuelve al terminar. Si el motor falla se
+    descarta y se arranca uno nuevo en segundo plano.
+
+    Un análisis ocupa su motor durante toda la partida, así que el análisis no
+    puede llevarse los últimos `reservados` motores libres: quedan para las
+    peticiones interactivas, que no esperan a que termine ningún análisis.
+    """
+
+    def __init__(self, path: str, depth: int, size: int, reservados: int = 0):
+        self.path = path
+        self.depth = depth
+        self.size = max(1, size)
+        # Siempre queda al menos un motor para el análisis
+        self.reservados = max(0, min(reservados, self.size - 1))
+        self.reinicios = 0
+        # Todos los motores vivos y, de los prestados, desde cuándo
+        self._motores: list[MotorStockfish] = []
+        self._ocupados: dict[int, float] = {}
+        # Motores libres (None hasta que el pool arranca)
+        self._libres: list = None
+        # Quienes esperan un motor: heap de (prioridad, orden de llegada, future)
+        self._esperas: list = []
+        self._orden = itertools.count()
+        # Peticiones en curso (esperando o con motor) de cada usuario
+        self._por_usuario: dict[str, int] = {}
+        self._arranque: asyncio.Future = None
+        self._tareas_fondo = set()
+
+    def _crear_motor(self) -> MotorStockfish:
+        motor = MotorStockfish(path=self.path, depth=self.depth)
+        self._motores.append(motor)
+        return motor
+
+    async def _arrancar(self):
+        libres = []
+        for _ in range(self.size):
+            motor = await asyncio.to_thread(self._crear_motor)
+            libres.append(motor)
+        self._libres = libres
+        print(f"Pool de Stockfish iniciado con {self.size} motores")
+
+    async def iniciar(self):
+        """Arranca los procesos del pool (se llama en el startup de la app)"""
+        if self._arranque is None:
+            self._arranque = asyncio.ensure_future(self._arrancar())
+        # Protegido: cancelar a quien espera no deja el pool a medio arrancar
+        await asyncio.shield(self._arranque)
+
+    async def cerrar(self):
+        """Cierra todos los motores arrancados, también los que estén prestados"""
+        if self._arranque is None:
+            return
+        await asyncio.shield(self._arranque)
+        # Con _libres a None, los motores que vuelvan después se cierran en lugar de guardarse
+        self._libres = None
+        self._arranque = None
+        self._ocupados = {}
+        # Reinicios y cierres en curso (el motor de un reinicio se descarta al llegar)
+        while self._tareas_fondo:
+            await asyncio.gather(*self._tareas_fondo, return_exceptions=True)
+        motores, self._motores = self._motores, []
+        for motor in motores:
+            await asyncio.to_thread(motor.terminar)
+
+    def _descartar(self, motor: MotorStockfish):
+        """Quita un motor del pool y cierra su proceso en un hilo"""
+        if motor in self._motores:
+            self._motores.remove(motor)
+        cierre = asyncio.ensure_future(asyncio.to_thread(motor.terminar))
+        self._tareas_fondo.add(cierre)
+        cierre.add_done_callback(self._tareas_fondo.discard)
+
+    def _reserva(self, prioridad: int) -> int:
+        """Motores libres que quien tiene esta prioridad debe dejar sin tocar"""
+        return self.reservados if prioridad > PRIORIDAD_INTERACTIVA else 0
+
+    def _en_espera(self, prioridad: int) -> int:
+        """Cuántos esperan un motor y serían atendidos antes que alguien con esta prioridad"""
+        return sum(1 for p, _, espera in self._esperas if p <= prioridad and not espera.done())
+
+    def _reintentar_en(self, por_delante: int) -> int:
+        """Segundos estimados hasta que se libere un motor para quien llegue ahora"""
+        uso_s = metricas.media("pool.uso_motor", 1000) / 1000
+        return max(1, math.ceil((por_delante + 1) / self.size * uso_s))
+
+    def _admitir(self, usuario: str, prioridad: int):
+        """
+        Control de admisión: límite de peticiones simultáneas por usuario y de
+        esperas por delante en la cola. Sin usuario (trabajos internos, ya
+        acotados por sus propios trabajadores) siempre se espera turno.
+        """
+        if usuario is None:
+            return
+        por_delante = self._en_espera(prioridad)
+        if self._por_usuario.get(usuario, 0) >= ENGINE_USER_MAX:
+            metricas.incrementar("pool.rechazos_usuario")
+            raise MotorSaturado("Demasiadas peticiones al motor en curso", self._reintentar_en(por_delante))
+        if por_delante >= ENGINE_QUEUE_MAX:
+            metricas.incrementar("pool.rechazos_saturado")
+            raise MotorSaturado("El motor está saturado, inténtalo de nuevo en unos segundos",
+                                self._reintentar_en(por_delante))
+        self._por_usuario[usuario] = self._por_usuario.get(usuario, 0) + 1
+
+    def _salir(self, usuario: str):
+        if usuario is None:
+            return
+        self._por_usuario[usuario] -= 1
+        if not self._por_usuario[usuario]:
+            del self._por_usuario[usuario]
+
+    async def _tomar(self, prioridad: int = PRIORIDAD_ANALISIS) -> MotorStockfish:
+        if self._libres is None:
+            await self.iniciar()
+        inicio = time.perf_counter()
+        if len(self._libres) > self._reserva(prioridad) and not self._en_espera(prioridad):
+            motor = self._libres.pop()
+        else:
+            espera = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._esperas, (prioridad, next(self._orden), espera))
+            try:
+                motor = await espera
+            except asyncio.CancelledError:
+                # Se le asignó un motor justo cuando se cancelaba: pasa al siguiente
+                if espera.done() and not espera.cancelled():
+                    self._devolver(espera.result())
+                raise
+        metricas.observar("pool.espera_motor", (time.perf_counter() - inicio) * 1000)
+        self._ocupados[id(motor)] = time.monotonic()
+        # Quien lo usó antes pudo cambiar la profundidad (solo es un atributo, no habla con el motor)
+        motor.set_depth(self.depth)
+        return motor
+
+    def _devolver(self, motor: MotorStockfish):
+        inicio = self._ocupados.pop(id(motor), None)
+        if inicio is not None:
+            metricas.observar("pool.uso_motor", (time.monotonic() - inicio) * 1000)
+        if self._libres is None:
+            # El pool se cerró mientras estaba prestado
+            self._descartar(motor)
+            return
+        # Se entrega al primero de mayor prioridad; las esperas canceladas se descartan
+        while self._esperas:
+            prioridad, _, espera = self._esperas[0]
+            if espera.done():
+                heapq.heappop(self._esperas)
+                continue
+            if len(self._libres) < self._reserva(prioridad):
+                break  # completa la reserva; el análisis sigue esperando
+            heapq.heappop(self._esperas)
+            espera.set_result(motor)
+            return
+        self._libres.append(motor)
+
+    async def _reiniciar(self):
+        self.reinicios += 1
+        metricas.incrementar("pool.reinicios")
+        motor = await asyncio.to_thread(self._crear_motor)
+        self._devolver(motor)
+
+    def _al_terminar(self, motor: MotorStockfish, tarea: asyncio.Future):
+        """Devuelve el motor al pool cuando el hilo termina, o lo reemplaza si falló"""
+        if tarea.cancelled() or tarea.exception() is not None:
+            print(f"Motor Stockfish descartado: {None if tarea.cancelled() else tarea.exception()}")
+            self._ocupados.pop(id(motor), None)
+            self._descartar(motor)
+            if self._libres is None:
+                return
+            reinicio = asyncio.ensure_future(self._reiniciar())
+            self._tareas_fondo.add(reinicio)
+            reinicio.add_done_callback(self._tareas_fondo.discard)
+        else:
+            self._devolver(motor)
+
+    async def ejecutar(self, funcion, *args, prioridad: int = PRIORIDAD_ANALISIS, usuario: str = None, **kwargs):
+        """
+        Ejecuta funcion(motor, *args, **kwargs) con un motor del pool en un hilo.
+        Si quien espera se cancela (p. ej. el cliente se fue), la búsqueda en curso
+        termina igualmente antes de que el motor vuelva al pool.
+        Con usuario se aplica el control de admisión (lanza MotorSaturado); la
+        plaza del usuario se libera cuando acaba la búsqueda, no cuando se cancela
+        la espera, para que abrir y abandonar peticiones no sortee ENGINE_USER_MAX.
+        """
+        self._admitir(usuario, prioridad)
+        try:
+            motor = await self._tomar(prioridad)
+        except BaseException:
+            self._salir(usuario)
+            raise
+        tarea = asyncio.ensure_future(asyncio.to_thread(funcion, motor, *args, **kwargs))
+        tarea.add_done_callback(lambda t: self._al_terminar(motor, t))
+        tarea.add_done_callback(lambda t: self._salir(usuario))
+        return await asyncio.shield(tarea)
+
+    async def iterar(self, generadora, *args, prioridad: int = PRIORIDAD_ANALISIS, usuario: str = None, **kwargs):
+        """
+        Versión en streaming de ejecutar: generadora(motor, ...) es un generador
+        bloqueante y cada paso corre en un hilo. Los resultados se entregan en
+        cuanto están listos; si el consumidor abandona (cliente desconectado) no
+        se piden más pasos y el motor vuelve al pool al acabar el paso en curso.
+        """
+        self._admitir(usuario, prioridad)
+        try:
+            motor = await self._tomar(prioridad)
+        except BaseException:
+            self._salir(usuario)
+            raise
+        generador = generadora(motor, *args, **kwargs)
+        paso = None
+        try:
+            while True:
+                paso = asyncio.ensure_future(asyncio.to_thread(next, generador, _FIN))
+                resultado = await asyncio.shield(paso)
+                if resultado is _FIN:
+                    return
+                yield resultado
+        finally:
+            if paso is None:
+                self._devolver(motor)
+                self._salir(usuario)
+            elif paso.done():
+                self._al_terminar(motor, paso)
+                self._salir(usuario)
+            else:
+                # El paso en curso sigue en su hilo: motor y plaza se liberan cuando acabe
+                paso.add_done_callback(lambda t: self._al_terminar(motor, t))
+                paso.add_done_callback(lambda t: self._salir(usuario))
+
+    def salud(self) -> dict:
+        """Estado de cada proceso; un motor prestado durante demasiado tiempo probablemente está colgado"""
+        ahora = time.monotonic()
+        motores = []
+        for motor in self._motores:
+            inicio = self._ocupados.get(id(motor))
+            ocupado_s = round(ahora - inicio, 1) if inicio is not None else None
+            motores.append({
+                "pid": motor.pid,
+                "vivo": motor.vivo(),
+                "ocupado_s": ocupado_s,
+                "colgado": ocupado_s is not None and ocupado_s > STOCKFISH_HUNG_SECONDS
+            })
+        return {
+            "tamano": self.size,
+            "libres": len(self._libres) if self._libres is not None else 0,
+            "ocupados": len(self._ocupados),
+            "en_espera": self._en_espera(PRIORIDAD_ANALISIS),
+            "usuarios_activos": len(self._por_usuario),
+            "reinicios": self.reinicios,
+            "motores": motores
+        }
+
+# Instancia global del pool
+stockfish_pool = StockfishPool(STOCKFISH_PATH, STOCKFISH_DEPTH, STOCKFISH_POOL_SIZE, ENGINE_INTERACTIVE_RESERVED)
@@ -0,0 +1,305 @@
+# /backend/utils/trabajos_analisis.py
+import asyncio
+import math
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from models.analisis import OpcionesAnalisis
+from utils import servicio_analisis
+from utils.stockfish_analysis import resumir_analisis
+from utils.stockfish_pool import MotorSaturado
+from utils.metricas import metricas
+from config import (ANALYSIS_WORKERS, ANALYSIS_JOBS_RETAINED, ANALYSIS_QUEUE_MAX, ENGINE_USER_MAX,
+                    ANALYSIS_JOBS_TTL_SECONDS)
+
+class ColaAnalisis:
+    """
+    Cola de trabajos de análisis de partidas completas.
+    Los trabajadores ejecutan el análisis fuera de la petición HTTP usando el
+    pool de Stockfish. Las peticiones idénticas (misma partida y opciones)
+    mientras el trabajo está pendiente o en curso se agrupan en un único cálculo.
+
+    Cada cambio de estado de un trabajo o lote se copia además en MongoDB
+    (trabajos_analisis y analisis_lotes, con caducidad TTL): con varios workers,
+    la consulta puede llegar a uno distinto del que lo ejecuta.
+    """
+
+    def __init__(self, trabajadores: int, retenidos: int):
+        self.trabajadores = max(1, trabajadores)
+        # Trabajos terminados que se conservan para poder consultar su resultado
+        self.retenidos = retenidos
+        self.agrupados = 0
+        self._trabajos: OrderedDict = OrderedDict()
+        # (partida_id, opciones) → job_id del trabajo pendiente o en curso
+        self._activos: dict = {}
+        self._eventos: dict = {}
+        self._cola: asyncio.Queue = None
+        self._tareas: list = []
+        self._lotes: OrderedDict = OrderedDict()
+        self._indices = False
+
+    def _arrancar(self):
+        if self._cola is None:
+            self._cola = asyncio.Queue()
+            self._tareas = [asyncio.create_task(self._trabajador()) for _ in range(self.trabajadores)]
+
+    async def cerrar(self):
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        self._cola = None
+
+    def _admitir(self, usuario: str):
+        """
+        Límite de trabajos activos por usuario y de trabajos pendientes en total:
+        mejor un 429 rápido que una espera que crece sin límite
+        """
+        activos = [self._trabajos[j] for j in self._activos.values()]
+        pendientes = sum(1 for t in activos if t["estado"] == "pendiente")
+        if usuario is not None and sum(1 for t in activos if t["usuario"] == usuario) >= ENGINE_USER_MAX:
+            metricas.incrementar("analisis.rechazos_usuario")
+            raise MotorSaturado("Ya tienes análisis en curso; espera a que terminen", self._reintentar_en(pendientes))
+        if pendientes >= ANALYSIS_QUEUE_MAX:
+            metricas.incrementar("analisis.rechazos_saturado")
+            raise MotorSaturado("Hay demasiados análisis en cola, inténtalo más tarde", self._reintentar_en(pendientes))
+
+    def _admitir_lote(self, nuevos: int):
+        """
+        Admisión de un lote entero antes de encolar nada: o caben todos sus
+        trabajos nuevos en la cola o no entra ninguno
+        """
+        if nuevos > ANALYSIS_QUEUE_MAX:
+            raise ValueError(f"El lote necesita {nuevos} análisis y la cola admite {ANALYSIS_QUEUE_MAX}; divídelo")
+        pendientes = sum(1 for j in self._activos.values() if self._trabajos[j]["estado"] == "pendiente")
+        if pendientes + nuevos > ANALYSIS_QUEUE_MAX:
+            metricas.incrementar("analisis.rechazos_saturado")
+            raise MotorSaturado("Hay demasiados análisis en cola para este lote, inténtalo más tarde",
+                                self._reintentar_en(pendientes + nuevos))
+
+    def _reintentar_en(self, pendientes: int) -> int:
+        duracion_s = metricas.media("analisis.partida.fijo", 10000) / 1000
+        return max(1, math.ceil((pendientes + 1) / self.trabajadores * duracion_s))
+
+    def enviar(self, db, partida: dict, opciones: OpcionesAnalisis, usuario: str = None) -> dict:
+        """
+        Encola el análisis o devuelve el trabajo idéntico que ya está en marcha.
+        Con usuario se aplica el control de admisión (lanza MotorSaturado).
+        """
+        opciones = servicio_analisis.completar_opciones(opciones)
+        clave = _clave(partida, opciones)
+        if clave in self._activos:
+            self.agrupados += 1
+            return self._trabajos[self._activos[clave]]
+
+        self._admitir(usuario)
+        return self._encolar(db, partida, opciones, clave, usuario)
+
+    def _encolar(self, db, partida: dict, opciones: OpcionesAnalisis, clave: tuple, usuario: str = None) -> dict:
+        self._arrancar()
+        job_id = str(uuid.uuid4())
+        trabajo = {
+            "job_id": job_id,
+            "partida_id": clave[0],
+            "usuario": usuario,
+            "opciones": opciones.model_dump(),
+            "estado": "pendiente",
+            "creado": datetime.utcnow(),
+            "terminado": None,
+            "error": None,
+            "resultado": None
+        }
+        self._trabajos[job_id] = trabajo
+        self._activos[clave] = job_id
+        self._eventos[job_id] = asyncio.Event()
+        self._cola.put_nowait((job_id, db, partida, opciones, clave))
+        self._reflejar(db, "trabajos_analisis", trabajo, vista_trabajo(trabajo))
+        return trabajo
+
+    def _reflejar(self, db, coleccion: str, registro: dict, documento: dict):
+        """
+        Copia el estado en MongoDB en segundo plano. Las escrituras de un mismo
+        registro van en orden (cada una espera a la anterior); la última queda en
+        registro["_reflejo"] para quien necesite esperarla.
+        """
+        anterior = registro.get("_reflejo")
+        registro["_reflejo"] = asyncio.ensure_future(self._escribir(db, coleccion, documento, anterior))
+
+    async def _escribir(self, db, coleccion: str, documento: dict, anterior: asyncio.Future):
+        if anterior is not None:
+            await asyncio.wait([anterior])
+        if not self._indices:
+            self._indices = True
+            try:
+                for nombre in ("trabajos_analisis", "analisis_lotes"):
+                    await db[nombre].create_index("creado", expireAfterSeconds=ANALYSIS_JOBS_TTL_SECONDS)
+            except Exception as e:
+                print(f"No se pudieron crear los índices TTL del análisis: {e}")
+        try:
+            clave = documento.get("job_id") or documento["lote_id"]
+            await db[coleccion].replace_one({"_id": clave}, {**documento, "_id": clave}, upsert=True)
+        except Exception as e:
+            print(f"Error al copiar en {coleccion} el estado de análisis: {e}")
+
+    async def compartido(self, registro: dict):
+        """Espera a que el estado del trabajo o lote esté en MongoDB (antes de dar su id)"""
+        reflejo = registro.get("_reflejo")
+        if reflejo is not None:
+            await asyncio.wait([reflejo])
+
+    async def obtener(self, db, job_id: str):
+        """Trabajo de este worker o, si no, el copiado en MongoDB por otro"""
+        trabajo = self._trabajos.get(job_id)
+        if trabajo is None:
+            trabajo = await db.trabajos_analisis.find_one({"_id": job_id})
+        return trabajo
+
+    async def esperar(self, job_id: str) -> list[dict]:
+        """Espera a que el trabajo termine y devuelve su resultado"""
+        trabajo = self._trabajos[job_id]
+        evento = self._eventos.get(job_id)
+        if evento is not None:
+            await evento.wait()
+        if trabajo["estado"] == "error":
+            raise trabajo["_excepcion"]
+        return trabajo["resultado"]
+
+    async def _trabajador(self):
+        while True:
+            job_id, db, partida, opciones, clave = await self._cola.get()
+            trabajo = self._trabajos[job_id]
+            trabajo["estado"] = "en_curso"
+            self._reflejar(db, "trabajos_analisis", trabajo, vista_trabajo(trabajo))
+            try:
+                trabajo["resultado"] = await servicio_analisis.analizar_partida(db, partida, opciones)
+                trabajo["estado"] = "terminado"
+            except Exception as e:
+                print(f"Error en el trabajo de análisis {job_id}: {e}")
+                trabajo["estado"] = "error"
+                trabajo["error"] = getattr(e, "detail", str(e))
+                trabajo["_excepcion"] = e
+
+            trabajo["terminado"] = datetime.utcnow()
+            self._reflejar(db, "trabajos_analisis", trabajo, vista_trabajo(trabajo))
+            del self._activos[clave]
+            self._eventos.pop(job_id).set()
+            self._purgar()
+
+    def enviar_lote(self, db, partidas: list[dict], opciones: OpcionesAnalisis) -> dict:
+        """
+        Encola el análisis de varias partidas. Se reparten entre los trabajadores
+        (y por tanto entre los motores del pool); las que ya tienen un análisis
+        guardado suficiente no generan trabajo.
+        Si sus trabajos nuevos no caben en la cola no se encola ninguno
+        (MotorSaturado, o ValueError si el lote no cabría nunca).
+        """
+        opciones = servicio_analisis.completar_opciones(opciones)
+        sin_guardar = [p for p in partidas if servicio_analisis.analisis_guardado(p, opciones) is None]
+        self._admitir_lote(len({_clave(p, opciones) for p in sin_guardar} - self._activos.keys()))
+
+        lote = {"lote_id": str(uuid.uuid4()), "creado": datetime.utcnow(), "partidas": []}
+        for partida in partidas:
+            entrada = {
+                "partida_id": str(partida["_id"]),
+                "white_player": partida.get("white_player"),
+                "black_player": partida.get("black_player"),
+                "resultado": partida.get("result_code") or partida.get("result"),
+                "trabajo": None,
+                "resumen": None
+            }
+            guardado = servicio_analisis.analisis_guardado(partida, opciones)
+            if guardado is not None:
+                entrada["resumen"] = resumir_analisis(guardado["jugadas"])
+            else:
+                # Se guarda el trabajo en sí: sigue disponible aunque la cola lo olvide
+                clave = _clave(partida, opciones)
+                if clave in self._activos:
+                    self.agrupados += 1
+                    entrada["trabajo"] = self._trabajos[self._activos[clave]]
+                else:
+                    entrada["trabajo"] = self._encolar(db, partida, opciones, clave)
+            lote["partidas"].append(entrada)
+
+        self._lotes[lote["lote_id"]] = lote
+        while len(self._lotes) > self.retenidos:
+            self._lotes.popitem(last=False)
+        # Los trabajos se guardan por id: otro worker los busca en trabajos_analisis
+        self._reflejar(db, "analisis_lotes", lote, {
+            "lote_id": lote["lote_id"],
+            "creado": lote["creado"],
+            "partidas": [
+                {**{k: v for k, v in entrada.items() if k != "trabajo"},
+                 "job_id": entrada["trabajo"]["job_id"] if entrada["trabajo"] else None}
+                for entrada in lote["partidas"]
+            ]
+        })
+        return lote
+
+    async def estado_lote(self, db, lote_id: str):
+        """Progreso del lote y resumen de cada partida ya analizada"""
+        lote = self._lotes.get(lote_id)
+        if lote is None:
+            lote = await self._lote_compartido(db, lote_id)
+            if lote is None:
+                return None
+
+        conteo = {"pendiente": 0, "en_curso": 0, "terminado": 0, "error": 0}
+        partidas = []
+        for entrada in lote["partidas"]:
+            trabajo = entrada["trabajo"]
+            estado = "terminado" if trabajo is None else trabajo["estado"]
+            conteo[estado] += 1
+
+            vista = {k: entrada[k] for k in ("partida_id", "white_player", "black_player", "resultado")}
+            vista["estado"] = estado
+            if estado == "terminado":
+                vista["resumen"] = entrada["resumen"] if trabajo is None else resumir_analisis(trabajo["resultado"])
+            elif estado == "error":
+                vista["error"] = trabajo["error"]
+            partidas.append(vista)
+
+        total = len(lote["partidas"])
+        return {
+            "lote_id": lote_id,
+            "creado": lote["creado"],
+            "total": total,
+            **conteo,
+            "progreso": round(100 * (conteo["terminado"] + conteo["error"]) / total, 1) if total else 100.0,
+            "partidas": partidas
+        }
+
+    async def _lote_compartido(self, db, lote_id: str):
+        """Lote creado en otro worker, con sus trabajos tal como están en MongoDB"""
+        lote = await db.analisis_lotes.find_one({"_id": lote_id})
+        if lote is None:
+            return None
+        ids = [entrada["job_id"] for entrada in lote["partidas"] if entrada["job_id"]]
+        copiados = {t["_id"]: t for t in await db.trabajos_analisis.find({"_id": {"$in": ids}}).to_list(None)}
+        for entrada in lote["partidas"]:
+            job_id = entrada.pop("job_id")
+            if job_id is None:
+                entrada["trabajo"] = None
+            else:
+                entrada["trabajo"] = self._trabajos.get(job_id) or copiados.get(job_id) or \
+                    {"estado": "error", "error": "Trabajo caducado"}
+        return lote
+
+    def _purgar(self):
+        """Olvida los trabajos terminados más antiguos por encima del límite"""
+        terminados = [j for j, t in self._trabajos.items() if t["estado"] in ("terminado", "error")]
+        for job_id in terminados[:max(0, len(terminados) - self.retenidos)]:
+            del self._trabajos[job_id]
+
+def _clave(partida: dict, opciones: OpcionesAnalisis) -> tuple:
+    """Trabajos idénticos (misma partida y opciones) se agrupan en uno"""
+    return (str(partida["_id"]), tuple(opciones.model_dump().values()))
+
+def vista_trabajo(trabajo: dict, con_resultado: bool = True) -> dict:
+    """Datos públicos del trabajo (sin los campos internos que empiezan con _)"""
+    vista = {k: v for k, v in trabajo.items() if not k.startswith("_")}
+    if not con_resultado:
+        vista.pop("resultado")
+    return vista
+
+# Instancia global de la cola
+cola_analisis = ColaAnalisis(ANALYSIS_WORKERS, ANALYSIS_JOBS_RETAINED)
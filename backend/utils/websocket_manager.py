@@ -1,136 +1,515 @@
 # /backend/utils/websocket_manager.py
 from fastapi import WebSocket
-from typing import Dict, List, Set
+from typing import Dict, Set
+import asyncio
 import json
+import random
+import time
 import uuid
-from datetime import datetime
-from models.live_game import LiveGame, GameMessage
-from utils.chess_validation import validate_move_format, STARTING_FEN
+import chess
+from utils.chess_validation import validate_move_format
+from utils.partida_viva import PartidaViva
+from utils.backplane import crear_backplane, CANAL_TODOS
+from utils.matchmaking import Emparejador
+from utils.metricas import metricas
+from utils.diario_partidas import diario_partidas
+from utils.guardado_partidas import guardado_partidas
+from utils.relojes import PlanificadorRelojes
+from utils.protocolo_binario import codificar_jugada, PING
+from utils.lobby import IndiceLobby
+from config import (BACKPLANE_URL, MATCHMAKING_TICK_SECONDS, MATCHMAKING_BASE_WINDOW,
+                    MATCHMAKING_WIDEN_PER_SECOND, MATCHMAKING_MAX_WINDOW,
+                    WS_SEND_QUEUE_MAX, WS_SLOW_CONSUMER_POLICY,
+                    WS_HEARTBEAT_SECONDS, WS_HEARTBEAT_MISSED_MAX, LOBBY_PUSH_MS,
+                    CLOCK_INITIAL_SECONDS, CLOCK_INCREMENT_SECONDS, GAME_ABANDON_SECONDS)
+
+# Pings de aplicación tal como los mandan los clientes: se contestan sin pasar por json
+PING_FRAMES = frozenset({'{"type":"ping"}', '{"type": "ping"}', "ping"})
+PING_FRAME = '{"type": "ping"}'
+PONG_FRAME = '{"type": "pong"}'
+
+class ClientConnection:
+    """
+    Socket de un usuario con su cola de salida acotada y una tarea que la vacía.
+    Encolar nunca espera: un cliente lento no retrasa a nadie más, solo llena su cola.
+    En la cola puede haber texto (JSON) o bytes (tramas del protocolo binario).
+    """
+
+    def __init__(self, websocket: WebSocket, username: str, max_queue: int, on_error, binary: bool = False):
+        self.websocket = websocket
+        self.username = username
+        # Negoció el protocolo binario: las tramas frecuentes le llegan compactas
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.dropped = 0
+        # Último mensaje recibido del cliente (time.monotonic), para el latido
+        self.last_seen = time.monotonic()
+        # Usa el latido de aplicación (ha mandado algún ping propio); solo a estos se les exige
+        self.heartbeat = False
+        self._on_error = on_error
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Conexión cerrada: el manager la limpia
+            self._on_error(self)
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def mark_heartbeat(self):
+        self.heartbeat = True
+
+    def send(self, frame) -> bool:
+        """Encola el texto o la trama; False si la cola está llena"""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self._writer.cancel()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass  # ya estaba cerrado
 
 class ConnectionManager:
-    def __init__(self):
+    """
+    Conexiones y partidas en vivo de este worker. Con varios workers, el
+    backplane indica dónde está cada usuario y qué worker es dueño de cada
+    partida y de la cola de matchmaking; los mensajes para usuarios o partidas
+    de otro worker se reenvían por él.
+    """
+
+    def __init__(self, backplane):
         # Conexiones activas por usuario
-        self.active_connections: Dict[str, WebSocket] = {}
-        # Salas de juego activas {game_id: {players, game_data}}
-        self.active_games: Dict[str, Dict] = {}
-        # Cola de jugadores buscando partida
-        self.matchmaking_queue: List[str] = []
+        self.active_connections: Dict[str, ClientConnection] = {}
+        # Salas de juego activas {game_id: PartidaViva}
+        self.active_games: Dict[str, PartidaViva] = {}
+        # Cola de jugadores buscando partida, ordenada por ELO
+        self.matchmaking = Emparejador(MATCHMAKING_BASE_WINDOW, MATCHMAKING_WIDEN_PER_SECOND, MATCHMAKING_MAX_WINDOW)
         # Mapping de usuario a game_id
         self.user_to_game: Dict[str, str] = {}
+        # Espectadores de las partidas de este worker {game_id: {username: worker_id}}
+        self.spectators: Dict[str, Dict[str, str]] = {}
+        # Partida que mira cada espectador conectado a este worker {username: game_id}
+        self.spectating: Dict[str, str] = {}
+        # Momento (time.monotonic) en que empezó a correr el reloj del turno actual {game_id: t}
+        self.turn_started: Dict[str, float] = {}
+        # Vencimientos de todos los relojes de este worker en un solo planificador
+        self.clocks = PlanificadorRelojes()
+        # Lobby de todos los workers y usuarios de este worker suscritos a sus cambios
+        self.lobby = IndiceLobby()
+        self.lobby_subscribers: Set[str] = set()
+        self.backplane = backplane
+        self._tasks: Set[asyncio.Task] = set()
+        self._matchmaking_task: asyncio.Task = None
+        self._heartbeat_task: asyncio.Task = None
+        self._lobby_task: asyncio.Task = None
+
+    async def start(self):
+        await self.backplane.iniciar(self._on_backplane_message)
+        await self.clocks.iniciar(self._on_timer)
+        self._matchmaking_task = asyncio.create_task(self._matchmaking_loop())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        self._lobby_task = asyncio.create_task(self._lobby_loop())
+        # Los demás workers nos mandan sus partidas para completar el lobby
+        await self.backplane.publicar(CANAL_TODOS, {"tipo": "lobby_sync", "worker": self.backplane.worker_id})
 
-    async def connect(self, websocket: WebSocket, username: str):
+    async def stop(self):
+        for task in (self._matchmaking_task, self._heartbeat_task, self._lobby_task):
+            if task is not None:
+                task.cancel()
+        self._matchmaking_task = self._heartbeat_task = self._lobby_task = None
+        await self.clocks.cerrar()
+        await self.backplane.cerrar()
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def connect(self, websocket: WebSocket, username: str, binary: bool = False) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[username] = websocket
+        previous = self.active_connections.get(username)
+        connection = ClientConnection(websocket, username, WS_SEND_QUEUE_MAX, self._on_connection_error, binary)
+        self.active_connections[username] = connection
+        if previous is not None:
+            self._spawn(previous.close(reason="Sesión abierta en otra conexión"))
+        # La última conexión manda, también si la anterior estaba en otro worker
+        await self.backplane.reclamar(f"usuario:{username}", forzar=True)
         print(f"Usuario {username} conectado")
 
-    def disconnect(self, username: str):
-        if username in self.active_connections:
+        # Si tenía una partida en pausa (desconexión o reinicio del servidor), se le reengancha
+        if username in self.user_to_game:
+            await self._player_returned(username)
+        else:
+            await self.backplane.publicar(CANAL_TODOS, {"tipo": "conectado", "usuario": username})
+        return connection
+
+    def disconnect(self, username: str, websocket: WebSocket = None, code: int = 1000, reason: str = ""):
+        connection = self.active_connections.get(username)
+        # Una conexión antigua que se cierra no debe tumbar a la nueva del mismo usuario
+        if websocket is not None and (connection is None or connection.websocket is not websocket):
+            return
+        if connection is not None:
             del self.active_connections[username]
+            self._spawn(connection.close(code, reason))
         
-        # Remover de cola de matchmaking si está
-        if username in self.matchmaking_queue:
-            self.matchmaking_queue.remove(username)
-        
-        # Si está en una partida, notificar al oponente
-        if username in self.user_to_game:
-            game_id = self.user_to_game[username]
-            if game_id in self.active_games:
-                game = self.active_games[game_id]
-                opponent = None
-                if game["white_player"] == username:
-                    opponent = game["black_player"]
-                elif game["black_player"] == username:
-                    opponent = game["white_player"]
-                
-                if opponent and opponent in self.active_connections:
-                    self.send_personal_message({
-                        "type": "opponent_disconnected",
-                        "message": f"{username} se ha desconectado"
-                    }, opponent)
-                
-                # Pausar o terminar la partida
-                game["status"] = "paused"
-            
-            del self.user_to_game[username]
+        # Cola, partida y backplane necesitan enviar mensajes: se hace en segundo plano
+        self._spawn(self._release_user(username))
         
         print(f"Usuario {username} desconectado")
 
-    async def send_personal_message(self, message: dict, username: str):
+    def _on_connection_error(self, connection: ClientConnection):
+        self.disconnect(connection.username, connection.websocket)
+
+    async def _heartbeat_loop(self):
+        """
+        Latido central para los clientes que usan el latido de aplicación: al que
+        lleva un intervalo callado se le manda un ping, y al que no ha dado señales
+        en WS_HEARTBEAT_MISSED_MAX intervalos se le desconecta como a cualquier
+        otro (cola, partida y backplane incluidos).
+
+        Los pongs de protocolo no llegan a la aplicación, así que un cliente que
+        solo escucha (un espectador, una pestaña del lobby) parecería muerto: a
+        esos no se les exige nada aquí y sus sockets muertos los cierran los
+        pings de protocolo de uvicorn (cada 20 s, con 20 s para contestar: los
+        valores por defecto de --ws-ping-interval / --ws-ping-timeout).
+
+        El ping va en el protocolo de la conexión: trama PING a los clientes
+        binarios, JSON al resto.
+                """
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_SECONDS)
+            now = time.monotonic()
+            for username, connection in list(self.active_connections.items()):
+                if not connection.heartbeat:
+                    continue
+                idle = now - connection.last_seen
+                if idle >= WS_HEARTBEAT_SECONDS * WS_HEARTBEAT_MISSED_MAX:
+                    print(f"Desconectando a {username}: sin respuesta al latido")
+                    metricas.incrementar("ws.desconexiones_sin_latido")
+                    # 1001: "going away"
+                    self.disconnect(username, connection.websocket, 1001, "Sin respuesta al latido")
+                elif idle >= WS_HEARTBEAT_SECONDS:
+                    self._deliver(PING_FRAME, username, PING)
+
+    async def _release_user(self, username: str):
         if username in self.active_connections:
+            return  # ya se reconectó a este worker
+        await self.backplane.liberar(f"usuario:{username}")
+
+        # Remover de cola de matchmaking si está
+        await self.remove_from_matchmaking(username)
+
+        # Dejar de mirar la partida que estuviera mirando, y el lobby
+        await self.unspectate(username)
+        self.lobby_subscribers.discard(username)
+
+        # Si está en una partida, notificar al oponente (la partida puede ser de otro worker)
+        if username in self.user_to_game:
+            await self._player_left(username)
+        else:
+            await self.backplane.publicar(CANAL_TODOS, {"tipo": "desconectado", "usuario": username})
+
+    async def _player_left(self, username: str):
+        game_id = self.user_to_game[username]
+        # Con varios workers puede haberse reconectado en otro antes de que este cierre su socket viejo
+        if await self.is_online(username):
+            return
+        if game_id in self.active_games:
+            game = self.active_games[game_id]
+            opponent = None
+            if game.white_player == username:
+                opponent = game.black_player
+            elif game.black_player == username:
+                opponent = game.white_player
+            
+            if opponent:
+                await self.send_personal_message({
+                    "type": "opponent_disconnected",
+                    "message": f"{username} se ha desconectado"
+                }, opponent)
+            
+            # Pausar la partida: sigue en user_to_game para reengancharle si vuelve
+            if game.status == "active":
+                game.status = "paused"
+                self._stop_clock(game)
+                self._schedule_abandon(game)
+                diario_partidas.estado(game)
+                self._lobby_update(game)
+                await self._notify_spectators(game_id, {
+                    "type": "spectate_status", "game_id": game_id, "status": "paused"
+                })
+
+    async def _player_returned(self, username: str):
+        """Reengancha a un jugador que vuelve a su partida en pausa y la reanuda si están los dos"""
+        game_id = self.user_to_game[username]
+        game = self.active_games.get(game_id)
+        if game is None or game.status == "finished":
+            return
+        color = "white" if game.white_player == username else "black"
+        opponent = game.black_player if color == "white" else game.white_player
+
+        if game.status == "paused" and await self.is_online(opponent):
+            await self._resume_game(game)
+            await self.send_personal_message({
+                "type": "opponent_reconnected",
+                "message": f"{username} ha vuelto a la partida"
+            }, opponent)
+
+        await self._send_resumed(game, username)
+
+    async def _resume_game(self, game: PartidaViva):
+        """Reanuda una partida en pausa con los dos jugadores conectados"""
+        game.status = "active"
+        self.clocks.cancelar(f"abandono:{game.game_id}")
+        self._start_clock(game)
+        diario_partidas.estado(game)
+        self._lobby_update(game)
+        await self._notify_spectators(game.game_id, {
+            "type": "spectate_status", "game_id": game.game_id, "status": "active"
+        })
+
+    async def _send_resumed(self, game: PartidaViva, username: str):
+        """Estado completo de la partida para un jugador que se reengancha"""
+        color = "white" if game.white_player == username else "black"
+        await self.send_personal_message({
+            "type": "game_resumed",
+            "game_id": game.game_id,
+            "white_player": game.white_player,
+            "black_player": game.black_player,
+            "your_color": color,
+            "fen": game.current_fen,
+            "moves": game.san_moves(),
+            "current_turn": game.current_turn,
+            "clock": self._clock_view(game),
+            "status": game.status
+        }, username)
+
+    async def recover(self):
+        """
+        Rehidrata desde el diario las partidas que no terminaron (reinicio o caída).
+        Quedan en pausa hasta que vuelvan los dos jugadores; con varios workers,
+        cada partida la recupera el primero que la reclama.
+        """
+        recovered = 0
+        for doc in await diario_partidas.sin_terminar():
+            game_id = doc.pop("_id")
+            if game_id in self.active_games:
+                continue
+            if await self.backplane.reclamar(f"partida:{game_id}") != self.backplane.worker_id:
+                continue
             try:
-                await self.active_connections[username].send_text(json.dumps(message))
-            except:
-                # Conexión cerrada, limpiar
-                self.disconnect(username)
+                game = PartidaViva.desde_diario(game_id, doc)
+            except (ValueError, KeyError) as e:
+                print(f"No se pudo recuperar la partida {game_id}: {e}")
+                await self.backplane.liberar(f"partida:{game_id}")
+                continue
+
+            game.status = "paused"
+            self.active_games[game_id] = game
+            self.user_to_game[game.white_player] = game_id
+            self.user_to_game[game.black_player] = game_id
+            self._schedule_abandon(game)
+            diario_partidas.estado(game)
+            self._lobby_update(game)
+            recovered += 1
+        if recovered:
+            print(f"Recuperadas {recovered} partidas en vivo del diario")
+
+        # Terminadas cuyo guardado quedó a medias: se vuelven a encolar (el guardado es idempotente)
+        for doc in await diario_partidas.terminadas():
+            game_id = doc.pop("_id")
+            if await self.backplane.reclamar(f"partida:{game_id}") != self.backplane.worker_id:
+                continue
+            try:
+                guardado_partidas.encolar(PartidaViva.desde_diario(game_id, doc))
+            except (ValueError, KeyError) as e:
+                print(f"No se pudo guardar la partida terminada {game_id}: {e}")
+            await self.backplane.liberar(f"partida:{game_id}")
+
+    async def is_online(self, username: str) -> bool:
+        """Conectado a este o a cualquier otro worker"""
+        return username in self.active_connections or \
+            await self.backplane.dueno(f"usuario:{username}") is not None
 
-    async def send_game_message(self, message: dict, game_id: str):
-        """Envía un mensaje a todos los jugadores de una partida específica"""
+    def _deliver(self, text: str, username: str, packed: bytes = None) -> bool:
+        """
+        Encola el mensaje si el usuario está conectado a este worker; False si no lo está.
+        packed es la misma información en trama binaria, para quien negoció ese protocolo.
+        """
+        connection = self.active_connections.get(username)
+        if connection is None:
+            return False
+        if not connection.send(packed if connection.binary and packed is not None else text):
+            # Cliente que no lee: se descarta el mensaje o se le desconecta (luego puede reconectar)
+            if WS_SLOW_CONSUMER_POLICY == "drop":
+                connection.dropped += 1
+                metricas.incrementar("ws.mensajes_descartados")
+            else:
+                print(f"Desconectando a {username}: cola de salida llena")
+                metricas.incrementar("ws.desconexiones_cliente_lento")
+                # 1013: "try again later"
+                self.disconnect(username, connection.websocket, 1013, "Cliente demasiado lento")
+        return True
+
+    async def _forward(self, text: str, username: str, packed: bytes = None):
+        """Conectado a otro worker: se reenvía por el backplane"""
+        owner = await self.backplane.dueno(f"usuario:{username}")
+        if owner is not None and owner != self.backplane.worker_id:
+            await self.backplane.enviar_a_worker(owner, {
+                "tipo": "a_usuario", "usuario": username, "texto": text,
+                "binario": packed.hex() if packed is not None else None
+            })
+
+    async def _fanout(self, text: str, targets: Dict[str, str], packed: bytes = None):
+        """
+        Entrega el mismo texto a muchos usuarios de los que ya se conoce el worker
+        (p. ej. espectadores): encolado local y un solo mensaje por worker remoto
+        """
+        by_worker: Dict[str, list] = {}
+        for username, worker_id in targets.items():
+            if worker_id == self.backplane.worker_id:
+                self._deliver(text, username, packed)
+            else:
+                by_worker.setdefault(worker_id, []).append(username)
+        if by_worker:
+            hex_packed = packed.hex() if packed is not None else None
+            await asyncio.gather(*(
+                self.backplane.enviar_a_worker(worker_id, {
+                    "tipo": "a_usuarios", "usuarios": users, "texto": text, "binario": hex_packed
+                })
+                for worker_id, users in by_worker.items()
+            ))
+
+    async def send_text(self, text: str, username: str):
+        if not self._deliver(text, username):
+            await self._forward(text, username)
+
+    async def send_personal_message(self, message: dict, username: str):
+        await self.send_text(json.dumps(message), username)
+
+    async def send_game_message(self, message: dict, game_id: str, packed: bytes = None):
+        """
+        Envía un mensaje a todos los jugadores de una partida específica (se serializa
+        una vez por protocolo: JSON y, si se da, la trama binaria equivalente)
+        """
         if game_id in self.active_games:
             game = self.active_games[game_id]
-            players = [game["white_player"], game["black_player"]]
+            players = [game.white_player, game.black_player]
             
-            for player in players:
-                await self.send_personal_message(message, player)
+            text = json.dumps(message)
+            remote = [player for player in players if not self._deliver(text, player, packed)]
+            if remote:
+                await asyncio.gather(*(self._forward(text, player, packed) for player in remote))
 
-    def create_game(self, white_player: str, black_player: str, white_elo: int, black_elo: int) -> str:
-        """Crea una nueva partida"""
+    async def create_game(self, white_player: str, black_player: str, white_elo: int, black_elo: int) -> str:
+        """Crea una nueva partida (este worker queda como dueño)"""
         game_id = str(uuid.uuid4())
+        await self.backplane.reclamar(f"partida:{game_id}")
+        
+        game = PartidaViva(game_id, white_player, black_player, white_elo, black_elo,
+                           CLOCK_INITIAL_SECONDS, CLOCK_INCREMENT_SECONDS)
         
-        game_data = {
+        self.active_games[game_id] = game
+        self.user_to_game[white_player] = game_id
+        self.user_to_game[black_player] = game_id
+        self._start_clock(game)
+        diario_partidas.crear(game)
+        self._lobby_update(game)
+        
+        return game_id
+
+    async def start_game(self, white_player: str, black_player: str, white_elo: int, black_elo: int,
+                         is_private: bool = False) -> str:
+        """Crea la partida en este worker y avisa a ambos jugadores"""
+        game_id = await self.create_game(white_player, black_player, white_elo, black_elo)
+        
+        # Notificar a ambos jugadores
+        game_start_message = {
+            "type": "game_start",
             "game_id": game_id,
             "white_player": white_player,
             "black_player": black_player,
-            "white_elo": white_elo,
-            "black_elo": black_elo,
-            "current_turn": "white",
-            "moves": [],
-            "status": "active",
-            "result": "*",
-            "winner": None,
-            "time_control": {"white_time": 600, "black_time": 600},
-            "current_fen": STARTING_FEN,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "time_control": {
+                "initial": CLOCK_INITIAL_SECONDS,
+                "increment": CLOCK_INCREMENT_SECONDS
+            }
         }
+        if is_private:
+            game_start_message["is_private"] = True
         
-        self.active_games[game_id] = game_data
-        self.user_to_game[white_player] = game_id
-        self.user_to_game[black_player] = game_id
-        
+        await self.send_personal_message({**game_start_message, "your_color": "white"}, white_player)
+        await self.send_personal_message({**game_start_message, "your_color": "black"}, black_player)
         return game_id
 
+    async def remove_game(self, game_id: str, journal: bool = True):
+        """
+        Olvida una partida terminada y libera su propiedad en el backplane. Con
+        journal=False su entrada del diario la borra el guardado cuando la escribe.
+        """
+        game = self.active_games.pop(game_id, None)
+        self.spectators.pop(game_id, None)
+        self.turn_started.pop(game_id, None)
+        self.clocks.cancelar(game_id)
+        self.clocks.cancelar(f"abandono:{game_id}")
+        if game is not None:
+            for player in (game.white_player, game.black_player):
+                if self.user_to_game.get(player) == game_id:
+                    del self.user_to_game[player]
+            if journal:
+                diario_partidas.borrar(game_id)
+            self.lobby.quitar(game_id)
+        await self.backplane.liberar(f"partida:{game_id}")
+
     async def add_to_matchmaking(self, username: str, user_elo: int):
-        """Añade un jugador a la cola de matchmaking"""
-        if username not in self.matchmaking_queue:
-            self.matchmaking_queue.append(username)
-            
-            # Buscar oponente
-            opponent = self.find_opponent(username, user_elo)
-            if opponent:
-                await self.create_match(username, opponent, user_elo)
+        """Añade un jugador a la cola de matchmaking (la cola vive en un único worker)"""
+        owner = await self.backplane.reclamar("matchmaking")
+        if owner != self.backplane.worker_id:
+            await self.backplane.enviar_a_worker(owner, {
+                "tipo": "buscar_partida", "usuario": username, "elo": user_elo
+            })
+            return
 
-    def find_opponent(self, username: str, user_elo: int):
-        """Encuentra un oponente adecuado basado en ELO"""
-        elo_range = 200  # Rango de ELO aceptable
-        
-        for potential_opponent in self.matchmaking_queue:
-            if potential_opponent != username:
-                # Aquí deberías obtener el ELO del oponente desde la base de datos
-                # Por simplicidad, asumimos que está disponible
-                return potential_opponent
-        
-        return None
+        # El emparejamiento se hace en el siguiente tick, junto con el resto de la cola
+        self.matchmaking.agregar(username, user_elo)
 
-    async def create_match(self, player1: str, player2: str, player1_elo: int, player2_elo: int = 1200):
-        """Crea una partida entre dos jugadores"""
-        # Remover de la cola
-        if player1 in self.matchmaking_queue:
-            self.matchmaking_queue.remove(player1)
-        if player2 in self.matchmaking_queue:
-            self.matchmaking_queue.remove(player2)
-        
+    async def remove_from_matchmaking(self, username: str):
+        """Saca al jugador de la cola, esté en este worker o en el dueño de la cola"""
+        owner = await self.backplane.dueno("matchmaking")
+        if owner is None or owner == self.backplane.worker_id:
+            self.matchmaking.quitar(username)
+        else:
+            await self.backplane.enviar_a_worker(owner, {"tipo": "cancelar_busqueda", "usuario": username})
+
+    async def _matchmaking_loop(self):
+        """Tick periódico: empareja en bloque a los que esperan (solo en el worker dueño de la cola)"""
+        while True:
+            await asyncio.sleep(MATCHMAKING_TICK_SECONDS)
+            if not len(self.matchmaking):
+                continue
+            try:
+                for player1, elo1, player2, elo2 in self.matchmaking.emparejar():
+                    await self.create_match(player1, player2, elo1, elo2)
+            except Exception as e:
+                print(f"Error en el matchmaking: {e}")
+
+    async def create_match(self, player1: str, player2: str, player1_elo: int, player2_elo: int):
+        """Crea una partida entre dos jugadores (ya fuera de la cola)"""
         # Determinar colores aleatoriamente
-        import random
         if random.choice([True, False]):
             white_player, black_player = player1, player2
             white_elo, black_elo = player1_elo, player2_elo
@@ -138,19 +517,313 @@ class ConnectionManager:
             white_player, black_player = player2, player1
             white_elo, black_elo = player2_elo, player1_elo
         
-        game_id = self.create_game(white_player, black_player, white_elo, black_elo)
-        
-        # Notificar a ambos jugadores
-        game_start_message = {
-            "type": "game_start",
+        # La partida se crea en el worker de las blancas, no en el de la cola
+        owner = await self.backplane.dueno(f"usuario:{white_player}")
+        if owner is None or owner == self.backplane.worker_id:
+            await self.start_game(white_player, black_player, white_elo, black_elo)
+        else:
+            await self.backplane.enviar_a_worker(owner, {
+                "tipo": "crear_partida",
+                "white_player": white_player, "black_player": black_player,
+                "white_elo": white_elo, "black_elo": black_elo
+            })
+
+    async def route_game_event(self, game_id: str, event: dict, player: str):
+        """
+        Lleva una jugada, acción o chat al worker dueño de la partida.
+        event: {"type": "move", "move": ...}, {"type": "game_action", "action": ...}
+        o {"type": "chat", "message": ...}
+        """
+        if game_id in self.active_games:
+            await self._handle_game_event(game_id, event, player)
+            return
+
+        owner = await self.backplane.dueno(f"partida:{game_id}")
+        if owner is None or owner == self.backplane.worker_id:
+            if event["type"] == "unspectate":
+                return  # la partida ya no existe: no hay nada que dejar de mirar
+            if event["type"] == "spectate":
+                self.spectating.pop(player, None)
+            await self.send_personal_message({
+                "type": "error",
+                "message": "Partida no encontrada"
+            }, player)
+            return
+        await self.backplane.enviar_a_worker(owner, {
+            "tipo": "evento_partida", "game_id": game_id, "evento": event, "jugador": player
+        })
+
+    async def _handle_game_event(self, game_id: str, event: dict, player: str):
+        if event["type"] == "move":
+            await self.handle_move(game_id, event["move"], player)
+        elif event["type"] == "game_action":
+            await self.handle_game_action(game_id, event["action"], player)
+        elif event["type"] == "chat":
+            game = self.active_games.get(game_id)
+            if game is None:
+                return
+            if player not in (game.white_player, game.black_player):
+                await self.send_personal_message({
+                    "type": "error",
+                    "message": "No juegas esta partida"
+                }, player)
+                return
+            await self.send_game_message({
+                "type": "chat",
+                "player": player,
+                "message": event["message"]
+            }, game_id)
+        elif event["type"] == "spectate":
+            await self._add_spectator(game_id, player, event["worker"])
+        elif event["type"] == "unspectate":
+            self.spectators.get(game_id, {}).pop(player, None)
+
+    async def spectate(self, game_id: str, username: str):
+        """Empieza a mirar una partida (de este o de otro worker)"""
+        if self.spectating.get(username) == game_id:
+            return
+        await self.unspectate(username)
+        self.spectating[username] = game_id
+        await self.route_game_event(game_id, {"type": "spectate", "worker": self.backplane.worker_id}, username)
+
+    async def unspectate(self, username: str):
+        game_id = self.spectating.pop(username, None)
+        if game_id is not None:
+            await self.route_game_event(game_id, {"type": "unspectate"}, username)
+
+    async def _add_spectator(self, game_id: str, username: str, worker_id: str):
+        """
+        Registra al espectador y le envía una foto compacta de la partida; después
+        solo recibe deltas (spectate_move). Con "ply" puede detectar si se perdió
+        alguno y volver a pedir spectate para recibir otra foto.
+        """
+        game = self.active_games.get(game_id)
+        if game is None:
+            return
+        self.spectators.setdefault(game_id, {})[username] = worker_id
+        snapshot = {
+            "type": "spectate_snapshot",
             "game_id": game_id,
-            "white_player": white_player,
-            "black_player": black_player,
-            "your_color": "white" if white_player == player1 else "black"
+            "white_player": game.white_player,
+            "black_player": game.black_player,
+            "white_elo": game.white_elo,
+            "black_elo": game.black_elo,
+            "fen": game.current_fen,
+            "moves": game.san_moves(),
+            "ply": len(game.moves),
+            "current_turn": game.current_turn,
+            "clock": self._clock_view(game),
+            "status": game.status,
+            "result": game.result,
+            "winner": game.winner,
+            "spectators": len(self.spectators[game_id])
         }
-        
-        await self.send_personal_message({**game_start_message, "your_color": "white"}, white_player)
-        await self.send_personal_message({**game_start_message, "your_color": "black"}, black_player)
+        await self._fanout(json.dumps(snapshot), {username: worker_id})
+
+    async def _notify_spectators(self, game_id: str, message: dict, packed: bytes = None):
+        targets = self.spectators.get(game_id)
+        if targets:
+            await self._fanout(json.dumps(message), targets, packed)
+
+    def _lobby_update(self, game: PartidaViva):
+        self.lobby.actualizar({
+            "game_id": game.game_id,
+            "white_player": game.white_player,
+            "black_player": game.black_player,
+            "white_elo": game.white_elo,
+            "black_elo": game.black_elo,
+            "status": game.status,
+            "moves_count": len(game.moves)
+        })
+
+    async def subscribe_lobby(self, username: str):
+        """Foto del lobby completo y, después, solo los cambios cada LOBBY_PUSH_MS"""
+        self.lobby_subscribers.add(username)
+        await self.send_personal_message({
+            "type": "lobby_snapshot",
+            "version": self.lobby.version,
+            "games": self.lobby.todas()
+        }, username)
+
+    def unsubscribe_lobby(self, username: str):
+        self.lobby_subscribers.discard(username)
+
+    async def _lobby_loop(self):
+        """
+        Cada LOBBY_PUSH_MS: cuenta a los demás workers los cambios de sus partidas y
+        envía a los suscriptores de este worker un único lobby_delta con todo lo acumulado
+        """
+        while True:
+            await asyncio.sleep(LOBBY_PUSH_MS / 1000)
+            try:
+                updated, removed = self.lobby.tomar_cambios_locales()
+                if updated or removed:
+                    await self.backplane.publicar(CANAL_TODOS, {
+                        "tipo": "lobby_delta", "actualizadas": updated, "quitadas": removed
+                    })
+                updated, removed = self.lobby.tomar_cambios()
+                if (updated or removed) and self.lobby_subscribers:
+                    text = json.dumps({
+                        "type": "lobby_delta",
+                        "version": self.lobby.version,
+                        "updated": updated,
+                        "removed": removed
+                    })
+                    for username in list(self.lobby_subscribers):
+                        if not self._deliver(text, username):
+                            self.lobby_subscribers.discard(username)
+            except Exception as e:
+                print(f"Error al difundir el lobby: {e}")
+
+    async def _on_backplane_message(self, mensaje: dict):
+        """Mensajes que otros workers envían a este"""
+        tipo = mensaje.get("tipo")
+        if tipo in ("a_usuario", "a_usuarios"):
+            packed = bytes.fromhex(mensaje["binario"]) if mensaje.get("binario") else None
+            for username in mensaje["usuarios"] if tipo == "a_usuarios" else [mensaje["usuario"]]:
+                self._deliver(mensaje["texto"], username, packed)
+        elif tipo == "evento_partida":
+            await self._handle_game_event(mensaje["game_id"], mensaje["evento"], mensaje["jugador"])
+        elif tipo == "buscar_partida":
+            await self.add_to_matchmaking(mensaje["usuario"], mensaje["elo"])
+        elif tipo == "cancelar_busqueda":
+            self.matchmaking.quitar(mensaje["usuario"])
+        elif tipo == "crear_partida":
+            await self.start_game(mensaje["white_player"], mensaje["black_player"],
+                                  mensaje["white_elo"], mensaje["black_elo"])
+        elif tipo == "desconectado":
+            # Un jugador de una partida de este worker se fue de otro worker
+            if mensaje["usuario"] in self.user_to_game and mensaje["usuario"] not in self.active_connections:
+                await self._player_left(mensaje["usuario"])
+        elif tipo == "lobby_delta":
+            # Cambios en las partidas de otro worker
+            for entry in mensaje["actualizadas"]:
+                self.lobby.actualizar(entry, local=False)
+            for game_id in mensaje["quitadas"]:
+                self.lobby.quitar(game_id, local=False)
+        elif tipo == "lobby_sync":
+            # Un worker recién arrancado pide las partidas de este
+            games = [entry for entry in self.lobby.todas() if entry["game_id"] in self.active_games]
+            if games:
+                await self.backplane.enviar_a_worker(mensaje["worker"], {
+                    "tipo": "lobby_delta", "actualizadas": games, "quitadas": []
+                })
+        elif tipo == "conectado":
+            username = mensaje["usuario"]
+            # La última conexión manda: si aún tiene aquí un socket viejo, se cierra como en connect
+            connection = self.active_connections.get(username)
+            if connection is not None and await self.backplane.dueno(f"usuario:{username}") != self.backplane.worker_id:
+                self.disconnect(username, connection.websocket, reason="Sesión abierta en otra conexión")
+            # Un jugador de una partida de este worker volvió, conectado a otro worker
+            if username in self.user_to_game:
+                await self._player_returned(username)
+
+    def _start_clock(self, game: PartidaViva):
+        """Pone en marcha el reloj del jugador al que le toca y programa su caída de bandera"""
+        now = time.monotonic()
+        self.turn_started[game.game_id] = now
+        remaining = getattr(game, f"{game.current_turn}_time")
+        self.clocks.programar(game.game_id, now + remaining)
+
+    def _stop_clock(self, game: PartidaViva):
+        """Para el reloj en marcha descontando lo consumido en el turno"""
+        started = self.turn_started.pop(game.game_id, None)
+        self.clocks.cancelar(game.game_id)
+        if started is not None:
+            key = f"{game.current_turn}_time"
+            setattr(game, key, max(0.0, getattr(game, key) - (time.monotonic() - started)))
+
+    def _clock_view(self, game: PartidaViva) -> dict:
+        """Tiempos restantes en este instante (el del turno actual descontando lo que lleva)"""
+        clock = {"white_time": game.white_time, "black_time": game.black_time}
+        started = self.turn_started.get(game.game_id)
+        if started is not None:
+            key = f"{game.current_turn}_time"
+            clock[key] = max(0.0, clock[key] - (time.monotonic() - started))
+        return {key: round(value, 3) for key, value in clock.items()}
+
+    def _schedule_abandon(self, game: PartidaViva):
+        """
+        Plazo para volver a una partida en pausa (en el mismo planificador que los
+        relojes, que con la pausa están parados): sin él, quien va perdiendo
+        podría desconectarse y dejar la partida congelada para siempre
+        """
+        self.clocks.programar(f"abandono:{game.game_id}", time.monotonic() + GAME_ABANDON_SECONDS)
+
+    async def _on_timer(self, key: str):
+        if key.startswith("abandono:"):
+            await self._on_abandon(key[len("abandono:"):])
+        else:
+            await self._on_flag(key)
+
+    async def _on_abandon(self, game_id: str):
+        """Venció el plazo de una partida en pausa: pierde quien no ha vuelto (tablas si no volvió ninguno)"""
+        game = self.active_games.get(game_id)
+        if game is None or game.status != "paused":
+            return
+        white_online = await self.is_online(game.white_player)
+        black_online = await self.is_online(game.black_player)
+        if white_online and black_online:
+            # Los dos volvieron sin que nadie la reanudara (p. ej. reconexión en otro worker durante la pausa)
+            await self._resume_game(game)
+            for player in (game.white_player, game.black_player):
+                await self._send_resumed(game, player)
+            return
+        if white_online:
+            await self._end_game(game, "1-0", game.white_player, "abandonment")
+        elif black_online:
+            await self._end_game(game, "0-1", game.black_player, "abandonment")
+        else:
+            await self._end_game(game, "1/2-1/2", None, "abandonment")
+
+    async def _on_flag(self, game_id: str):
+        """El planificador avisa de que al jugador en turno se le acabó el tiempo"""
+        game = self.active_games.get(game_id)
+        if game is None or game.status != "active":
+            return
+        self._stop_clock(game)
+        loser = game.current_turn
+        winner_color = chess.BLACK if loser == "white" else chess.WHITE
+        # Sin material para dar mate, quedarse sin tiempo es tablas
+        if game.board.board.has_insufficient_material(winner_color):
+            game.result, game.winner = "1/2-1/2", None
+            game.end_reason = "timeout_vs_insufficient_material"
+        elif winner_color == chess.WHITE:
+            game.result, game.winner = "1-0", game.white_player
+            game.end_reason = "timeout"
+        else:
+            game.result, game.winner = "0-1", game.black_player
+            game.end_reason = "timeout"
+        await self._end_game(game)
+
+    async def _end_game(self, game: PartidaViva, result: str = None, winner: str = None, reason: str = None):
+        """
+        Termina la partida fuera de una jugada (abandono, reloj, tablas reclamadas):
+        avisa a jugadores y espectadores y la manda a guardar
+        """
+        if result is not None:
+            game.result, game.winner, game.end_reason = result, winner, reason
+        game.status = "finished"
+        game.updated_ts = time.time()
+        self._stop_clock(game)
+        diario_partidas.estado(game)
+        self._lobby_update(game)
+
+        end_message = {
+            "type": "game_end",
+            "result": game.result,
+            "winner": game.winner,
+            "reason": game.end_reason,
+            "clock": self._clock_view(game)
+        }
+        await self.send_game_message(end_message, game.game_id)
+        await self._notify_spectators(game.game_id, {**end_message, "type": "spectate_end", "game_id": game.game_id})
+        await self._finish_game(game)
+
+    async def _finish_game(self, game: PartidaViva):
+        """Partida terminada: al guardado en segundo plano y fuera de memoria ya"""
+        guardado_partidas.encolar(game)
+        await self.remove_game(game.game_id, journal=False)
 
     async def handle_move(self, game_id: str, move_data: dict, player: str):
         """Procesa un movimiento en una partida"""
@@ -158,11 +831,26 @@ class ConnectionManager:
             return False
         
         game = self.active_games[game_id]
+        board = game.board
+
+        if game.status == "finished":
+            await self.send_personal_message({
+                "type": "error",
+                "message": "La partida ha terminado"
+            }, player)
+            return False
+
+        if game.status == "paused":
+            await self.send_personal_message({
+                "type": "error",
+                "message": "La partida está en pausa hasta que vuelva tu oponente"
+            }, player)
+            return False
         
         # Verificar que es el turno del jugador
-        current_color = game["current_turn"]
-        if (current_color == "white" and player != game["white_player"]) or \
-           (current_color == "black" and player != game["black_player"]):
+        current_color = game.current_turn
+        if (current_color == "white" and player != game.white_player) or \
+           (current_color == "black" and player != game.black_player):
             await self.send_personal_message({
                 "type": "error",
                 "message": "No es tu turno"
@@ -177,36 +865,90 @@ class ConnectionManager:
             }, player)
             return False
         
-        # Agregar el movimiento
-        game["moves"].append(move_data)
-        game["current_turn"] = "black" if current_color == "white" else "white"
-        game["current_fen"] = move_data.get("fen", game["current_fen"])
-        game["updated_at"] = datetime.utcnow()
-        
-        # Verificar si la partida terminó
-        if "checkmate" in move_data.get("san", "").lower() or "mate" in move_data.get("san", "").lower():
-            game["status"] = "finished"
-            if current_color == "white":
-                game["result"] = "1-0"
-                game["winner"] = game["white_player"]
-            else:
-                game["result"] = "0-1"
-                game["winner"] = game["black_player"]
+        # El reloj lo mide el servidor: si la bandera cayó y el planificador aún no lo vio, la jugada no vale
+        time_key = f"{current_color}_time"
+        remaining = getattr(game, time_key) - (time.monotonic() - self.turn_started[game_id])
+        if remaining <= 0:
+            await self._on_flag(game_id)
+            return False
+
+        # Validar legalidad con el tablero del servidor (no se confía en el fen del cliente)
+        try:
+            move = board.leer_jugada(move_data["from_square"], move_data["to_square"], move_data.get("promotion"))
+        except ValueError as e:
+            await self.send_personal_message({
+                "type": "error",
+                "message": str(e)
+            }, player)
+            return False
+
+        # Aplicar y anotar el movimiento (el turno pasa al rival con el tablero)
+        piece = board.board.piece_at(move.from_square).symbol().upper()
+        san = game.jugar(move)
+        setattr(game, time_key, remaining + game.increment)
+        move_data = {
+            "from_square": move_data["from_square"],
+            "to_square": move_data["to_square"],
+            "piece": piece,
+            "promotion": chess.piece_symbol(move.promotion).upper() if move.promotion else None,
+            "san": san,
+            "fen": board.fen()
+        }
+        
+        # Verificar si la partida terminó (mate, ahogado, material, quíntuple repetición, 75 jugadas)
+        final = board.estado_final()
+        if final:
+            game.status = "finished"
+            game.result, game.end_reason = final
+            if game.result == "1-0":
+                game.winner = game.white_player
+            elif game.result == "0-1":
+                game.winner = game.black_player
+            self.turn_started.pop(game_id, None)
+            self.clocks.cancelar(game_id)
+        else:
+            self._start_clock(game)
+
+        # Al diario en segundo plano: el envío no espera a MongoDB
+        diario_partidas.jugada(game, move_data)
+        self._lobby_update(game)
         
         # Enviar movimiento a ambos jugadores
         move_message = {
             "type": "move",
             "move": move_data,
             "player": player,
-            "current_turn": game["current_turn"],
-            "game_status": game["status"]
+            "current_turn": game.current_turn,
+            "clock": self._clock_view(game),
+            "game_status": game.status
         }
         
-        if game["status"] == "finished":
-            move_message["result"] = game["result"]
-            move_message["winner"] = game["winner"]
+        if game.status == "finished":
+            move_message["result"] = game.result
+            move_message["winner"] = game.winner
+            move_message["reason"] = game.end_reason
+
+        # La misma jugada en trama binaria (sin FEN: jugada empaquetada y hash Zobrist), una sola vez
+        packed = codificar_jugada(game_id, len(game.moves), move, move_message["clock"], board.hash,
+                                  game.status, game.current_turn, game.result, game.end_reason)
         
-        await self.send_game_message(move_message, game_id)
+        await self.send_game_message(move_message, game_id, packed)
+
+        # Delta para los espectadores: solo la jugada, no la partida entera
+        delta = {
+            "type": "spectate_move",
+            "game_id": game_id,
+            "ply": len(game.moves),
+            "san": san,
+            "uci": move.uci(),
+            "clock": move_message["clock"]
+        }
+        if game.status == "finished":
+            delta["result"] = game.result
+            delta["reason"] = game.end_reason
+        await self._notify_spectators(game_id, delta, packed)
+        if game.status == "finished":
+            await self._finish_game(game)
         return True
 
     async def handle_game_action(self, game_id: str, action: str, player: str):
@@ -215,31 +957,40 @@ class ConnectionManager:
             return
         
         game = self.active_games[game_id]
+
+        # Solo los dos jugadores: un espectador no puede rendir ni pedir tablas por nadie
+        if player not in (game.white_player, game.black_player):
+            await self.send_personal_message({
+                "type": "error",
+                "message": "No juegas esta partida"
+            }, player)
+            return
         
         if action == "resign":
             # El jugador se rinde
-            game["status"] = "finished"
-            if player == game["white_player"]:
-                game["result"] = "0-1"
-                game["winner"] = game["black_player"]
+            if player == game.white_player:
+                await self._end_game(game, "0-1", game.black_player, "resignation")
             else:
-                game["result"] = "1-0"
-                game["winner"] = game["white_player"]
-            
-            await self.send_game_message({
-                "type": "game_end",
-                "result": game["result"],
-                "winner": game["winner"],
-                "reason": "resignation"
-            }, game_id)
+                await self._end_game(game, "1-0", game.white_player, "resignation")
+
+        elif action == "claim_draw":
+            # Triple repetición y 50 jugadas no terminan la partida solas: hay que reclamarlas
+            reason = game.board.tablas_reclamables() if game.status == "active" else None
+            if reason is None:
+                await self.send_personal_message({
+                    "type": "error",
+                    "message": "No se pueden reclamar tablas en esta posición"
+                }, player)
+                return
+            await self._end_game(game, "1/2-1/2", None, reason)
         
         elif action == "offer_draw":
             # Ofrecer tablas
-            opponent = game["black_player"] if player == game["white_player"] else game["white_player"]
+            opponent = game.black_player if player == game.white_player else game.white_player
             await self.send_personal_message({
                 "type": "draw_offer",
                 "from": player
             }, opponent)
 
 # Instancia global del manager
-manager = ConnectionManager()
+manager = ConnectionManager(crear_backplane(BACKPLANE_URL))